@@ -1,5 +1,6 @@
 from glob import glob
 import random
+import time
 from sys import maxsize
 
 
@@ -12,10 +13,109 @@ pieceScore = {
     "p": 1
 }
 
+# Piece-square tables from white's point of view (row 0 is the 8th rank).
+# Black pieces read them mirrored, at row 7 - r.
+knightScores = [
+    [1, 1, 1, 1, 1, 1, 1, 1],
+    [1, 2, 2, 2, 2, 2, 2, 1],
+    [1, 2, 3, 3, 3, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 3, 3, 3, 2, 1],
+    [1, 2, 2, 2, 2, 2, 2, 1],
+    [1, 1, 1, 1, 1, 1, 1, 1]
+]
+
+bishopScores = [
+    [4, 3, 2, 1, 1, 2, 3, 4],
+    [3, 4, 3, 2, 2, 3, 4, 3],
+    [2, 3, 4, 3, 3, 4, 3, 2],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [2, 3, 4, 3, 3, 4, 3, 2],
+    [3, 4, 3, 2, 2, 3, 4, 3],
+    [4, 3, 2, 1, 1, 2, 3, 4]
+]
+
+queenScores = [
+    [1, 1, 1, 3, 1, 1, 1, 1],
+    [1, 2, 3, 3, 3, 1, 1, 1],
+    [1, 4, 3, 3, 3, 4, 2, 1],
+    [1, 2, 3, 3, 3, 2, 2, 1],
+    [1, 2, 3, 3, 3, 2, 2, 1],
+    [1, 4, 3, 3, 3, 4, 2, 1],
+    [1, 1, 2, 3, 3, 1, 1, 1],
+    [1, 1, 1, 3, 1, 1, 1, 1]
+]
+
+rookScores = [
+    [4, 3, 4, 4, 4, 4, 3, 4],
+    [4, 4, 4, 4, 4, 4, 4, 4],
+    [1, 1, 2, 3, 3, 2, 1, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 1, 2, 2, 2, 2, 1, 1],
+    [4, 4, 4, 4, 4, 4, 4, 4],
+    [4, 3, 4, 4, 4, 4, 3, 4]
+]
+
+pawnScores = [
+    [8, 8, 8, 8, 8, 8, 8, 8],
+    [8, 8, 8, 8, 8, 8, 8, 8],
+    [5, 6, 6, 7, 7, 6, 6, 5],
+    [2, 3, 3, 5, 5, 3, 3, 2],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 1, 2, 3, 3, 2, 1, 1],
+    [1, 1, 1, 0, 0, 1, 1, 1],
+    [0, 0, 0, 0, 0, 0, 0, 0]
+]
+
+kingScores = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [1, 1, 0, 0, 0, 0, 1, 1],
+    [2, 3, 2, 0, 0, 1, 3, 2]
+]
+
+POSITION_WEIGHT = 0.1  # How much one point of a piece-square table is worth in pawns
+
+piecePositionScores = {
+    piece: [[POSITION_WEIGHT * score for score in row] for row in table]
+    for piece, table in (
+        ("N", knightScores), ("B", bishopScores), ("Q", queenScores),
+        ("R", rookScores), ("p", pawnScores), ("K", kingScores)
+    )
+}
+
+# Weights fitted by ChessTune.py replace the hand-picked ones when they have been written
+try:
+    from ChessWeights import pieceScore, piecePositionScores
+except ImportError:
+    pass
+
 CHECKMATE = 1000
 STALEMATE = 0
 DEPTH = 4
 
+searchDepth = DEPTH  # Depth of the alpha-beta search running now, so it can tell the root apart
+searchDeadline = None  # time.perf_counter() value at which a timed search gives up
+searchNodeLimit = None  # Node count at which a budgeted search gives up
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# Transposition table: position hash -> (depth, score, bound, move code).
+# Scores are from the point of view of the side to move in that position.
+EXACT, LOWERBOUND, UPPERBOUND = 0, 1, 2
+MAX_TABLE_ENTRIES = 1 << 20
+transpositionTable = {}
+
 
 def findRandomMove(validMoves):
     """
@@ -95,7 +195,11 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
         maxScore = -CHECKMATE
         for move in validMoves:
             gs.makeMove(move)
-            nextMoves = gs.getValidMoves()
+            if depth > 1:
+                nextMoves = gs.getValidMoves()
+            else:
+                nextMoves = None
+                gs.updateGameOver()
             score = findMoveMinMax(gs, nextMoves, depth - 1, False)
             if score > maxScore:
                 maxScore = score
@@ -107,7 +211,11 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
         minScore = CHECKMATE
         for move in validMoves:
             gs.makeMove(move)
-            nextMoves = gs.getValidMoves()
+            if depth > 1:
+                nextMoves = gs.getValidMoves()
+            else:
+                nextMoves = None
+                gs.updateGameOver()
             score = findMoveMinMax(gs, nextMoves, depth - 1, True)
             if score < minScore:
                 minScore = score
@@ -131,13 +239,106 @@ def scoreBoard(gs):
 
     board = gs.board
     score = 0
-    for row in board:
-        for square in row:
+    for row in range(8):
+        for col in range(8):
+            square = board[row][col]
             if square[0] == "w":
-                score += pieceScore[square[1]]
+                score += pieceScore[square[1]] + \
+                    piecePositionScores[square[1]][row][col]
             elif square[0] == "b":
-                score -= pieceScore[square[1]]
+                score -= pieceScore[square[1]] + \
+                    piecePositionScores[square[1]][7 - row][col]
+
+    return score + scorePawnStructure(gs)
+
+
+# Pawn structure terms in pawns, for the side owning the pawn
+DOUBLED_PAWN = -0.2  # Per extra pawn on a file
+ISOLATED_PAWN = -0.15  # No friendly pawn on either neighbouring file
+BACKWARD_PAWN = -0.1  # Can't be supported by a pawn and its stop square is attacked by one
+PASSED_PAWN = [0, 0.1, 0.15, 0.25, 0.4, 0.6, 0.9]  # By squares advanced from the starting rank
+
+PAWN_TABLE_SIZE = 1 << 14  # Slots in the pawn hash table, a power of two
+
+
+class PawnHashTable():
+    """
+    Fixed-size table of pawn structure scores indexed by the low bits of the pawn hash.
+    A new entry always replaces whatever was in its slot.
+    """
+
+    def __init__(self, size=PAWN_TABLE_SIZE):
+        self.mask = size - 1
+        self.keys = [None] * size
+        self.scores = [0] * size
+        self.hits = 0
+        self.misses = 0
+
+    def probe(self, key):
+        i = key & self.mask
+        if self.keys[i] == key:
+            self.hits += 1
+            return self.scores[i]
+        self.misses += 1
+        return None
 
+    def store(self, key, score):
+        i = key & self.mask
+        self.keys[i] = key
+        self.scores[i] = score
+
+    def clear(self):
+        self.keys = [None] * len(self.keys)
+        self.hits = 0
+        self.misses = 0
+
+
+pawnTable = PawnHashTable()
+
+
+def scorePawnStructure(gs):
+    """
+    Pawn structure score, positive good for white, cached in pawnTable by gs.pawnHash
+    """
+    score = pawnTable.probe(gs.pawnHash)
+    if score is None:
+        score = evaluatePawnStructure(gs.board)
+        pawnTable.store(gs.pawnHash, score)
+    return score
+
+
+def evaluatePawnStructure(board):
+    """
+    Doubled, isolated, backward and passed pawns; depends on the pawns alone
+    """
+    pawns = {'w': [[] for _ in range(8)], 'b': [[] for _ in range(8)]}  # Rows of each color's pawns per file
+    for row in range(8):
+        for col in range(8):
+            if board[row][col][1] == 'p':
+                pawns[board[row][col][0]][col].append(row)
+
+    score = 0
+    for color, forward, sign in (('w', -1, 1), ('b', 1, -1)):
+        own = pawns[color]
+        enemy = pawns['b' if color == 'w' else 'w']
+        for col in range(8):
+            if len(own[col]) > 1:
+                score += sign * DOUBLED_PAWN * (len(own[col]) - 1)
+            neighbours = [c for c in (col - 1, col + 1) if 0 <= c < 8]
+            for row in own[col]:
+                if not any(own[c] for c in neighbours):
+                    score += sign * ISOLATED_PAWN
+                else:
+                    # Every friendly pawn on a neighbouring file is already ahead of this one
+                    supportable = any((r - row) * forward <= 0 for c in neighbours for r in own[c])
+                    stop = row + forward
+                    stopAttacked = any(r == stop + forward for c in neighbours for r in enemy[c])
+                    if not supportable and stopAttacked:
+                        score += sign * BACKWARD_PAWN
+                # Passed: no enemy pawn ahead on this or a neighbouring file
+                if not any((r - row) * forward > 0 for c in [col] + neighbours for r in enemy[c]):
+                    advanced = 6 - row if color == 'w' else row - 1
+                    score += sign * PASSED_PAWN[advanced]
     return score
 
 
@@ -164,7 +365,12 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
     random.shuffle(validMoves)
     for move in validMoves:
         gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
+        if depth > 1:
+            nextMoves = gs.getValidMoves()
+        else:
+            # Children are leaves: only need to know whether the game is over
+            nextMoves = None
+            gs.updateGameOver()
         score = -findMoveNegaMax(gs, nextMoves, depth - 1, -turnMultiplier)
         if score > maxScore:
             maxScore = score
@@ -174,13 +380,14 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
     return maxScore
 
 
-def findBestMoveNegaMaxAlphaBeta(gs, validMoves):
-    global nextMove, counter
+def findBestMoveNegaMaxAlphaBeta(gs, validMoves, depth=DEPTH):
+    global nextMove, counter, searchDepth
     nextMove = None
     counter = 0
+    searchDepth = depth
     findMoveNegaMaxAlphaBeta(
         gs, validMoves,
-        DEPTH,
+        depth,
         -CHECKMATE, CHECKMATE,
         1 if gs.whiteToMove else -1
     )
@@ -191,6 +398,8 @@ def findBestMoveNegaMaxAlphaBeta(gs, validMoves):
 def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
     global nextMove, counter
     counter += 1
+    if counter & 1023 == 0 and searchOutOfBudget():
+        raise SearchTimeout()
 
     if depth == 0:
         return turnMultiplier * scoreBoard(gs)
@@ -199,7 +408,12 @@ def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier)
     random.shuffle(validMoves)
     for move in validMoves:
         gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
+        if depth > 1:
+            nextMoves = gs.getValidMoves()
+        else:
+            # Children are leaves: only need to know whether the game is over
+            nextMoves = None
+            gs.updateGameOver()
         score = -findMoveNegaMaxAlphaBeta(
             gs, nextMoves,
             depth - 1,
@@ -208,7 +422,7 @@ def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier)
         )
         if score > maxScore:
             maxScore = score
-            if depth == DEPTH:
+            if depth == searchDepth:
                 nextMove = move
         gs.undoMove()
         if maxScore > alpha:
@@ -216,3 +430,172 @@ def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier)
         if alpha >= beta:
             break
     return maxScore
+
+
+def searchOutOfBudget():
+    # Checked every 1024 nodes by the searches that can be interrupted
+    return (searchDeadline is not None and time.perf_counter() > searchDeadline) or \
+        (searchNodeLimit is not None and counter >= searchNodeLimit)
+
+
+def findBestMoveTimed(gs, validMoves, timeLimit, maxDepth=DEPTH):
+    """
+    Iterative deepening alpha-beta.
+    Returns the move of the deepest search that finished within timeLimit seconds
+    """
+    global searchDeadline
+    bestMove = None
+    ply = gs.ply
+    searchDeadline = time.perf_counter() + timeLimit
+    try:
+        for depth in range(1, maxDepth + 1):
+            move = findBestMoveNegaMaxAlphaBeta(gs, validMoves, depth)
+            if move is not None:  # None when every move loses to mate; keep the shallower choice
+                bestMove = move
+    except SearchTimeout:
+        while gs.ply > ply:  # Take back the moves the interrupted search had made
+            gs.undoMove()
+    finally:
+        searchDeadline = None
+    return bestMove
+
+
+def findBestMovesMultiPV(gs, validMoves, k=3, depth=DEPTH, nodes=None, timeLimit=None):
+    """
+    The k best moves as [(score, principal variation)], best first.
+    Scores are from the point of view of the side to move.
+    Iterative deepening: each iteration searches root moves in the order of the last one's
+    scores, and once k moves have exact scores the rest are only tested against the k-th best
+    with a null window, re-searched in full only if they beat it.
+    With a budget of nodes and/or timeLimit seconds, returns the deepest iteration that
+    finished within it (an empty list if not even depth 1 did).
+    """
+    global counter, searchDeadline, searchNodeLimit
+    counter = 0
+    searchNodeLimit = nodes
+    searchDeadline = time.perf_counter() + timeLimit if timeLimit is not None else None
+    turnMultiplier = 1 if gs.whiteToMove else -1
+    rootScores = {}  # move code -> score (exact or upper bound) from the last iteration
+    finished = []  # best of the deepest finished iteration
+    finishedDepth = 0
+    ply = gs.ply
+    try:
+        for d in range(1, depth + 1):
+            ordered = sorted(validMoves, key=lambda move: rootScores.get(move.getCode(), 0), reverse=True)
+            best = []  # (score, move) of moves with exact scores, best first
+            for move in ordered:
+                gs.makeMove(move)
+                if len(best) < k:
+                    score = -findMovePV(gs, d - 1, -CHECKMATE - 1, CHECKMATE + 1, -turnMultiplier)
+                else:
+                    threshold = best[k - 1][0]
+                    score = -findMovePV(gs, d - 1, -threshold - NULL_WINDOW, -threshold, -turnMultiplier)
+                    if score > threshold:  # Enters the top k: get its exact score
+                        score = -findMovePV(gs, d - 1, -CHECKMATE - 1, -threshold, -turnMultiplier)
+                gs.undoMove()
+                rootScores[move.getCode()] = score
+                if len(best) < k or score > best[k - 1][0]:
+                    best.append((score, move))
+                    best.sort(key=lambda entry: entry[0], reverse=True)
+                    del best[k:]
+            finished = best
+            finishedDepth = d
+    except SearchTimeout:
+        while gs.ply > ply:  # Take back the moves the interrupted search had made
+            gs.undoMove()
+    finally:
+        searchDeadline = searchNodeLimit = None
+    return [(score, principalVariation(gs, move, finishedDepth)) for score, move in finished]
+
+
+NULL_WINDOW = 1e-6  # Smaller than any difference in evaluation
+
+
+def findMovePV(gs, depth, alpha, beta, turnMultiplier):
+    """
+    Fail-soft alpha-beta that stores every result in transpositionTable and
+    tries the stored best move first
+    """
+    global counter
+    counter += 1
+    if counter & 1023 == 0 and searchOutOfBudget():
+        raise SearchTimeout()
+    alphaOriginal = alpha
+    entry = transpositionTable.get(gs.hash)
+    ttMove = None
+    if entry is not None:
+        ttDepth, ttScore, ttBound, ttMove = entry
+        if ttDepth >= depth:
+            if ttBound == EXACT or \
+                    (ttBound == LOWERBOUND and ttScore >= beta) or \
+                    (ttBound == UPPERBOUND and ttScore <= alpha):
+                return ttScore
+
+    if depth == 0:
+        gs.updateGameOver()
+        return turnMultiplier * scoreBoard(gs)
+
+    validMoves = gs.getValidMoves()
+    if gs.checkmate or gs.stalemate:
+        return turnMultiplier * scoreBoard(gs)
+    if ttMove is not None:
+        for i in range(len(validMoves)):
+            if validMoves[i].getCode() == ttMove:
+                validMoves[0], validMoves[i] = validMoves[i], validMoves[0]
+                break
+
+    maxScore = -CHECKMATE - 1
+    bestMove = None
+    for move in validMoves:
+        gs.makeMove(move)
+        score = -findMovePV(gs, depth - 1, -beta, -alpha, -turnMultiplier)
+        gs.undoMove()
+        if score > maxScore:
+            maxScore = score
+            bestMove = move
+        if maxScore > alpha:
+            alpha = maxScore
+        if alpha >= beta:
+            break
+
+    if maxScore <= alphaOriginal:
+        bound = UPPERBOUND
+    elif maxScore >= beta:
+        bound = LOWERBOUND
+    else:
+        bound = EXACT
+    if len(transpositionTable) >= MAX_TABLE_ENTRIES:
+        transpositionTable.clear()
+    transpositionTable[gs.hash] = (depth, maxScore, bound, bestMove.getCode())
+    return maxScore
+
+
+def principalVariation(gs, move, depth):
+    """
+    move followed by the best replies stored in transpositionTable, up to depth moves
+    """
+    line = [move]
+    gs.makeMove(move)
+    while len(line) < depth:
+        entry = transpositionTable.get(gs.hash)
+        if entry is None:
+            break
+        for reply in gs.getValidMoves():
+            if reply.getCode() == entry[3]:
+                break
+        else:
+            break
+        line.append(reply)
+        gs.makeMove(reply)
+    for _ in line:
+        gs.undoMove()
+    return line
+
+
+def findBestMove(gs, validMoves, returnQueue):
+    """
+    Entry point for searching in a separate process.
+    Puts the move found on returnQueue
+    """
+    gs.enableIncrementalMoves()  # gs is this process's own copy, so keeping move lists on it is safe
+    returnQueue.put(findBestMoveNegaMaxAlphaBeta(gs, validMoves))
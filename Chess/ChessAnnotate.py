@@ -0,0 +1,195 @@
+"""
+Annotates every game of a PGN file with engine evaluations.
+
+Each position of a game is searched by ChessAI under a node and/or time budget in a process pool.
+After every move the output carries the evaluation from white's point of view in pawns and, when
+the engine preferred another move, that move. A move that loses more than the blunder threshold
+is marked ??. Games are written in input order as soon as all of their positions are analysed, and
+only a bounded number of games is in flight, so memory stays flat however long the file is.
+
+    python ChessAnnotate.py games.pgn --out annotated.pgn --nodes 5000 --workers 8
+"""
+import argparse
+import collections
+import os
+import sys
+import textwrap
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+import ChessAI
+import ChessPGN
+
+DEFAULT_NODES = 5000  # Search nodes per position
+BLUNDER = 2.0  # Pawns a move may lose before it is marked ??
+
+
+def analysePosition(snapshot, nodes, timeLimit, depth):
+    """
+    Runs in a pool process: (score from white's point of view, best move code, best move SAN) of a
+    position; the move is None when the game is over or the budget ran out before depth 1 finished
+    """
+    gs = ChessEngine.GameState.fromSnapshot(snapshot)
+    validMoves = gs.getValidMoves()
+    if not validMoves:
+        return ChessAI.scoreBoard(gs), None, None
+    lines = ChessAI.findBestMovesMultiPV(gs, validMoves, 1, depth, nodes, timeLimit)
+    if not lines:
+        return ChessAI.scoreBoard(gs), None, None
+    score, pv = lines[0]
+    return (score if gs.whiteToMove else -score), pv[0].getCode(), ChessPGN.toSan(gs, pv[0], validMoves)
+
+
+class PendingGame():
+    """
+    A game whose positions have been handed to the pool
+    """
+
+    def __init__(self, headers, fen):
+        self.headers = headers
+        self.fen = fen  # Starting position, or None for the initial one
+        self.moves = []  # (SAN, move code, white moved) of each move played
+        self.analyses = []  # One future per position, the start included
+        self.error = None
+
+    def done(self):
+        return all(future.done() for future in self.analyses)
+
+
+def submitGame(pool, headers, movetext, nodes, timeLimit, depth):
+    """
+    Replay a game and queue the analysis of each of its positions
+    """
+    fen = headers.get('FEN')
+    game = PendingGame(headers, fen)
+    try:
+        gs = ChessEngine.GameState.fromFen(fen) if fen else ChessEngine.GameState()
+    except (ValueError, KeyError, IndexError):
+        game.error = "unreadable FEN"
+        return game
+    validMoves = gs.getValidMoves()
+    game.analyses.append(pool.submit(analysePosition, gs.snapshot(history=False), nodes, timeLimit, depth))
+    for san in ChessPGN.sanTokens(movetext):
+        try:
+            move = ChessPGN.parseSan(gs, san, validMoves)
+        except ChessPGN.PGNError as e:
+            game.error = str(e)
+            break
+        game.moves.append((ChessPGN.toSan(gs, move, validMoves), move.getCode(), gs.whiteToMove))
+        gs.makeMove(move)
+        validMoves = gs.getValidMoves()
+        game.analyses.append(pool.submit(analysePosition, gs.snapshot(history=False), nodes, timeLimit, depth))
+    return game
+
+
+def formatScore(score):
+    if score >= ChessAI.CHECKMATE:
+        return "white mates"
+    if score <= -ChessAI.CHECKMATE:
+        return "black mates"
+    return "%+.2f" % (round(score, 2) + 0.0)  # No -0.00
+
+
+def formatGame(game, threshold):
+    """
+    The annotated game as PGN text
+    """
+    results = [future.result() for future in game.analyses]
+    headers = dict(game.headers)
+    headers['Annotator'] = 'ChessAI'
+    lines = ['[%s "%s"]' % (name, value.replace('"', '\\"')) for name, value in headers.items()]
+    lines.append('')
+
+    moveNumber = 1
+    if game.fen:
+        fields = game.fen.split()
+        if len(fields) > 5 and fields[5].isdigit():
+            moveNumber = int(fields[5])
+    tokens = []
+    blunders = 0
+    for i, (san, code, whiteMoved) in enumerate(game.moves):
+        if whiteMoved:
+            tokens.append('%d.' % moveNumber)
+        elif i == 0:
+            tokens.append('%d...' % moveNumber)
+        before, bestCode, bestSan = results[i]
+        after = results[i + 1][0]
+        loss = (before - after) if whiteMoved else (after - before)
+        comment = formatScore(after)
+        if bestCode is not None and bestCode != code:
+            if loss > threshold:
+                san += '??'
+                blunders += 1
+                comment += ", blunder, best " + bestSan
+            else:
+                comment += ", best " + bestSan
+        tokens.append(san)
+        tokens.append('{%s}' % comment)
+        if not whiteMoved:
+            moveNumber += 1
+    if game.error:
+        tokens.append('{annotation stopped: %s}' % game.error)
+    tokens.append(headers.get('Result', '*'))
+    lines.append(textwrap.fill(' '.join(tokens), 79, break_long_words=False, break_on_hyphens=False))
+    lines.append('')
+    return '\n'.join(lines) + '\n', blunders
+
+
+def annotate(pgnPath, out, workers=None, nodes=DEFAULT_NODES, timeLimit=None, depth=ChessAI.DEPTH,
+             threshold=BLUNDER, window=None, log=sys.stderr):
+    """
+    Annotate every game in pgnPath, writing them to out in order.
+    At most window games (twice the workers by default) are in flight at once.
+    """
+    workers = workers or os.cpu_count()
+    window = window or 2 * workers
+    start = time.perf_counter()
+    written = positions = 0
+    pending = collections.deque()
+
+    def writeNext():
+        nonlocal written, positions
+        game = pending.popleft()
+        text, blunders = formatGame(game, threshold)
+        out.write(text)
+        out.flush()
+        written += 1
+        positions += len(game.analyses)
+        if log:
+            log.write("game %d: %d positions, %d blunders (%.0fs elapsed)\n" % (
+                written, len(game.analyses), blunders, time.perf_counter() - start))
+
+    with open(pgnPath, 'rb') as f, ProcessPoolExecutor(workers) as pool:
+        for _, headers, movetext in ChessPGN.readGames(f):
+            pending.append(submitGame(pool, headers, movetext, nodes, timeLimit, depth))
+            while len(pending) >= window or (pending and pending[0].done()):
+                writeNext()
+        while pending:
+            writeNext()
+    return written, positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate PGN games with engine evaluations")
+    parser.add_argument('pgn')
+    parser.add_argument('--out', help="output PGN file (standard output by default)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES, help="search nodes per position (0 for no limit)")
+    parser.add_argument('--time', type=float, default=None, help="search seconds per position")
+    parser.add_argument('--depth', type=int, default=ChessAI.DEPTH, help="maximum search depth")
+    parser.add_argument('--blunder', type=float, default=BLUNDER, help="pawns lost that make a move a blunder")
+    parser.add_argument('--window', type=int, default=None, help="games in flight at once")
+    args = parser.parse_args()
+
+    out = open(args.out, 'w') if args.out else sys.stdout
+    try:
+        games, positions = annotate(args.pgn, out, args.workers, args.nodes or None, args.time, args.depth,
+                                    args.blunder, args.window)
+    finally:
+        if args.out:
+            out.close()
+    print("%d games, %d positions annotated" % (games, positions), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
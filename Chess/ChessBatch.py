@@ -0,0 +1,233 @@
+"""
+Vectorized evaluation of many positions at once with NumPy.
+Boards are encoded as one-hot piece planes so material and piece-square terms
+for a whole batch reduce to a single matrix product. Attack maps, checks and
+mobility are computed on uint64 bitboards with shifts and masks over the batch.
+"""
+import numpy as np
+import ChessEngine
+import ChessAI
+
+# Plane i holds ChessEngine.PIECES[i + 1]; squares are indexed row * 8 + col
+PLANES = len(ChessEngine.PIECES) - 1
+SQUARES = 64
+
+
+def encodeSquares(gameStates):
+    """
+    Encode boards as an (N, 64) int8 array of ChessEngine piece codes (0 is empty)
+    """
+    codes = ChessEngine.PIECE_CODES
+    return np.fromiter(
+        (codes[square] for gs in gameStates for row in gs.board for square in row),
+        dtype=np.int8,
+        count=len(gameStates) * SQUARES
+    ).reshape(len(gameStates), SQUARES)
+
+
+def encodeBoards(gameStates, dtype=np.uint8):
+    """
+    Encode boards as an (N, 12, 64) array with a 1 wherever a piece stands on its plane
+    """
+    return planesFromSquares(encodeSquares(gameStates), dtype)
+
+
+def planesFromSquares(squares, dtype=np.uint8):
+    """
+    Expand an (N, 64) array of piece codes into (N, 12, 64) one-hot planes
+    """
+    planes = np.zeros((squares.shape[0], PLANES, SQUARES), dtype=dtype)
+    n, sq = np.nonzero(squares)
+    planes[n, squares[n, sq].astype(np.intp) - 1, sq] = 1
+    return planes
+
+
+def evaluationWeights():
+    """
+    (12, 64) weights equal to ChessAI's material plus piece-square score of a piece on a square.
+    Black planes carry negative weights so the dot product is from white's point of view.
+    """
+    weights = np.zeros((PLANES, SQUARES))
+    for plane, piece in enumerate(ChessEngine.PIECES[1:]):
+        table = np.array(ChessAI.piecePositionScores[piece[1]], dtype=np.float64)
+        if piece[0] == 'w':
+            weights[plane] = ChessAI.pieceScore[piece[1]] + table.ravel()
+        else:
+            weights[plane] = -(ChessAI.pieceScore[piece[1]] + table[::-1].ravel())
+    return weights
+
+
+def scoreBoards(planes, weights=None):
+    """
+    Material and piece-square score of every board in an (N, 12, 64) batch.
+    Positive good for white, Negative good for black; matches ChessAI.scoreBoard
+    without its pawn structure term for positions that are not checkmate or stalemate.
+    """
+    if weights is None:
+        weights = evaluationWeights()
+    return planes.reshape(planes.shape[0], -1) @ weights.reshape(-1)
+
+
+def scoreGameStates(gameStates, batchSize=65536):
+    """
+    Score a sequence of GameStates, encoding and evaluating batchSize positions at a time
+    """
+    weights = evaluationWeights()
+    scores = np.empty(len(gameStates))
+    for start in range(0, len(gameStates), batchSize):
+        batch = gameStates[start:start + batchSize]
+        scores[start:start + len(batch)] = scoreBoards(encodeBoards(batch), weights)
+    return scores
+
+
+# ======================================================== Attack Maps =============================================================
+# Boards as uint64 bitboards, bit row * 8 + col, so row 0 (the 8th rank) is the low byte.
+# Moving up the board is a right shift by 8; moving right along a rank is a left shift by 1.
+
+SQUARE_BITS = np.left_shift(np.uint64(1), np.arange(SQUARES, dtype=np.uint64))
+FILE_A = np.uint64(sum(1 << (r * 8) for r in range(8)))
+FILE_B = FILE_A << np.uint64(1)
+FILE_G = FILE_A << np.uint64(6)
+FILE_H = FILE_A << np.uint64(7)
+NOT_A, NOT_AB = ~FILE_A, ~(FILE_A | FILE_B)
+NOT_H, NOT_GH = ~FILE_H, ~(FILE_G | FILE_H)
+RANK_3 = np.uint64(0xFF << 40)  # Row 5: white pawns that single-pushed from their starting rank
+RANK_6 = np.uint64(0xFF << 16)  # Row 2, the same for black
+
+
+def shifter(rows, cols):
+    """
+    A function moving every bit of a bitboard array rows down and cols right, dropping what leaves the board
+    """
+    amount = rows * 8 + cols
+    mask = {2: NOT_AB, 1: NOT_A, 0: ~np.uint64(0), -1: NOT_H, -2: NOT_GH}[cols]
+    if amount >= 0:
+        shift = np.uint64(amount)
+        return lambda b: (b << shift) & mask
+    shift = np.uint64(-amount)
+    return lambda b: (b >> shift) & mask
+
+
+ROOK_SHIFTS = [shifter(-1, 0), shifter(1, 0), shifter(0, 1), shifter(0, -1)]
+BISHOP_SHIFTS = [shifter(-1, 1), shifter(-1, -1), shifter(1, 1), shifter(1, -1)]
+KING_SHIFTS = ROOK_SHIFTS + BISHOP_SHIFTS
+KNIGHT_SHIFTS = [shifter(r, c) for r, c in ((-2, -1), (-2, 1), (2, -1), (2, 1), (1, 2), (1, -2), (-1, 2), (-1, -2))]
+PAWN_CAPTURE_SHIFTS = ([shifter(-1, -1), shifter(-1, 1)], [shifter(1, -1), shifter(1, 1)])  # White, black
+PAWN_PUSH_SHIFTS = (shifter(-1, 0), shifter(1, 0))
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:
+    def popcount(b):
+        b = b - ((b >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        b = (b & np.uint64(0x3333333333333333)) + ((b >> np.uint64(2)) & np.uint64(0x3333333333333333))
+        b = (b + (b >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return (b * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def pieceBitboards(squares):
+    """
+    (13, N) uint64 bitboards of an (N, 64) array of piece codes, one per ChessEngine piece code
+    """
+    boards = np.zeros((len(ChessEngine.PIECES), squares.shape[0]), dtype=np.uint64)
+    for code in range(1, len(ChessEngine.PIECES)):
+        boards[code] = np.where(squares == code, SQUARE_BITS, np.uint64(0)).sum(axis=1, dtype=np.uint64)
+    return boards
+
+
+def slide(sliders, empty, shift):
+    """
+    Squares the sliders reach in one direction: every empty square up to and including the first occupied one
+    """
+    ray = shift(sliders)
+    reach = ray
+    for _ in range(6):
+        ray = shift(ray & empty)
+        reach |= ray
+    return reach
+
+
+def sideAttacks(boards, side, empty):
+    """
+    Squares attacked by one side (0 white, 1 black) with empty as the free squares
+    """
+    offset = 6 * side
+    pawns, knights, bishops, rooks, queens, king = (boards[offset + i] for i in range(1, 7))
+    attacks = PAWN_CAPTURE_SHIFTS[side][0](pawns) | PAWN_CAPTURE_SHIFTS[side][1](pawns)
+    for shift in KNIGHT_SHIFTS:
+        attacks |= shift(knights)
+    for shift in KING_SHIFTS:
+        attacks |= shift(king)
+    for shift in ROOK_SHIFTS:
+        attacks |= slide(rooks | queens, empty, shift)
+    for shift in BISHOP_SHIFTS:
+        attacks |= slide(bishops | queens, empty, shift)
+    return attacks
+
+
+def attackTables(squares):
+    """
+    For an (N, 64) array of piece codes, as (N, 2) arrays with white in column 0 and black in column 1:
+    attacks  uint64 bitboards of the squares each side attacks (defended pieces included)
+    inCheck  whether each side's king is attacked
+    mobility pseudo-legal move counts: every move of the side's pieces that doesn't take one of
+             its own, with the king kept off attacked squares, as GameState.getAllPossibleMoves
+             generates them with no pins. Castling and en passant are not counted.
+    Each direction is handled for all pieces of a kind at once: no two rays of one side in the same
+    direction overlap, so the bits set after a shift count the moves in that direction.
+    """
+    boards = pieceBitboards(squares)
+    sides = (np.bitwise_or.reduce(boards[1:7]), np.bitwise_or.reduce(boards[7:13]))
+    empty = ~(sides[0] | sides[1])
+    n = squares.shape[0]
+    attacks = np.empty((n, 2), dtype=np.uint64)
+    inCheck = np.empty((n, 2), dtype=bool)
+    mobility = np.zeros((n, 2), dtype=np.int32)
+    for side in (0, 1):
+        attacks[:, side] = sideAttacks(boards, side, empty)
+    for side in (0, 1):
+        offset = 6 * side
+        own, enemy = sides[side], sides[1 - side]
+        pawns, knights, bishops, rooks, queens, king = (boards[offset + i] for i in range(1, 7))
+        inCheck[:, side] = (attacks[:, 1 - side] & king) != 0
+
+        count = np.zeros(n, dtype=np.int64)
+        push = PAWN_PUSH_SHIFTS[side]
+        single = push(pawns) & empty
+        count += popcount(single)
+        count += popcount(push(single & (RANK_3 if side == 0 else RANK_6)) & empty)
+        for shift in PAWN_CAPTURE_SHIFTS[side]:
+            count += popcount(shift(pawns) & enemy)
+        for shift in KNIGHT_SHIFTS:
+            count += popcount(shift(knights) & ~own)
+        for shift in ROOK_SHIFTS:
+            count += popcount(slide(rooks | queens, empty, shift) & ~own)
+        for shift in BISHOP_SHIFTS:
+            count += popcount(slide(bishops | queens, empty, shift) & ~own)
+        # The king may not step onto a square attacked once it has left its own square
+        guarded = sideAttacks(boards, 1 - side, empty | king)
+        for shift in KING_SHIFTS:
+            count += popcount(shift(king) & ~own & ~guarded)
+        mobility[:, side] = count
+    return attacks, inCheck, mobility
+
+
+def verifyAgainstScalar(gameStates):
+    """
+    Compare attackTables with GameState on each position; returns the indices of positions that differ.
+    Checks are compared with checkForPinsAndChecks and mobility with getAllPossibleMoves (no pins,
+    en passant cleared) for both sides.
+    """
+    _, inCheck, mobility = attackTables(encodeSquares(gameStates))
+    mismatches = []
+    for i, gs in enumerate(gameStates):
+        copy = ChessEngine.GameState.fromSnapshot(gs.snapshot(history=False))
+        copy.enpassantPossible = ()
+        for side in (0, 1):
+            copy.whiteToMove = side == 0
+            copy.pins = []
+            if copy.checkForPinsAndChecks()[0] != inCheck[i, side] or \
+                    len(copy.getAllPossibleMoves()) != mobility[i, side]:
+                mismatches.append(i)
+                break
+    return mismatches
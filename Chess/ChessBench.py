@@ -0,0 +1,204 @@
+"""
+Benchmarks move generation, make/undo, evaluation and search on a fixed set of positions.
+
+Each benchmark reports latency statistics in microseconds; the search also reports nodes per second.
+Results can be written as JSON and compared against an earlier run: any benchmark whose median
+latency grew (or search NPS fell) by more than the threshold counts as a regression and the
+command exits with status 1.
+
+    python ChessBench.py --out bench.json
+    python ChessBench.py --baseline bench.json --threshold 0.1
+
+Change BENCH_VERSION whenever the positions or the way something is measured change;
+results of different versions are never compared.
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+import ChessEngine
+import ChessAI
+
+BENCH_VERSION = 1
+POSITIONS = [
+    ("start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"),
+    ("open game", "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"),
+    ("castling both ways", "r3k2r/pppq1ppp/2npbn2/2b1p3/2B1P3/2NPBN2/PPPQ1PPP/R3K2R w KQkq - 0 9"),
+    ("middlegame", "r2q1rk1/pp2bppp/2n1pn2/3p4/3P1B2/2PB1N2/PP1N1PPP/R2Q1RK1 b - - 5 10"),
+    ("en passant", "rnbqkbnr/pp2pppp/8/2ppP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3"),
+    ("check", "rnbqk1nr/pppp1ppp/8/4p3/1b1P4/8/PPP1PPPP/RNBQKBNR w KQkq - 1 3"),
+    ("rook endgame", "8/5pk1/6p1/7p/R6P/6P1/r4PK1/8 w - - 0 40"),
+    ("promotion race", "8/1P6/8/8/8/8/6p1/K6k w - - 0 50"),
+]
+REPEATS = 200  # Calls per position for the fast benchmarks
+SEARCH_DEPTH = 3
+SEED = 1  # The alpha-beta search shuffles moves; seeding keeps node counts repeatable
+THRESHOLD = 0.1  # Default allowed slowdown before a result counts as a regression
+
+
+def percentile(sortedValues, p):
+    return sortedValues[min(len(sortedValues) - 1, int(p / 100 * len(sortedValues)))]
+
+
+def summarize(samples):
+    """
+    Latency statistics of samples given in nanoseconds, in microseconds
+    """
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples) / 1000,
+        'p50': percentile(samples, 50) / 1000,
+        'p90': percentile(samples, 90) / 1000,
+        'p99': percentile(samples, 99) / 1000,
+        'min': samples[0] / 1000,
+    }
+
+
+def gameStates():
+    return [ChessEngine.GameState.fromFen(fen) for _, fen in POSITIONS]
+
+
+def benchMoveGeneration(repeats=REPEATS):
+    samples = []
+    for gs in gameStates():
+        for _ in range(repeats):
+            start = time.perf_counter_ns()
+            gs.getValidMoves()
+            samples.append(time.perf_counter_ns() - start)
+    return summarize(samples)
+
+
+def benchMakeUndo(repeats=REPEATS // 10):
+    samples = []
+    for gs in gameStates():
+        moves = gs.getValidMoves()
+        for _ in range(repeats):
+            for move in moves:
+                start = time.perf_counter_ns()
+                gs.makeMove(move)
+                gs.undoMove()
+                samples.append(time.perf_counter_ns() - start)
+    return summarize(samples)
+
+
+def benchEvaluation(repeats=REPEATS):
+    # Pawn structure comes from the pawn hash table after the first call on each position,
+    # as it mostly does during a search
+    samples = []
+    ChessAI.pawnTable.clear()
+    for gs in gameStates():
+        for _ in range(repeats):
+            start = time.perf_counter_ns()
+            ChessAI.scoreBoard(gs)
+            samples.append(time.perf_counter_ns() - start)
+    return summarize(samples)
+
+
+def benchSearch(depth=SEARCH_DEPTH):
+    samples = []
+    nodes = 0
+    random.seed(SEED)
+    ChessAI.pawnTable.clear()
+    for gs in gameStates():
+        validMoves = gs.getValidMoves()
+        start = time.perf_counter_ns()
+        with contextlib.redirect_stdout(io.StringIO()):  # ChessAI prints node counts
+            ChessAI.findBestMoveNegaMaxAlphaBeta(gs, validMoves, depth)
+        samples.append(time.perf_counter_ns() - start)
+        nodes += ChessAI.counter
+    result = summarize(samples)
+    result['depth'] = depth
+    result['nodes'] = nodes
+    result['nps'] = nodes / (sum(samples) / 1e9)
+    return result
+
+
+def runBenchmarks(depth=SEARCH_DEPTH, repeats=REPEATS, log=None):
+    benchmarks = [
+        ('getValidMoves', lambda: benchMoveGeneration(repeats)),
+        ('makeUndo', lambda: benchMakeUndo(max(1, repeats // 10))),
+        ('scoreBoard', lambda: benchEvaluation(repeats)),
+        ('search', lambda: benchSearch(depth)),
+    ]
+    results = {}
+    for name, bench in benchmarks:
+        if log:
+            log.write("running %s...\n" % name)
+        results[name] = bench()
+    return {
+        'version': BENCH_VERSION,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold=THRESHOLD):
+    """
+    [(benchmark, statistic, baseline value, new value, relative change, regressed)];
+    positive changes are slowdowns
+    """
+    if baseline.get('version') != report['version']:
+        raise ValueError("baseline is from benchmark version %s, this is version %s" % (
+            baseline.get('version'), report['version']))
+    rows = []
+    for name, result in report['results'].items():
+        old = baseline['results'].get(name)
+        if old is None or old.get('depth') != result.get('depth'):
+            continue  # Not measured, or searched to another depth
+        change = result['p50'] / old['p50'] - 1
+        rows.append((name, 'p50', old['p50'], result['p50'], change, change > threshold))
+        if 'nps' in result and 'nps' in old:
+            change = old['nps'] / result['nps'] - 1
+            rows.append((name, 'nps', old['nps'], result['nps'], change, change > threshold))
+    return rows
+
+
+def printReport(report):
+    print("benchmark version %d, Python %s" % (report['version'], report['python']))
+    print("%-14s %10s %10s %10s %10s %10s" % ('', 'mean us', 'p50 us', 'p90 us', 'p99 us', 'calls'))
+    for name, result in report['results'].items():
+        print("%-14s %10.1f %10.1f %10.1f %10.1f %10d" % (
+            name, result['mean'], result['p50'], result['p90'], result['p99'], result['count']))
+    search = report['results']['search']
+    print("search depth %d: %d nodes, %.0f nodes per second" % (search['depth'], search['nodes'], search['nps']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the engine and compare against a baseline")
+    parser.add_argument('--out', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="relative slowdown that counts as a regression (0.1 is 10%%)")
+    parser.add_argument('--depth', type=int, default=SEARCH_DEPTH)
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    args = parser.parse_args()
+
+    report = runBenchmarks(args.depth, args.repeats, sys.stderr)
+    printReport(report)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        try:
+            rows = compare(report, baseline, args.threshold)
+        except ValueError as e:
+            parser.error(str(e))
+        regressed = False
+        for name, statistic, old, new, change, bad in rows:
+            print("%-14s %-4s %12.1f -> %12.1f  %+6.1f%%%s" % (
+                name, statistic, old, new, 100 * change, "  REGRESSION" if bad else ""))
+            regressed = regressed or bad
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
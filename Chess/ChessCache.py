@@ -0,0 +1,327 @@
+"""
+Persistent analysis cache.
+
+Keeps ChessAI's transposition table entries (depth, score, bound, best move) in a SQLite file
+across sessions, keyed by Zobrist hash (stored as a signed 64-bit integer, as SQLite wants).
+A ProbedTable attached to a cache reads each position a search looks up and doesn't hold from the
+file, one indexed SELECT at a time, so a short search only pays for the positions it reaches;
+load() instead warm-loads the most recently used entries in bulk, for a long-lived process. record() hands the entries a search added or improved to a background thread, which writes them
+in batches, keeps the deeper result when a position is already stored, and once the file holds
+more than maxEntries positions evicts the least recently used ones. An entry counts as used when
+a search stores it or, if the table is a ProbedTable, looks up the copy read from the file.
+
+The stored scores are only valid for the evaluation that produced them, so the file remembers a
+fingerprint of ChessAI's weights and starts over when they change.
+
+The entries are ChessAI's, so only that engine can use them. In ChessMain, set ANALYSIS_CACHE
+to a path to have the AI use it while AI_ENGINE is ChessAI. Standalone:
+
+    python ChessCache.py analysis.db --stats
+"""
+import argparse
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+import ChessEngine
+import ChessAI
+
+MAX_ENTRIES = 2000000  # Positions kept in the file
+EVICT_TO = 0.9  # Eviction brings the file down to this fraction of maxEntries
+WARM_ENTRIES = 200000  # Entries load() reads by default; only worth it in a process that searches many times
+MIN_DEPTH = 1  # Entries shallower than this are not written; raise it to keep the file small
+BATCH_ENTRIES = 50000  # Entries written per transaction at most
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis (
+    hash INTEGER PRIMARY KEY,
+    depth INTEGER NOT NULL,
+    score REAL NOT NULL,
+    bound INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analysisUsed ON analysis (used);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+UPSERT = """
+INSERT INTO analysis (hash, depth, score, bound, move, used) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (hash) DO UPDATE SET
+    score = CASE WHEN excluded.depth >= depth THEN excluded.score ELSE score END,
+    bound = CASE WHEN excluded.depth >= depth THEN excluded.bound ELSE bound END,
+    move = CASE WHEN excluded.depth >= depth THEN excluded.move ELSE move END,
+    depth = max(depth, excluded.depth),
+    used = excluded.used
+"""
+
+
+def toSigned(h):
+    return h - (1 << 64) if h >> 63 else h
+
+
+def evaluationFingerprint():
+    """
+    Digest of everything ChessAI's scores depend on
+    """
+    weights = (ChessAI.pieceScore, ChessAI.piecePositionScores, ChessAI.CHECKMATE, ChessAI.STALEMATE,
+               ChessAI.DOUBLED_PAWN, ChessAI.ISOLATED_PAWN, ChessAI.BACKWARD_PAWN, ChessAI.PASSED_PAWN)
+    return hashlib.sha1(repr(weights).encode()).hexdigest()
+
+
+def connect(path):
+    connection = sqlite3.connect(path, timeout=30)  # Other sessions may be writing
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    with connection:
+        connection.executescript(SCHEMA)
+    return connection
+
+
+class ProbedTable(dict):
+    """
+    Transposition table that notes which of the entries loaded from a cache a search looked up.
+    Once attached to an AnalysisCache, get() reads the positions it doesn't hold from the file.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.loaded = set()
+        self.probed = set()
+        self.cache = None  # AnalysisCache that get() falls back on
+        self.missing = set()  # Hashes the file was found not to hold
+
+    def get(self, key, default=None):
+        entry = dict.get(self, key)
+        if entry is None and self.cache is not None and key not in self.missing:
+            entry = self.cache.fetch(self, key)
+        if key in self.loaded:
+            self.probed.add(key)
+        return default if entry is None else entry
+
+    def clear(self):
+        dict.clear(self)
+        self.missing.clear()
+
+
+class AnalysisCache():
+    """
+    One session's view of a cache file. Call close() to wait for the last writes.
+    """
+
+    def __init__(self, path, maxEntries=MAX_ENTRIES, minDepth=MIN_DEPTH):
+        self.path = path
+        self.maxEntries = maxEntries
+        self.minDepth = minDepth
+        self.known = {}  # hash -> entry as last loaded or recorded, so unchanged entries aren't rewritten
+        self.reader = None  # Connection fetch() reads with, opened by attach()
+        self.attached = []  # Tables reading from this cache
+        connection = connect(path)
+        with connection:
+            fingerprint = evaluationFingerprint()
+            row = connection.execute("SELECT value FROM meta WHERE key = 'evaluation'").fetchone()
+            if row is None or row[0] != fingerprint:
+                connection.execute('DELETE FROM analysis')
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('evaluation', ?)", (fingerprint,))
+        connection.close()
+        self.queue = queue.Queue()
+        self.count = 0  # Positions in the file as the writer thread reckons them
+        self.error = None
+        self.writer = threading.Thread(target=self.writeBack, daemon=True)
+        self.writer.start()
+
+    def load(self, table=None, limit=WARM_ENTRIES):
+        """
+        Put the limit most recently used entries into table (ChessAI.transpositionTable by
+        default) where it has nothing as deep; returns the number of entries taken
+        """
+        table = ChessAI.transpositionTable if table is None else table
+        limit = min(limit, ChessAI.MAX_TABLE_ENTRIES - len(table))
+        connection = connect(self.path)
+        taken = 0
+        try:
+            rows = connection.execute(
+                'SELECT hash, depth, score, bound, move FROM analysis ORDER BY used DESC LIMIT ?', (max(limit, 0),))
+            for h, depth, score, bound, move in rows:
+                h &= ChessEngine.HASH_MASK
+                current = table.get(h)
+                if current is None or current[0] < depth:
+                    entry = (depth, score, bound, move)
+                    table[h] = entry
+                    self.known[h] = entry
+                    if isinstance(table, ProbedTable):
+                        table.loaded.add(h)
+                    taken += 1
+        finally:
+            connection.close()
+        return taken
+
+    def attach(self, table):
+        """
+        Have the ProbedTable table read the entries it misses from this cache until close()
+        """
+        if self.reader is None:
+            self.reader = connect(self.path)
+        table.cache = self
+        self.attached.append(table)
+        return table
+
+    def fetch(self, table, h):
+        """
+        The entry stored for hash h, also put into table, or None if the file has none
+        """
+        try:
+            row = self.reader.execute(
+                'SELECT depth, score, bound, move FROM analysis WHERE hash = ?', (toSigned(h),)).fetchone()
+        except sqlite3.Error as e:  # Search on without the cache
+            self.error = e
+            row = None
+        if row is None:
+            table.missing.add(h)
+            return None
+        entry = tuple(row)
+        if len(table) >= ChessAI.MAX_TABLE_ENTRIES:
+            table.clear()
+        table[h] = entry
+        table.loaded.add(h)
+        self.known[h] = entry
+        return entry
+
+    def record(self, table=None):
+        """
+        Queue the entries of table (ChessAI.transpositionTable by default) deep enough to keep
+        that are new or changed since they were loaded or last recorded, and for a ProbedTable
+        the loaded entries looked up since; returns how many entries changed
+        """
+        table = ChessAI.transpositionTable if table is None else table
+        known = self.known
+        minDepth = self.minDepth
+        changed = [(h, entry) for h, entry in table.items() if entry[0] >= minDepth and known.get(h) is not entry]
+        added = sum(h not in known for h, _ in changed)  # Rows the file will gain, as far as this session knows
+        touched = []
+        if isinstance(table, ProbedTable):
+            touched = list(table.probed.difference(h for h, _ in changed))
+            table.probed.clear()
+        known.update(changed)
+        if changed or touched:
+            self.queue.put((changed, added, touched))
+        return len(changed)
+
+    def writeBack(self):
+        # Runs on the writer thread, which owns its own connection
+        connection = connect(self.path)
+        try:
+            self.count = countEntries(connection)
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    return
+                entries, added, touched = batch
+                try:
+                    while len(entries) + len(touched) < BATCH_ENTRIES:  # Gather whatever else is waiting
+                        more = self.queue.get_nowait()
+                        if more is None:
+                            self.queue.put(None)
+                            break
+                        entries.extend(more[0])
+                        added += more[1]
+                        touched.extend(more[2])
+                except queue.Empty:
+                    pass
+                try:
+                    self.write(connection, entries, added, touched)
+                except sqlite3.Error as e:  # Keep the session going without the cache
+                    self.error = e
+        finally:
+            connection.close()
+
+    def write(self, connection, entries, added, touched):
+        used = int(time.time())
+        with connection:
+            connection.executemany(UPSERT, (
+                (toSigned(h), depth, score, bound, move, used) for h, (depth, score, bound, move) in entries))
+            connection.executemany('UPDATE analysis SET used = ? WHERE hash = ?',
+                                   ((used, toSigned(h)) for h in touched))
+            # self.count follows this session's inserts; other sessions' only show up when it is recounted here
+            self.count += added
+            if self.count > self.maxEntries:
+                self.count = countEntries(connection)
+                if self.count > self.maxEntries:
+                    connection.execute(
+                        'DELETE FROM analysis WHERE hash IN (SELECT hash FROM analysis ORDER BY used, depth LIMIT ?)',
+                        (self.count - int(self.maxEntries * EVICT_TO),))
+                    self.count = int(self.maxEntries * EVICT_TO)
+
+    def close(self):
+        for table in self.attached:
+            table.cache = None
+        self.attached = []
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        self.queue.put(None)
+        self.writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def countEntries(connection):
+    return connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+
+
+def stats(path):
+    """
+    (positions stored, {depth: positions})
+    """
+    connection = connect(path)
+    try:
+        depths = dict(connection.execute('SELECT depth, COUNT(*) FROM analysis GROUP BY depth ORDER BY depth'))
+    finally:
+        connection.close()
+    return sum(depths.values()), depths
+
+
+# ======================================================== AI ======================================================================
+
+def findBestMoveCached(gs, validMoves, returnQueue, path):
+    """
+    Entry point for searching in a separate process with the cache at path: search, reading the
+    positions reached from the file as they come up, hand the move back, and only then write the
+    new analysis. Always searches with ChessAI, whose transposition table is what the cache holds.
+    """
+    gs.enableIncrementalMoves()
+    ChessAI.transpositionTable = ProbedTable(ChessAI.transpositionTable)  # This process's own table
+    with AnalysisCache(path) as cache:
+        cache.attach(ChessAI.transpositionTable)
+        lines = ChessAI.findBestMovesMultiPV(gs, validMoves, 1, ChessAI.DEPTH)
+        returnQueue.put(lines[0][1][0] if lines else None)
+        cache.record()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or trim a persistent analysis cache")
+    parser.add_argument('path')
+    parser.add_argument('--stats', action='store_true', help="print the positions stored per depth")
+    parser.add_argument('--max-entries', type=int, default=None, help="evict down to this many positions")
+    args = parser.parse_args()
+
+    if args.max_entries is not None:
+        connection = connect(args.path)
+        with connection:
+            connection.execute(
+                'DELETE FROM analysis WHERE hash IN (SELECT hash FROM analysis ORDER BY used, depth LIMIT max('
+                '(SELECT COUNT(*) FROM analysis) - ?, 0))', (args.max_entries,))
+        connection.close()
+    if args.stats or args.max_entries is None:
+        total, depths = stats(args.path)
+        print("%d positions" % total)
+        for depth, count in depths.items():
+            print("depth %2d: %d" % (depth, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,114 @@
+import random
+import struct
+from collections import OrderedDict
+
+# Bitmask of every square on the board; square index is row * 8 + col
+ALL_SQUARES = (1 << 64) - 1
+
+
+def buildEvasionMasks():
+    # For every (king square, checker square) pair, the squares a non-king piece can
+    # move to in order to answer the check: the checker itself plus, when the two
+    # squares share a line, every square between them
+    masks = [[0] * 64 for _ in range(64)]
+    directions = ((-1, 0), (0, -1), (1, 0), (0, 1),
+                  (-1, -1), (-1, 1), (1, -1), (1, 1))
+    for kingSq in range(64):
+        kingRow, kingCol = divmod(kingSq, 8)
+        for checkSq in range(64):
+            masks[kingSq][checkSq] = 1 << checkSq
+        for d in directions:
+            mask = 0
+            for i in range(1, 8):
+                endRow = kingRow + d[0] * i
+                endCol = kingCol + d[1] * i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                    break
+                mask |= 1 << (endRow * 8 + endCol)
+                masks[kingSq][endRow * 8 + endCol] = mask
+    return masks
+
+
+EVASION_MASKS = buildEvasionMasks()
+
+# Directions in the order checkForPinsAndChecks uses: orthogonal 0-3, diagonal 4-7
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1),
+              (-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (2, -1), (2, 1),
+                  (1, 2), (1, -2), (-1, 2), (-1, -2))
+
+
+def buildRays():
+    # For every square, the squares outward from it in each direction (nearest first)
+    # and the squares a knight reaches from it, as (row, col) pairs
+    rays = []
+    knightSquares = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        rays.append([[(row + d[0] * i, col + d[1] * i) for i in range(1, 8)
+                      if 0 <= row + d[0] * i < 8 and 0 <= col + d[1] * i < 8] for d in DIRECTIONS])
+        knightSquares.append([(row + m[0], col + m[1]) for m in KNIGHT_OFFSETS
+                              if 0 <= row + m[0] < 8 and 0 <= col + m[1] < 8])
+    return rays, knightSquares
+
+
+RAYS, KNIGHT_SQUARES = buildRays()
+
+# Piece codes used by packed records and hashing; 0 is an empty square
+PIECES = ['--', 'wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PIECE_CODES = {piece: code for code, piece in enumerate(PIECES)}
+WHITE_PAWN, BLACK_PAWN = PIECE_CODES['wp'], PIECE_CODES['bp']
+
+# Castling rights bits
+WKS, WQS, BKS, BQS = 1, 2, 4, 8
+
+# FEN letters of pieces and castling rights
+FEN_PIECES = {'p': 'p', 'n': 'N', 'b': 'B', 'r': 'R', 'q': 'Q', 'k': 'K'}
+FEN_CASTLING = {'K': WKS, 'Q': WQS, 'k': BKS, 'q': BQS}
+
+# Rights that survive a move from or to each square: a king or rook leaving its
+# home square, or a rook being captured there, clears the matching rights
+CASTLING_KEPT = [WKS | WQS | BKS | BQS] * 64
+CASTLING_KEPT[0] &= ~BQS  # a8
+CASTLING_KEPT[4] &= ~(BKS | BQS)  # e8
+CASTLING_KEPT[7] &= ~BKS  # h8
+CASTLING_KEPT[56] &= ~WQS  # a1
+CASTLING_KEPT[60] &= ~(WKS | WQS)  # e1
+CASTLING_KEPT[63] &= ~WKS  # h1
+
+# Move flags stored in bits 12-13 of a 16-bit move code (start | end << 6 | flag << 12)
+MOVE_NORMAL, MOVE_ENPASSANT, MOVE_CASTLE, MOVE_PROMOTION = 0, 1, 2, 3
+
+# Undo record layout. Each record is a single int:
+# bits 0-15 move code, 16-19 piece moved, 20-23 piece captured, 24-27 castling rights,
+# 28-31 en-passant file + 1 (0 for none), 32-41 halfmove clock, 42-105 Zobrist hash,
+# 106-169 pawn hash. Everything but the move describes the position *before* the move was made.
+UNDO_MOVED_SHIFT = 16
+UNDO_CAPTURED_SHIFT = 20
+UNDO_CASTLING_SHIFT = 24
+UNDO_ENPASSANT_SHIFT = 28
+UNDO_HALFMOVE_SHIFT = 32
+UNDO_HALFMOVE_MAX = 1023
+UNDO_HASH_SHIFT = 42
+UNDO_PAWN_HASH_SHIFT = 106
+UNDO_RECORD_BYTES = 22  # Bytes needed to hold one record
+HASH_MASK = (1 << 64) - 1
+MAX_PLY = 512  # Initial undo stack size; doubled if a game ever gets longer
+
+# Snapshot layout: board as 64 piece codes, flags (bit 0 white to move, bits 1-4 castling
+# rights, bit 5 checkmate, bit 6 stalemate), en-passant file + 1, halfmove clock, hash,
+# pawn hash, white and black king squares, number of undo records that follow
+# (UNDO_RECORD_BYTES each)
+SNAPSHOT_HEADER = struct.Struct('<64sBBHQQBBH')
+
+# Zobrist keys, seeded so hashes stay the same across runs and processes
+zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = [[0] * 64] + [[zobristRandom.getrandbits(64) for _ in range(64)] for _ in range(12)]
+ZOBRIST_SIDE = zobristRandom.getrandbits(64)  # Black to move
+ZOBRIST_CASTLING = [zobristRandom.getrandbits(64) for _ in range(16)]
+ZOBRIST_ENPASSANT = [0] + [zobristRandom.getrandbits(64) for _ in range(8)]
+
+MOVE_CACHE_ENTRIES = 1024  # Default size of a legal move cache; an entry of about 30 moves takes ~10 KB
 
 
 class GameState():
@@ -22,7 +133,6 @@ class GameState():
         ]
 
         self.whiteToMove = True
-        self.moveLog = []
         self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getPawnMoves, 'N': self.getKnightMoves, 'R': self.getRookMoves,
                               'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
 
@@ -33,30 +143,270 @@ class GameState():
         self.inCheck = False
         self.pins = []
         self.checks = []
+        # Squares non-king moves may land on; narrowed while generating check evasions
+        self.targetMask = ALL_SQUARES
 
         self.enpassantPossible = ()  # Coords where an enpassant capture is possible
-        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.castlingRights = WKS | WQS | BKS | BQS  # 4-bit mask of castling rights
+        self.halfmoveClock = 0  # Plies since the last capture or pawn move
+
+        # One packed integer record per move played (see UNDO_* layout above).
+        # Preallocated and indexed by self.ply so make/undo never allocate.
+        self.undoStack = [0] * MAX_PLY
+        self.ply = 0
+        self.hash = self.computeHash()
+        self.pawnHash = self.computePawnHash()  # Zobrist key of the pawns alone
 
-        self.currentCastlingRight = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                             self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
         self.undoFlag = False
         self.checkmate = False
         self.stalemate = False
+        self.moveCache = None  # Optional MoveCache used by getValidMoves
+        self.pieceMoves = None  # Optional per-square move lists, see enableIncrementalMoves
+        self.changedSquares = 0  # Bitmask of squares changed since pieceMoves was last brought up to date
+        self.checkPieceMoves = False  # Validate pieceMoves against full regeneration (debugging)
 
         # TODO: Add the following features
         # self.protects = [][]
         # self.threatens = [][]
         # self.squaresCanMoveTo = [][]
 
+    # ======================================================== Move Log ================================================================
+
+    @property
+    def moveLog(self):
+        # Moves played so far, rebuilt from the undo stack on every access (O(ply)). A tuple, so
+        # code still trying to append to or delete from the log fails instead of changing a copy;
+        # play moves with makeMove / undoMove
+        return tuple(Move.fromRecord(self.undoStack[i]) for i in range(self.ply))
+
+    def lastMove(self):
+        # The move that led to the position, or None at the start
+        return Move.fromRecord(self.undoStack[self.ply - 1]) if self.ply else None
+
+    def getMoveCodes(self):
+        # 16-bit codes of the moves played so far, oldest first
+        return [self.undoStack[i] & 0xFFFF for i in range(self.ply)]
+
+    # ======================================================== Snapshots ===============================================================
+
+    def snapshot(self, history=True):
+        # Compact bytes describing the position (and, with history, the moves that led to it)
+        ply = self.ply if history else 0
+        flags = (self.whiteToMove | self.castlingRights << 1 |
+                 self.checkmate << 5 | self.stalemate << 6)
+        header = SNAPSHOT_HEADER.pack(
+            bytes([PIECE_CODES[square] for row in self.board for square in row]),
+            flags,
+            self.enpassantPossible[1] + 1 if self.enpassantPossible else 0,
+            min(self.halfmoveClock, 0xFFFF),
+            self.hash,
+            self.pawnHash,
+            self.whiteKingLocation[0] * 8 + self.whiteKingLocation[1],
+            self.blackKingLocation[0] * 8 + self.blackKingLocation[1],
+            ply
+        )
+        return header + b''.join(self.undoStack[i].to_bytes(UNDO_RECORD_BYTES, 'little') for i in range(ply))
+
+    @classmethod
+    def fromSnapshot(cls, data):
+        gs = cls.__new__(cls)
+        gs.restoreSnapshot(data)
+        return gs
+
+    def restoreSnapshot(self, data):
+        # Set every attribute from a snapshot; works on an object whose __init__ never ran
+        board, flags, epFile, halfmoveClock, h, pawnHash, whiteKing, blackKing, ply = \
+            SNAPSHOT_HEADER.unpack_from(data)
+        self.board = [[PIECES[code] for code in board[r * 8:r * 8 + 8]] for r in range(8)]
+        self.whiteToMove = bool(flags & 1)
+        self.castlingRights = flags >> 1 & 15
+        self.checkmate = bool(flags >> 5 & 1)
+        self.stalemate = bool(flags >> 6 & 1)
+        self.enpassantPossible = (2 if self.whiteToMove else 5, epFile - 1) if epFile else ()
+        self.halfmoveClock = halfmoveClock
+        self.hash = h
+        self.pawnHash = pawnHash
+        self.whiteKingLocation = (whiteKing >> 3, whiteKing & 7)
+        self.blackKingLocation = (blackKing >> 3, blackKing & 7)
+
+        offset = SNAPSHOT_HEADER.size
+        self.undoStack = [
+            int.from_bytes(data[offset + i * UNDO_RECORD_BYTES:offset + (i + 1) * UNDO_RECORD_BYTES], 'little')
+            for i in range(ply)
+        ]
+        self.undoStack.extend([0] * max(MAX_PLY - ply, ply))
+        self.ply = ply
+
+        self.moveFunctions = {'p': self.getPawnMoves, 'N': self.getKnightMoves, 'R': self.getRookMoves,
+                              'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
+        self.inCheck = False
+        self.pins = []
+        self.checks = []
+        self.targetMask = ALL_SQUARES
+        self.undoFlag = False
+        self.moveCache = None
+        self.pieceMoves = None
+        self.changedSquares = 0
+        self.checkPieceMoves = False
+
+    def __getstate__(self):
+        # Pickle as a snapshot rather than nested lists, Move objects and bound methods
+        return self.snapshot()
+
+    def __setstate__(self, state):
+        self.restoreSnapshot(state)
+
+    # ======================================================== FEN =====================================================================
+
+    @classmethod
+    def fromFen(cls, fen):
+        gs = cls()
+        gs.loadFen(fen)
+        return gs
+
+    def loadFen(self, fen):
+        # Set up the position of a FEN (or the first four fields of an EPD line); the move history is cleared
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: " + fen)
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError("FEN board needs 8 ranks: " + fields[0])
+        board = []
+        for rank in ranks:
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(['--'] * int(char))
+                elif char.lower() in FEN_PIECES:
+                    row.append(('w' if char.isupper() else 'b') + FEN_PIECES[char.lower()])
+                else:
+                    raise ValueError("bad piece %r in FEN" % char)
+            if len(row) != 8:
+                raise ValueError("FEN rank needs 8 squares: " + rank)
+            board.append(row)
+        if fields[1] not in ('w', 'b'):
+            raise ValueError("FEN side to move must be w or b: " + fields[1])
+
+        self.board = board
+        self.whiteToMove = fields[1] == 'w'
+        self.castlingRights = 0
+        for char in fields[2]:
+            if char != '-':
+                self.castlingRights |= FEN_CASTLING[char]
+        if fields[3] != '-':
+            self.enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        else:
+            self.enpassantPossible = ()
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == 'wK':
+                    self.whiteKingLocation = (r, c)
+                elif board[r][c] == 'bK':
+                    self.blackKingLocation = (r, c)
+
+        self.undoStack = [0] * MAX_PLY
+        self.ply = 0
+        self.hash = self.computeHash()
+        self.pawnHash = self.computePawnHash()
+        self.checkmate = False
+        self.stalemate = False
+        if self.moveCache is not None:
+            self.moveCache.clear()
+        if self.pieceMoves is not None:
+            self.pieceMoves = [None] * 64
+            self.changedSquares = 0
+
+    def getFen(self):
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for square in row:
+                if square == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += square[1].upper() if square[0] == 'w' else square[1].lower()
+            ranks.append(rank + (str(empty) if empty else ''))
+        castling = ''.join(char for char, right in FEN_CASTLING.items() if self.castlingRights & right) or '-'
+        enpassant = '-'
+        if self.enpassantPossible:
+            r, c = self.enpassantPossible
+            enpassant = Move.colsToFiles[c] + Move.rowsToRanks[r]
+        # The fullmove number counts from wherever this GameState's history starts
+        return '%s %s %s %s %d %d' % ('/'.join(ranks), 'w' if self.whiteToMove else 'b', castling, enpassant,
+                                      self.halfmoveClock, self.ply // 2 + 1)
+
+    # ======================================================== Hashing =================================================================
+
+    def computeHash(self):
+        # Zobrist key of the position computed from scratch; makeMove/undoMove keep self.hash in step
+        h = 0
+        for r in range(8):
+            for c in range(8):
+                h ^= ZOBRIST_PIECES[PIECE_CODES[self.board[r][c]]][r * 8 + c]
+        if not self.whiteToMove:
+            h ^= ZOBRIST_SIDE
+        h ^= ZOBRIST_CASTLING[self.castlingRights]
+        return h ^ self.enpassantKey()
+
+    def enpassantKey(self):
+        # Zobrist key of the en-passant square, counted only when a pawn of the side to move
+        # stands next to the pawn that just advanced two squares. Otherwise the square changes
+        # nothing, and the position must hash the same as when it is reached by another move order.
+        if not self.enpassantPossible:
+            return 0
+        row, col = self.enpassantPossible
+        if self.whiteToMove:
+            pawnRow, pawn = row + 1, 'wp'
+        else:
+            pawnRow, pawn = row - 1, 'bp'
+        board = self.board
+        if (col > 0 and board[pawnRow][col - 1] == pawn) or (col < 7 and board[pawnRow][col + 1] == pawn):
+            return ZOBRIST_ENPASSANT[col + 1]
+        return 0
+
+    def computePawnHash(self):
+        # Zobrist key of the pawns alone, so pawn structure can be cached across positions
+        h = 0
+        for r in range(8):
+            for c in range(8):
+                code = PIECE_CODES[self.board[r][c]]
+                if code == WHITE_PAWN or code == BLACK_PAWN:
+                    h ^= ZOBRIST_PIECES[code][r * 8 + c]
+        return h
+
     # ======================================================== Make Move ===============================================================
 
     def makeMove(self, move):
-        # Takes Move as a parameter and executes it.
-        # This function won't work for Casteling, Pawn Promotion and en-passant
-        self.board[move.startRow][move.startCol] = '--'
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.moveLog.append(move)  # log the move so we can undo it later
+        # Takes Move as a parameter and executes it (including castling, promotion and en-passant)
+        board = self.board
+        startSq = move.startRow * 8 + move.startCol
+        endSq = move.endRow * 8 + move.endCol
+        moved = PIECE_CODES[move.pieceMoved]
+        captured = PIECE_CODES[move.pieceCaptured]
+        code = move.getCode()
+        flag = code >> 12
+        epFile = self.enpassantPossible[1] + 1 if self.enpassantPossible else 0
+        epKey = self.enpassantKey()
+
+        # Push the undo record: the move plus everything needed to restore the position
+        if self.ply == len(self.undoStack):
+            self.undoStack.extend([0] * len(self.undoStack))
+        self.undoStack[self.ply] = (code | moved << UNDO_MOVED_SHIFT |
+                                    captured << UNDO_CAPTURED_SHIFT | self.castlingRights << UNDO_CASTLING_SHIFT |
+                                    epFile << UNDO_ENPASSANT_SHIFT |
+                                    min(self.halfmoveClock, UNDO_HALFMOVE_MAX) << UNDO_HALFMOVE_SHIFT |
+                                    self.hash << UNDO_HASH_SHIFT | self.pawnHash << UNDO_PAWN_HASH_SHIFT)
+        self.ply += 1
+
+        h = self.hash ^ ZOBRIST_SIDE ^ ZOBRIST_PIECES[moved][startSq]
+        board[move.startRow][move.startCol] = '--'
+        board[move.endRow][move.endCol] = move.pieceMoved
         self.whiteToMove = not self.whiteToMove  # Swap players
         # Update the king's location if moved
         if move.pieceMoved == 'wK':
@@ -64,13 +414,17 @@ class GameState():
         elif move.pieceMoved == 'bK':
             self.blackKingLocation = (move.endRow, move.endCol)
 
-        # Pawn promotion
-        if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
+        if flag == MOVE_PROMOTION:
+            board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
+            h ^= ZOBRIST_PIECES[moved + 4][endSq]  # Pawn code + 4 is the queen of the same color
+        else:
+            h ^= ZOBRIST_PIECES[moved][endSq]
 
-        # Enpassant
-        if move.enPassant:
-            self.board[move.startRow][move.endCol] = '--'  # Capturing the pawn
+        if flag == MOVE_ENPASSANT:
+            board[move.startRow][move.endCol] = '--'  # Capturing the pawn
+            h ^= ZOBRIST_PIECES[captured][move.startRow * 8 + move.endCol]
+        else:
+            h ^= ZOBRIST_PIECES[captured][endSq]
 
         # Update enpassantPossible variable
         # To make sure only on 2 square pawn advance it updates
@@ -79,119 +433,220 @@ class GameState():
                 (move.startRow + move.endRow) // 2, move.startCol)
         else:
             self.enpassantPossible = ()
+        h ^= epKey ^ self.enpassantKey()
 
         # Castle Move
-        if move.isCastleMove:
+        if flag == MOVE_CASTLE:
             if move.endCol - move.startCol == 2:  # Kingside castle move
-                # Moves the rook
-                self.board[move.endRow][move.endCol -
-                                        1] = self.board[move.endRow][move.endCol + 1]
-                self.board[move.endRow][move.endCol +
-                                        1] = '--'  # Erase old rook
+                rookFrom, rookTo = move.endCol + 1, move.endCol - 1
             else:  # Queenside castle move
-                # Moves the rook
-                self.board[move.endRow][move.endCol +
-                                        1] = self.board[move.endRow][move.endCol - 2]
-                self.board[move.endRow][move.endCol - 2] = '--'
-
-        self.enpassantPossibleLog.append(self.enpassantPossible)
-
-        # Update castling right - whenever it is a rook or a king move
-        self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                                 self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
+                rookFrom, rookTo = move.endCol - 2, move.endCol + 1
+            rook = board[move.endRow][rookFrom]
+            board[move.endRow][rookTo] = rook  # Moves the rook
+            board[move.endRow][rookFrom] = '--'  # Erase old rook
+            h ^= ZOBRIST_PIECES[PIECE_CODES[rook]][move.endRow * 8 + rookFrom] ^ \
+                ZOBRIST_PIECES[PIECE_CODES[rook]][move.endRow * 8 + rookTo]
+            if self.pieceMoves is not None:
+                self.changedSquares |= 1 << move.endRow * 8 + rookFrom | 1 << move.endRow * 8 + rookTo
+
+        # Update castling right - whenever a king or rook leaves its home square or a rook is captured on it
+        rights = self.castlingRights & CASTLING_KEPT[startSq] & CASTLING_KEPT[endSq]
+        h ^= ZOBRIST_CASTLING[self.castlingRights] ^ ZOBRIST_CASTLING[rights]
+        self.castlingRights = rights
+
+        if move.pieceMoved[1] == 'p' or captured:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        self.hash = h
+
+        # Pawn hash only changes when a pawn moves or is captured
+        if moved == WHITE_PAWN or moved == BLACK_PAWN:
+            self.pawnHash ^= ZOBRIST_PIECES[moved][startSq]
+            if flag != MOVE_PROMOTION:
+                self.pawnHash ^= ZOBRIST_PIECES[moved][endSq]
+        if captured == WHITE_PAWN or captured == BLACK_PAWN:
+            self.pawnHash ^= ZOBRIST_PIECES[captured][
+                move.startRow * 8 + move.endCol if flag == MOVE_ENPASSANT else endSq]
+
+        if self.pieceMoves is not None:
+            self.changedSquares |= 1 << startSq | 1 << endSq
+            if flag == MOVE_ENPASSANT:
+                self.changedSquares |= 1 << move.startRow * 8 + move.endCol
 
     # ======================================================== Undo Move ===============================================================
     def undoMove(self):
-        if len(self.moveLog) != 0:  # Make sure tht there is a move to undo
-            move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+        if self.ply != 0:  # Make sure tht there is a move to undo
+            self.ply -= 1
+            record = self.undoStack[self.ply]
+            startSq = record & 63
+            endSq = record >> 6 & 63
+            flag = record >> 12 & 3
+            startRow, startCol = startSq >> 3, startSq & 7
+            endRow, endCol = endSq >> 3, endSq & 7
+            pieceMoved = PIECES[record >> UNDO_MOVED_SHIFT & 15]
+            pieceCaptured = PIECES[record >> UNDO_CAPTURED_SHIFT & 15]
+
+            self.board[startRow][startCol] = pieceMoved
+            self.board[endRow][endCol] = pieceCaptured
             self.whiteToMove = not self.whiteToMove  # Switch turns back
 
             # Update the king's location
-            if move.pieceMoved == 'wK':
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == 'bK':
-                self.blackKingLocation = (move.startRow, move.startCol)
+            if pieceMoved == 'wK':
+                self.whiteKingLocation = (startRow, startCol)
+            elif pieceMoved == 'bK':
+                self.blackKingLocation = (startRow, startCol)
 
             # Undo enpassant
-            if move.enPassant:
+            if flag == MOVE_ENPASSANT:
                 # Leave landing square blank
-                self.board[move.endRow][move.endCol] = '--'
+                self.board[endRow][endCol] = '--'
                 # Puts the pawn back on the corrct square it was captured from
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-
-            self.enpassantPossibleLog.pop()
-            self.enpassantPossible = self.enpassantPossibleLog[-1]
-
-            # Undo castling right
-
-            self.castleRightsLog.pop()  # Get rid of new castle rights from the move we are undoing
-            # Set the current castle rights to the last move we did
-            self.currentCastlingRight = self.castleRightsLog[-1]
+                self.board[startRow][endCol] = pieceCaptured
+                if self.pieceMoves is not None:
+                    self.changedSquares |= 1 << startRow * 8 + endCol
 
             # Undo Castle Move
-            if move.isCastleMove:
-                if move.endCol - move.startCol == 2:  # Kingside castle move
+            elif flag == MOVE_CASTLE:
+                if endCol - startCol == 2:  # Kingside castle move
                     # Puts rook back to its pre location
-                    self.board[move.endRow][move.endCol +
-                                            1] = self.board[move.endRow][move.endCol - 1]
-                    self.board[move.endRow][move.endCol - 1] = '--'
+                    self.board[endRow][endCol + 1] = self.board[endRow][endCol - 1]
+                    self.board[endRow][endCol - 1] = '--'
 
                 else:  # Queenside Castle move
-                    self.board[move.endRow][move.endCol -
-                                            2] = self.board[move.endRow][move.endCol + 1]
-                    self.board[move.endRow][move.endCol + 1] = '--'
+                    self.board[endRow][endCol - 2] = self.board[endRow][endCol + 1]
+                    self.board[endRow][endCol + 1] = '--'
+                if self.pieceMoves is not None:
+                    self.changedSquares |= 0b101 << endSq - 1 if endCol - startCol == 2 else 0b1001 << endSq - 2
+
+            # Restore the state saved before the move
+            self.castlingRights = record >> UNDO_CASTLING_SHIFT & 15
+            epFile = record >> UNDO_ENPASSANT_SHIFT & 15
+            if epFile:
+                self.enpassantPossible = (2 if self.whiteToMove else 5, epFile - 1)
+            else:
+                self.enpassantPossible = ()
+            self.halfmoveClock = record >> UNDO_HALFMOVE_SHIFT & UNDO_HALFMOVE_MAX
+            self.hash = record >> UNDO_HASH_SHIFT & HASH_MASK
+            self.pawnHash = record >> UNDO_PAWN_HASH_SHIFT
+            if self.pieceMoves is not None:
+                self.changedSquares |= 1 << startSq | 1 << endSq
 
             self.checkmate = False
             self.stalemate = False
 
-    # ======================================================= Update Castle Rights ======================================================
-
-    def updateCastleRights(self, move):
-
-        if move.pieceMoved == 'wK':
-            self.currentCastlingRight.wks = False
-            self.currentCastlingRight.wqs = False
-
-        elif move.pieceMoved == 'bK':
-            self.currentCastlingRight.bks = False
-            self.currentCastlingRight.bqs = False
-
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:  # Rook on the bottom row
-                if move.startCol == 0:  # Left Rook
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7:  # Right Rook
-                    self.currentCastlingRight.wks = False
-
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:  # Rook on the bottom row
-                if move.startCol == 0:  # Left Rook
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7:  # Right Rook
-                    self.currentCastlingRight.wks = False
-
-        # If a rook is captured
-        if move.pieceCaptured == 'wR':
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.wks = False
-
-        elif move.pieceCaptured == 'bR':
-            if move.endRow == 0:
-                if move.endCol == 0:
-                    self.currentCastlingRight.bqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.bks = False
-
     # ======================================================= Get Valid Moves ===========================================================
 
+    def enableMoveCache(self, maxEntries=MOVE_CACHE_ENTRIES):
+        # Remember legal moves of recent positions; assign a MoveCache to share one between games
+        self.moveCache = MoveCache(maxEntries)
+
+    # ======================================================= Incremental Moves =========================================================
+
+    def enableIncrementalMoves(self, validate=False):
+        # Keep every piece's moves between calls. makeMove / undoMove only note the squares they
+        # change, and the next generation drops just the lists those squares can affect.
+        # With validate, every getAllPossibleMoves checks the lists against full regeneration
+        # (slow, for debugging).
+        self.pieceMoves = [None] * 64
+        self.changedSquares = 0
+        self.checkPieceMoves = validate
+
+    def getPieceMoves(self, r, c, moves):
+        # Add the moves of the piece on r, c. Kings, pinned pieces and pawns that can take en
+        # passant depend on more than the squares around them, so they are always generated.
+        piece = self.board[r][c]
+        pieceMoves = self.pieceMoves
+        if pieceMoves is None or piece[1] == 'K' or \
+                self.pins and any(pin[0] == r and pin[1] == c for pin in self.pins) or \
+                piece[1] == 'p' and self.enpassantPossible and \
+                self.enpassantPossible[0] == r + (-1 if piece[0] == 'w' else 1) and \
+                abs(self.enpassantPossible[1] - c) == 1:
+            self.moveFunctions[piece[1]](r, c, moves)
+            return
+        if self.changedSquares:
+            self.invalidatePieceMoves()
+        cached = pieceMoves[r * 8 + c]
+        if cached is None:
+            cached = []
+            targetMask = self.targetMask
+            self.targetMask = ALL_SQUARES
+            self.moveFunctions[piece[1]](r, c, cached)
+            self.targetMask = targetMask
+            pieceMoves[r * 8 + c] = cached
+        targetMask = self.targetMask
+        if targetMask == ALL_SQUARES:
+            moves.extend(cached)
+        else:
+            moves.extend(move for move in cached if targetMask >> (move.endRow * 8 + move.endCol) & 1)
+
+    def invalidatePieceMoves(self):
+        # Drop the move lists of the pieces on changed squares and of every piece that moves to
+        # or through one: the first slider along each line, knights a jump away and pawns that
+        # push or capture onto it. Looking from the current board is enough even after several
+        # moves: a list whose squares all kept their contents still holds.
+        pieceMoves = self.pieceMoves
+        board = self.board
+        changed = self.changedSquares
+        self.changedSquares = 0
+        while changed:
+            low = changed & -changed
+            sq = low.bit_length() - 1
+            changed ^= low
+            pieceMoves[sq] = None
+            row = sq >> 3
+            for j, ray in enumerate(RAYS[sq]):
+                for r, c in ray:
+                    piece = board[r][c]
+                    if piece != '--':
+                        break
+                else:
+                    continue
+                kind = piece[1]
+                if kind == 'Q' or kind == ('R' if j < 4 else 'B'):
+                    pieceMoves[r * 8 + c] = None
+                elif kind == 'p':
+                    distance = abs(r - row)
+                    if piece[0] == 'w':
+                        if j == 2 and distance <= 2 or j >= 6 and distance == 1:
+                            pieceMoves[r * 8 + c] = None
+                    elif j == 0 and distance <= 2 or 4 <= j <= 5 and distance == 1:
+                        pieceMoves[r * 8 + c] = None
+            for r, c in KNIGHT_SQUARES[sq]:
+                if board[r][c][1] == 'N':
+                    pieceMoves[r * 8 + c] = None
+
+    def validatePieceMoves(self):
+        # Squares whose kept move list differs from a fresh generation
+        self.invalidatePieceMoves()
+        stale = []
+        whiteToMove, pins, enpassant = self.whiteToMove, self.pins, self.enpassantPossible
+        self.pins = []
+        self.enpassantPossible = ()
+        for sq, cached in enumerate(self.pieceMoves):
+            if cached is None:
+                continue
+            r, c = sq >> 3, sq & 7
+            piece = self.board[r][c]
+            fresh = []
+            if piece != '--':
+                self.whiteToMove = piece[0] == 'w'
+                self.moveFunctions[piece[1]](r, c, fresh)
+            if sorted((m.getCode(), m.pieceCaptured) for m in cached) != \
+                    sorted((m.getCode(), m.pieceCaptured) for m in fresh):
+                stale.append(sq)
+        self.whiteToMove, self.pins, self.enpassantPossible = whiteToMove, pins, enpassant
+        return stale
+
     def getValidMoves(self):
         # All moves considering checks
+        if self.moveCache is not None:
+            entry = self.moveCache.get(self.hash)
+            if entry is not None:
+                moves, self.inCheck, self.checks, self.checkmate, self.stalemate = entry
+                self.pins = []
+                return list(moves)  # Callers shuffle and sort the list they get
+
         moves = []
         self.inCheck, self.pins, self.checks, ally = self.checkForPinsAndChecks()
         if self.whiteToMove:
@@ -203,36 +658,7 @@ class GameState():
 
         if self.inCheck:
             if len(self.checks) == 1:  # Only 1 check ; block check or move king
-                moves = self.getAllPossibleMoves()
-
-                # To block a check you must move a piece in one of the squares
-                # between the enemy and the king
-                check = self.checks[0]  # Check info
-                checkRow = check[0]
-                checkCol = check[1]
-                # Enemy piece causing the check
-                pieceChecking = self.board[checkRow][checkCol]
-                # If the checking enemy is knight the only valid move is capturing the knight
-                if pieceChecking[1] == 'N':
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    validSquares = []
-                    for i in range(1, 8):
-                        # Check 2 and 3 are the check directions
-                        validSquare = (
-                            kingRow + check[2] * i, kingCol + check[3] * i)
-                        validSquares.append(validSquare)
-                        # Once you get to the enemy piece checking
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:
-                            break
-
-                # Get rid of any moves tht dont block check. And/or move the king
-                for i in range(len(moves) - 1, -1, -1):
-                    # Move doesnt move king so it must block or capture
-                    if moves[i].pieceMoved[1] != 'K':
-                        # The move wont block check or capture the checking piece enemy
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
+                moves = self.getCheckEvasions(kingRow, kingCol)
 
             else:  # Double Checks! King MUST move.
                 self.getKingMoves(kingRow, kingCol, moves)
@@ -255,6 +681,29 @@ class GameState():
         self.getCastleMoves(kingRow, kingCol, moves,
                             'w' if self.whiteToMove else 'b')
 
+        if self.moveCache is not None:
+            self.moveCache.put(self.hash, (tuple(moves), self.inCheck, self.checks,
+                                           self.checkmate, self.stalemate))
+        return moves
+
+    # ======================================================== Check Evasions ============================================================
+
+    def getCheckEvasions(self, kingRow, kingCol):
+        # All moves answering a single check. The king may step anywhere safe; every
+        # other piece may only land on the evasion mask (capture the checker or block
+        # the line), so moves that leave the king in check are never generated.
+        moves = []
+        checkRow, checkCol = self.checks[0][0], self.checks[0][1]
+        # A knight check can't be blocked; its mask entry is just the knight's square
+        # since a knight never shares a line with the king it attacks
+        self.targetMask = EVASION_MASKS[kingRow * 8 + kingCol][checkRow * 8 + checkCol]
+        allyColor = 'w' if self.whiteToMove else 'b'
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece[0] == allyColor:
+                    self.getPieceMoves(r, c, moves)
+        self.targetMask = ALL_SQUARES
         return moves
 
     # ======================================================== All Possible Moves ========================================================
@@ -267,10 +716,12 @@ class GameState():
             for c in range(len(self.board[r])):
                 turn = self.board[r][c][0]
                 if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
                     # Calls the appropriate move function based on piece type
-                    self.moveFunctions[piece](r, c, moves)
+                    self.getPieceMoves(r, c, moves)
 
+        if self.checkPieceMoves:
+            stale = self.validatePieceMoves()
+            assert not stale, "stale incremental move lists on squares %s" % stale
         return moves
 
     # ======================================================== Check Pins & Checks ======================================================
@@ -358,12 +809,44 @@ class GameState():
 
     # ======================================================== In Check =================================================================
 
-    def inCheck(self):
+    def isInCheck(self):
         # Determine if the current player is in check
-        if self.whiteToMove:
-            return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
+        # (the self.inCheck attribute is only up to date after move generation)
+        return self.checkForPinsAndChecks()[0]
+
+    # ======================================================== Has Legal Move ===========================================================
+
+    def hasLegalMove(self):
+        # True as soon as one legal move is found; much cheaper than getValidMoves when only
+        # checkmate / stalemate matters. Sets inCheck, pins and checks like getValidMoves.
+        self.inCheck, self.pins, self.checks, king = self.checkForPinsAndChecks()
+        moves = []
+        if len(self.checks) < 2:  # In double check only the king can move
+            if self.inCheck:
+                self.targetMask = EVASION_MASKS[king[0] * 8 + king[1]][self.checks[0][0] * 8 + self.checks[0][1]]
+            allyColor = 'w' if self.whiteToMove else 'b'
+            for r in range(8):
+                for c in range(8):
+                    piece = self.board[r][c]
+                    if piece[0] == allyColor and piece[1] != 'K':
+                        self.moveFunctions[piece[1]](r, c, moves)
+                        if moves:
+                            self.targetMask = ALL_SQUARES
+                            return True
+            self.targetMask = ALL_SQUARES
+        # King last, every king move costs a check test. Castling never needs testing:
+        # whenever castling is legal, so is the king's step towards the rook.
+        self.getKingMoves(king[0], king[1], moves)
+        return len(moves) != 0
+
+    def updateGameOver(self):
+        # Set checkmate / stalemate as getValidMoves would, without generating every move
+        if self.hasLegalMove():
+            self.checkmate = False
+            self.stalemate = False
         else:
-            return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
+            self.checkmate = self.inCheck
+            self.stalemate = not self.inCheck
 
     # ======================================================== Square Under Attack ========================================================
 
@@ -411,28 +894,35 @@ class GameState():
             kingRow, kingCol = self.blackKingLocation
 
         pawnPromotion = False
+        targetMask = self.targetMask
 
         if self.board[r + moveAmount][c] == '--':  # 1 square move
-            if not piecePinned or pinDirection == (moveAmount, 0):
+            # Pinned along the file, from in front or behind, the pawn still moves along the pin
+            if not piecePinned or pinDirection in ((moveAmount, 0), (-moveAmount, 0)):
                 if r + moveAmount == backRow:  # if piece gets to back rank then it is a pawn promotion
                     pawnPromotion = True
-                moves.append(Move((r, c), (r + moveAmount, c),
-                             self.board, pawnPromotion=pawnPromotion))
+                if targetMask >> ((r + moveAmount) * 8 + c) & 1:
+                    moves.append(Move((r, c), (r + moveAmount, c),
+                                 self.board, pawnPromotion=pawnPromotion))
 
                 # 2 square moves
                 if r == startRow and self.board[r + 2 * moveAmount][c] == '--':
-                    moves.append(
-                        Move((r, c), (r + 2 * moveAmount, c), self.board))
+                    if targetMask >> ((r + 2 * moveAmount) * 8 + c) & 1:
+                        moves.append(
+                            Move((r, c), (r + 2 * moveAmount, c), self.board))
 
         if c - 1 >= 0:  # Capture to left
             if not piecePinned or pinDirection == (moveAmount, -1):
                 if self.board[r + moveAmount][c - 1][0] == enemyColor:
                     if r + moveAmount == backRow:  # if piece gets to back rank then it is a pawn promotion
                         pawnPromotion = True
-                    moves.append(Move((r, c), (r + moveAmount, c - 1),
-                                 self.board, pawnPromotion=pawnPromotion))
+                    if targetMask >> ((r + moveAmount) * 8 + c - 1) & 1:
+                        moves.append(Move((r, c), (r + moveAmount, c - 1),
+                                     self.board, pawnPromotion=pawnPromotion))
 
-                if (r + moveAmount, c - 1) == self.enpassantPossible:
+                # Enpassant answers a check by landing on the mask or by removing the checking pawn
+                if (r + moveAmount, c - 1) == self.enpassantPossible and \
+                        targetMask >> ((r + moveAmount) * 8 + c - 1) & 1 | targetMask >> (r * 8 + c - 1) & 1:
                     attackingPiece = blockingPiece = False
                     if kingRow == r:  # Solving the weird enpassant bug
                         if kingCol < c:  # king is on the left of the pawn
@@ -449,11 +939,13 @@ class GameState():
                                 blockingPiece = True
                         for i in outsideRange:
                             square = self.board[r][i]
-                            # Attacking Piece
+                            # Only the first piece beyond the two pawns matters
                             if square[0] == enemyColor and (square[1] == 'R' or square[1] == 'Q'):
                                 attackingPiece = True
+                                break
                             elif square != '--':
                                 blockingPiece = True
+                                break
                     if not attackingPiece or blockingPiece:
                         moves.append(
                             Move((r, c), (r + moveAmount, c - 1), self.board, enPassant=True))
@@ -463,10 +955,13 @@ class GameState():
                 if self.board[r + moveAmount][c + 1][0] == enemyColor:
                     if r + moveAmount == backRow:  # if piece gets to back rank then it is a pawn promotion
                         pawnPromotion = True
-                    moves.append(Move((r, c), (r + moveAmount, c + 1),
-                                 self.board, pawnPromotion=pawnPromotion))
+                    if targetMask >> ((r + moveAmount) * 8 + c + 1) & 1:
+                        moves.append(Move((r, c), (r + moveAmount, c + 1),
+                                     self.board, pawnPromotion=pawnPromotion))
 
-                if (r + moveAmount, c + 1) == self.enpassantPossible:
+                # Enpassant answers a check by landing on the mask or by removing the checking pawn
+                if (r + moveAmount, c + 1) == self.enpassantPossible and \
+                        targetMask >> ((r + moveAmount) * 8 + c + 1) & 1 | targetMask >> (r * 8 + c + 1) & 1:
                     attackingPiece = blockingPiece = False
                     if kingRow == r:  # Solving the weird enpassant bug
                         if kingCol < c:  # king is on the left of the pawn
@@ -483,11 +978,13 @@ class GameState():
                                 blockingPiece = True
                         for i in outsideRange:
                             square = self.board[r][i]
-                            # Attacking Piece
+                            # Only the first piece beyond the two pawns matters
                             if square[0] == enemyColor and (square[1] == 'R' or square[1] == 'Q'):
                                 attackingPiece = True
+                                break
                             elif square != '--':
                                 blockingPiece = True
+                                break
                     if not attackingPiece or blockingPiece:
                         moves.append(
                             Move((r, c), (r + moveAmount, c + 1), self.board, enPassant=True))
@@ -519,11 +1016,13 @@ class GameState():
                     if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
                         endPiece = self.board[endRow][endCol]
                         if endPiece == '--':  # Empty space valid
-                            moves.append(
-                                Move((r, c), (endRow, endCol), self.board))
+                            if self.targetMask >> (endRow * 8 + endCol) & 1:
+                                moves.append(
+                                    Move((r, c), (endRow, endCol), self.board))
                         elif endPiece[0] == enemyColor:  # Enemy piece valid
-                            moves.append(
-                                Move((r, c), (endRow, endCol), self.board))
+                            if self.targetMask >> (endRow * 8 + endCol) & 1:
+                                moves.append(
+                                    Move((r, c), (endRow, endCol), self.board))
                             break
 
                         else:  # Friendly piece invalid
@@ -554,11 +1053,13 @@ class GameState():
                     if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
                         endPiece = self.board[endRow][endCol]
                         if endPiece == '--':  # Empty Space Valid
-                            moves.append(
-                                Move((r, c), (endRow, endCol), self.board))
+                            if self.targetMask >> (endRow * 8 + endCol) & 1:
+                                moves.append(
+                                    Move((r, c), (endRow, endCol), self.board))
                         elif endPiece[0] == enemyColor:  # Enemy color Valid
-                            moves.append(
-                                Move((r, c), (endRow, endCol), self.board))
+                            if self.targetMask >> (endRow * 8 + endCol) & 1:
+                                moves.append(
+                                    Move((r, c), (endRow, endCol), self.board))
                             break
                         else:  # Friendly Piece Invalid
                             break
@@ -585,7 +1086,7 @@ class GameState():
                 if not piecePinned:
                     endPiece = self.board[endRow][endCol]
                     # Not an ally piece (empty or enemy piece)
-                    if endPiece[0] != allyColor:
+                    if endPiece[0] != allyColor and self.targetMask >> (endRow * 8 + endCol) & 1:
                         moves.append(
                             Move((r, c), (endRow, endCol), self.board))
 
@@ -632,10 +1133,10 @@ class GameState():
     def getCastleMoves(self, r, c, moves, allyColor):
         if self.squareUnderAttack(r, c):
             return  # Can't castle while we are in check!
-        if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks):
+        if self.castlingRights & (WKS if self.whiteToMove else BKS):
             self.getKingsideCastleMoves(r, c, moves, allyColor)
 
-        if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs):
+        if self.castlingRights & (WQS if self.whiteToMove else BQS):
             self.getQueensideCastleMoves(r, c, moves, allyColor)
 
     def getKingsideCastleMoves(self, r, c, moves, allyColor):
@@ -652,6 +1153,41 @@ class GameState():
                     Move((r, c), (r, c - 2), self.board, isCastleMove=True))
 
 
+class MoveCache():
+    # Bounded LRU cache of legal move lists and game-over status keyed by Zobrist hash.
+    # The hash covers side to move, castling rights and en-passant file, so a position
+    # reached with different rights never shares an entry.
+
+    def __init__(self, maxEntries=MOVE_CACHE_ENTRIES):
+        self.entries = OrderedDict()
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)  # Least recently used
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class Move():
 
     ranksToRows = {'1': 7, '2': 6, '3': 5, '4': 4,
@@ -687,6 +1223,48 @@ class Move():
         if self.enPassant:
             self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
 
+    def getCode(self):
+        # 16-bit move code: start square | end square << 6 | flag << 12
+        if self.enPassant:
+            flag = MOVE_ENPASSANT
+        elif self.isCastleMove:
+            flag = MOVE_CASTLE
+        elif self.isPawnPromotion:
+            flag = MOVE_PROMOTION
+        else:
+            flag = MOVE_NORMAL
+        return self.startRow * 8 + self.startCol | (self.endRow * 8 + self.endCol) << 6 | flag << 12
+
+    @classmethod
+    def fromCode(cls, code, board):
+        # Rebuild a move from its 16-bit code on the board it is about to be played on
+        startSq = code & 63
+        endSq = code >> 6 & 63
+        flag = code >> 12 & 3
+        return cls((startSq >> 3, startSq & 7), (endSq >> 3, endSq & 7), board,
+                   enPassant=flag == MOVE_ENPASSANT, pawnPromotion=flag == MOVE_PROMOTION,
+                   isCastleMove=flag == MOVE_CASTLE)
+
+    @classmethod
+    def fromRecord(cls, record):
+        # Rebuild a move from an undo record without the board it was played on
+        move = cls.__new__(cls)
+        startSq = record & 63
+        endSq = record >> 6 & 63
+        flag = record >> 12 & 3
+        move.startRow, move.startCol = startSq >> 3, startSq & 7
+        move.endRow, move.endCol = endSq >> 3, endSq & 7
+        move.startSq = (move.startRow, move.startCol)
+        move.endSq = (move.endRow, move.endCol)
+        move.pieceMoved = PIECES[record >> UNDO_MOVED_SHIFT & 15]
+        move.pieceCaptured = PIECES[record >> UNDO_CAPTURED_SHIFT & 15]
+        move.moveID = move.startRow * 1000 + move.startCol * \
+            100 + move.endRow * 10 + move.endCol
+        move.isCastleMove = flag == MOVE_CASTLE
+        move.isPawnPromotion = move.pawnPromotion = flag == MOVE_PROMOTION
+        move.enPassant = flag == MOVE_ENPASSANT
+        return move
+
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
@@ -699,11 +1277,3 @@ class Move():
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
 
-
-class CastleRights():
-
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
@@ -0,0 +1,379 @@
+"""
+Monte Carlo tree search engine.
+
+UCT over a node arena of flat arrays. Leaves are valued by an optional short random playout
+followed by ChessAI.scoreBoard squashed to a win probability for white, so the engine is anytime:
+it can be stopped after any number of iterations. The tree survives between calls and is re-rooted
+when the next position descends from the last one searched, and root-parallel search runs
+independent trees in a process pool and adds up what each search added to its root statistics,
+with nothing shared.
+
+Offers the same entry points as ChessAI: findBestMove(gs, validMoves, returnQueue) for a separate
+process and findBestMoveTimed(gs, validMoves, timeLimit), plus findBestMoveParallel. A process
+started for one move takes its tree with it; the tree carries over only in a process that
+searches move after move, like the workers of ParallelSearch, which ChessMain uses.
+"""
+import math
+import os
+import random
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import ChessEngine
+import ChessAI
+
+ITERATIONS = 3000  # Iterations per move for findBestMove
+EXPLORATION = 1.4  # UCT exploration constant
+VALUE_SCALE = 0.5  # Logistic slope turning a score in pawns into a win probability
+ROLLOUT_PLIES = 0  # Random moves played before scoring a leaf; 0 scores the leaf itself
+MAX_NODES = 1 << 20  # Arena size; once full, leaves are still evaluated but no longer expanded
+
+UNEXPANDED, EXPANDED, TERMINAL = 0, 1, 2  # Node states
+
+
+class Tree():
+    """
+    Node arena. Node 0 is the root and the children of a node are stored contiguously from first[node].
+    value holds the summed results from the point of view of the side that made the move into the node.
+    """
+
+    def __init__(self, whiteToMove):
+        self.parent = array('i', [-1])
+        self.move = array('H', [0])
+        self.first = array('i', [0])
+        self.count = array('i', [0])
+        self.visits = array('i', [0])
+        self.value = array('d', [0.0])
+        self.whiteMoved = array('b', [not whiteToMove])
+        self.state = array('b', [UNEXPANDED])
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self, parent, code):
+        self.parent.append(parent)
+        self.move.append(code)
+        self.first.append(0)
+        self.count.append(0)
+        self.visits.append(0)
+        self.value.append(0.0)
+        self.whiteMoved.append(not self.whiteMoved[parent])
+        self.state.append(UNEXPANDED)
+
+    def children(self, node):
+        return range(self.first[node], self.first[node] + self.count[node])
+
+
+def winProbability(gs):
+    """
+    Chance that white wins the position in gs, whose game-over flags are up to date
+    """
+    if gs.checkmate:
+        return 0.0 if gs.whiteToMove else 1.0
+    if gs.stalemate:
+        return 0.5
+    return 1 / (1 + math.exp(-VALUE_SCALE * ChessAI.scoreBoard(gs)))
+
+
+class MCTS():
+    """
+    One search tree, kept between moves
+    """
+
+    def __init__(self, maxNodes=MAX_NODES, rolloutPlies=ROLLOUT_PLIES):
+        self.maxNodes = maxNodes
+        self.rolloutPlies = rolloutPlies
+        self.tree = None
+        self.rootHash = None
+        self.rootPly = 0
+
+    # ======================================================== Tree reuse ==============================================================
+
+    def prepare(self, gs):
+        """
+        Make the tree's root the position of gs, keeping the subtree of that position if the last
+        search's root was at most two plies before it
+        """
+        tree = self.tree
+        node = None
+        if tree is not None and 0 <= gs.ply - self.rootPly <= 2:
+            if gs.ply == self.rootPly:
+                matches = gs.hash == self.rootHash
+            else:
+                record = gs.undoStack[self.rootPly]
+                matches = record >> ChessEngine.UNDO_HASH_SHIFT & ChessEngine.HASH_MASK == self.rootHash
+            if matches:
+                node = 0
+                for code in gs.getMoveCodes()[self.rootPly:]:
+                    node = next((child for child in tree.children(node) if tree.move[child] == code), None)
+                    if node is None:
+                        break
+        if node is None:
+            self.tree = Tree(gs.whiteToMove)
+        elif node:
+            self.tree = self.reroot(node)
+        self.rootHash = gs.hash
+        self.rootPly = gs.ply
+
+    def reroot(self, root):
+        """
+        A new arena holding the subtree below root, copied breadth first
+        """
+        old = self.tree
+        new = Tree(not old.whiteMoved[root])
+        new.visits[0] = old.visits[root]
+        new.value[0] = old.value[root]
+        new.state[0] = old.state[root]
+        queue = [(root, 0)]
+        for oldNode, newNode in queue:
+            if old.state[oldNode] != EXPANDED:
+                continue
+            new.first[newNode] = len(new)
+            new.count[newNode] = old.count[oldNode]
+            for child in old.children(oldNode):
+                new.add(newNode, old.move[child])
+                copy = len(new) - 1
+                new.visits[copy] = old.visits[child]
+                new.value[copy] = old.value[child]
+                new.state[copy] = old.state[child]
+                queue.append((child, copy))
+        return new
+
+    # ======================================================== Search ==================================================================
+
+    def search(self, gs, iterations=None, timeLimit=None):
+        """
+        Grow the tree for gs by iterations and/or until timeLimit seconds have passed; gs is left as it was
+        """
+        self.prepare(gs)
+        deadline = time.perf_counter() + timeLimit if timeLimit is not None else None
+        done = 0
+        while iterations is None or done < iterations:
+            if deadline is not None and done & 15 == 0 and time.perf_counter() > deadline:
+                break
+            self.iterate(gs)
+            done += 1
+        return done
+
+    def iterate(self, gs):
+        tree = self.tree
+        node = 0
+        depth = 0
+        # Selection
+        while tree.state[node] == EXPANDED:
+            node = self.select(node)
+            gs.makeMove(ChessEngine.Move.fromCode(tree.move[node], gs.board))
+            depth += 1
+        # Expansion, then evaluation of one new child
+        if tree.state[node] == TERMINAL:
+            gs.updateGameOver()
+            result = winProbability(gs)
+        else:
+            if (tree.visits[node] or node == 0) and len(tree) < self.maxNodes:
+                moves = gs.getValidMoves()
+                if not moves:
+                    tree.state[node] = TERMINAL
+                else:
+                    random.shuffle(moves)
+                    tree.first[node] = len(tree)
+                    tree.count[node] = len(moves)
+                    tree.state[node] = EXPANDED
+                    for move in moves:
+                        tree.add(node, move.getCode())
+                    node = tree.first[node]
+                    gs.makeMove(moves[0])
+                    depth += 1
+            result = self.rollout(gs)
+            if tree.state[node] == UNEXPANDED and (gs.checkmate or gs.stalemate):
+                tree.state[node] = TERMINAL
+        # Backpropagation
+        while node >= 0:
+            tree.visits[node] += 1
+            tree.value[node] += result if tree.whiteMoved[node] else 1 - result
+            node = tree.parent[node]
+        for _ in range(depth):
+            gs.undoMove()
+
+    def select(self, node):
+        """
+        Child of node with the highest UCT score; unvisited children first
+        """
+        tree = self.tree
+        logVisits = math.log(tree.visits[node] or 1)
+        best = -1
+        bestScore = -1.0
+        for child in tree.children(node):
+            visits = tree.visits[child]
+            if visits == 0:
+                return child
+            score = tree.value[child] / visits + EXPLORATION * math.sqrt(logVisits / visits)
+            if score > bestScore:
+                best = child
+                bestScore = score
+        return best
+
+    def rollout(self, gs):
+        """
+        White's win probability after up to rolloutPlies random moves from gs; gs is left as it was
+        """
+        played = 0
+        gs.updateGameOver()
+        while played < self.rolloutPlies and not (gs.checkmate or gs.stalemate):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(random.choice(moves))
+            played += 1
+            gs.updateGameOver()
+        result = winProbability(gs)
+        for _ in range(played):
+            gs.undoMove()
+        if played:
+            gs.updateGameOver()
+        return result
+
+    # ======================================================== Results =================================================================
+
+    def rootStatistics(self):
+        """
+        {move code: (visits, summed value for the side to move)} of the root's children
+        """
+        tree = self.tree
+        return {tree.move[child]: (tree.visits[child], tree.value[child]) for child in tree.children(0)}
+
+
+engine = MCTS()  # Per-process tree, so repeated calls in one process reuse it
+
+
+def bestMove(statistics, validMoves):
+    """
+    The move in validMoves with the most visits
+    """
+    if not statistics:
+        return None
+    code = max(statistics, key=lambda c: statistics[c][0])
+    for move in validMoves:
+        if move.getCode() == code:
+            return move
+    return None
+
+
+def findBestMoveMCTS(gs, validMoves, iterations=ITERATIONS, timeLimit=None):
+    engine.search(gs, iterations, timeLimit)
+    return bestMove(engine.rootStatistics(), validMoves)
+
+
+def findBestMoveTimed(gs, validMoves, timeLimit):
+    return findBestMoveMCTS(gs, validMoves, None, timeLimit)
+
+
+def findBestMove(gs, validMoves, returnQueue):
+    """
+    Entry point for searching in a separate process, like ChessAI.findBestMove
+    """
+    returnQueue.put(findBestMoveMCTS(gs, validMoves))
+
+
+# ======================================================== Root parallel ===========================================================
+
+def searchRoot(snapshot, iterations, timeLimit, seed):
+    """
+    Runs in a pool process: grow this process's tree for the position and return the root statistics
+    this search added. What the tree carried over from earlier searches, possibly by the same worker
+    for this very position, guides the search but isn't counted again.
+    """
+    random.seed(seed)
+    gs = ChessEngine.GameState.fromSnapshot(snapshot)
+    engine.prepare(gs)
+    before = engine.rootStatistics()
+    engine.search(gs, iterations, timeLimit)
+    added = {}
+    for code, (visits, value) in engine.rootStatistics().items():
+        oldVisits, oldValue = before.get(code, (0, 0.0))
+        if visits > oldVisits:
+            added[code] = (visits - oldVisits, value - oldValue)
+    return added
+
+
+def submitRoots(pool, gs, iterations, timeLimit, workers):
+    """
+    Futures of one searchRoot per worker for the position of gs
+    """
+    snapshot = gs.snapshot()  # With history, so workers can match it to their trees
+    seeds = [random.getrandbits(32) for _ in range(workers)]
+    return [pool.submit(searchRoot, snapshot, iterations, timeLimit, seed) for seed in seeds]
+
+
+def mergeRoots(futures):
+    """
+    Statistics of finished searchRoot futures added up move by move, one result per task
+    """
+    merged = {}
+    for future in futures:
+        for code, (visits, value) in future.result().items():
+            total = merged.get(code, (0, 0.0))
+            merged[code] = (total[0] + visits, total[1] + value)
+    return merged
+
+
+def findBestMoveParallel(gs, validMoves, iterations=ITERATIONS, timeLimit=None, workers=None, pool=None):
+    """
+    Search one tree per worker and pick the move with the most visits summed over all of them.
+    Pass a pool that lives across moves so each worker can reuse its tree.
+    """
+    workers = workers or os.cpu_count()
+    ownPool = pool is None
+    if ownPool:
+        pool = ProcessPoolExecutor(workers)
+    try:
+        merged = mergeRoots(submitRoots(pool, gs, iterations, timeLimit, workers))
+    finally:
+        if ownPool:
+            pool.shutdown()
+    return bestMove(merged, validMoves)
+
+
+class ParallelSearch():
+    """
+    Root-parallel search on a pool kept across moves, for a caller that polls for the move, like
+    ChessMain. The workers outlive each search, so every one of them re-roots the tree it grew for
+    the previous move instead of starting over.
+    """
+
+    def __init__(self, workers=None, iterations=ITERATIONS):
+        self.workers = workers or os.cpu_count()
+        self.iterations = iterations
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.futures = None
+        self.validMoves = None
+
+    def start(self, gs, validMoves):
+        self.validMoves = validMoves
+        self.futures = submitRoots(self.pool, gs, self.iterations, None, self.workers)
+
+    def cancel(self):
+        # Forget the search in progress; its workers finish their iterations and take the next one
+        for future in self.futures or ():
+            future.cancel()
+        self.futures = None
+
+    def takeMove(self):
+        """
+        The move once every worker is done, None while they are still searching. If a worker
+        died the pool is replaced and a random move is played, so the game goes on.
+        """
+        if self.futures is None or not all(future.done() for future in self.futures):
+            return None
+        try:
+            move = bestMove(mergeRoots(self.futures), self.validMoves)
+        except BrokenProcessPool:
+            self.pool.shutdown(wait=False)
+            self.pool = ProcessPoolExecutor(self.workers)
+            move = None
+        self.futures = None
+        return move if move is not None else ChessAI.findRandomMove(self.validMoves)
+
+    def close(self):
+        self.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -2,15 +2,32 @@
 This is the main driver file. Responsible for handling user input and displaying game state.
 """
 from lib2to3 import pygram
+import queue
+from multiprocessing import Process, Queue
 import pygame
 import ChessEngine
 import ChessAI
+import ChessMCTS
+import ChessCache
+import ChessProfile
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8  # Dimension of chess board (8x8)
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15  # For Animation
+MAX_FPS = 15
+ANIMATION_FPS = 60  # Frame rate while a move is animating
+ANIMATION_MS_PER_SQUARE = 60
+MAX_ANIMATION_MS = 300  # No move takes longer than this to animate
+AI_ENGINE = ChessAI  # Module whose findBestMove plays the AI's moves; ChessMCTS for Monte Carlo tree search
+MCTS_WORKERS = 1  # Trees ChessMCTS searches side by side when it is the AI_ENGINE, in workers kept across moves
+AI_RESULT_TIMEOUT = 1.0  # Seconds to wait for the move of an AI process that has already exited
+ANALYSIS_CACHE = None  # Path of a ChessCache file keeping ChessAI's analysis across sessions, e.g. 'analysis.db'
 IMAGES = {}
+# Events after which the window may have lost what was drawn, so the whole board is repainted
+REDRAW_EVENTS = {getattr(pygame, name) for name in (
+    'VIDEOEXPOSE', 'VIDEORESIZE', 'WINDOWEXPOSED', 'WINDOWSHOWN', 'WINDOWRESTORED',
+    'WINDOWMAXIMIZED', 'WINDOWRESIZED', 'WINDOWSIZECHANGED'
+) if hasattr(pygame, name)}
 
 
 def load_images():
@@ -39,15 +56,24 @@ def main():
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     clock = pygame.time.Clock()
-    screen.fill(pygame.Color('white'))
     gs = ChessEngine.GameState()
+    gs.enableMoveCache()  # Undo revisits positions of the game
     validMoves = gs.getValidMoves()
     moveMade = False  # Flag variable when move is made
 
     animate = False  # Flag varible for animating the move
+    animation = None  # MoveAnimation in progress, if any
+    AIThinking = False
+    moveFinderProcess = None
+    parallelSearch = None  # ChessMCTS.ParallelSearch, started the first time ChessMCTS plays
+
+    profiler = None  # SpanProfiler of the next frames after 'p' is pressed
+    profileAI = False  # Profile the next AI move too
+    timer = None  # PhaseTimer while 't' has it switched on
 
     # print(gs.board)
     load_images()
+    renderer = BoardRenderer(screen)
     running = True
     sq_selected = ()  # No Square is selected, keep track of last click
     player_clicks = []
@@ -65,6 +91,8 @@ def main():
         for e in pygame.event.get():
             if e.type == pygame.QUIT:
                 running = False
+            elif e.type in REDRAW_EVENTS:
+                renderer.invalidate()
             elif e.type == pygame.MOUSEBUTTONDOWN:
                 if not gameOver and humanTurn:
                     location = pygame.mouse.get_pos()  # (x, y) location of mouse
@@ -106,100 +134,293 @@ def main():
                     gs.undoMove()
                     moveMade = True
                     animate = False
+                    animation = None
+                    if AIThinking:
+                        stopAI(moveFinderProcess, parallelSearch)
+                        AIThinking = False
                 if e.key == pygame.K_r:
                     # Reset board when 'r' is pressed
                     gs = ChessEngine.GameState()
+                    gs.enableMoveCache()
                     validMoves = gs.getValidMoves()
                     sq_selected = ()
                     player_clicks = []
                     moveMade = False
                     animate = False
+                    animation = None
                     gameOver = False
+                    if AIThinking:
+                        stopAI(moveFinderProcess, parallelSearch)
+                        AIThinking = False
+                if e.key == pygame.K_p and profiler is None:
+                    # Profile the next frames and the next AI move
+                    profiler = ChessProfile.SpanProfiler(ChessProfile.outputPrefix('gui'))
+                    profiler.start()
+                    profileAI = True
+                if e.key == pygame.K_t:
+                    # Switch the per-phase timer on, or off and print what it measured
+                    if timer is None:
+                        timer = ChessProfile.PhaseTimer()
+                    else:
+                        print(timer.report())
+                        timer = None
+        if timer is not None:
+            timer.mark('events')
 
-        # AI will find the move
+        # AI will find the move in a separate process so the window keeps running
         if not gameOver and not humanTurn:
-            # AIMove = ChessAI.findRandomMove(validMoves)
-            # AIMove = ChessAI.findBestMoveGreedy(gs, validMoves)
-            # AIMove = ChessAI.findBestMoveMinMaxIter(gs, validMoves)
-            # AIMove = ChessAI.findBestMoveMinMax(gs, validMoves)
-            # AIMove = ChessAI.findBestMoveNegaMax(gs, validMoves)
-            AIMove = ChessAI.findBestMoveNegaMaxAlphaBeta(gs, validMoves)
-            if AIMove == None:
-                AIMove = ChessAI.findRandomMove(validMoves)
-            gs.makeMove(AIMove)
-            moveMade = True
-            animate = False
+            if not AIThinking:
+                AIThinking = True
+                returnQueue = Queue()  # Passes the move found back from the process
+                if profileAI:
+                    moveFinderProcess = Process(
+                        target=ChessProfile.profiledCall,
+                        args=(ChessProfile.outputPrefix('ai'), AI_ENGINE.findBestMove, gs, validMoves, returnQueue)
+                    )
+                    profileAI = False
+                elif ANALYSIS_CACHE is not None and AI_ENGINE is ChessAI:  # The cache holds ChessAI's analysis
+                    moveFinderProcess = Process(
+                        target=ChessCache.findBestMoveCached,
+                        args=(gs, validMoves, returnQueue, ANALYSIS_CACHE)
+                    )
+                elif AI_ENGINE is ChessMCTS:
+                    # The search workers outlive the move, so their trees carry over to the next one
+                    if parallelSearch is None:
+                        parallelSearch = ChessMCTS.ParallelSearch(MCTS_WORKERS)
+                    parallelSearch.start(gs, validMoves)
+                    moveFinderProcess = None
+                else:
+                    moveFinderProcess = Process(
+                        target=AI_ENGINE.findBestMove,
+                        args=(gs, validMoves, returnQueue)
+                    )
+                if moveFinderProcess is not None:
+                    moveFinderProcess.start()
+
+            if moveFinderProcess is None:
+                AIMove = parallelSearch.takeMove()
+            else:
+                AIMove = takeAIMove(moveFinderProcess, returnQueue, validMoves)
+            if AIMove is not None:
+                gs.makeMove(AIMove)
+                moveMade = True
+                animate = False
+                AIThinking = False
+        if timer is not None:
+            timer.mark('ai')
 
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
+                animation = MoveAnimation(gs.lastMove(), pygame.time.get_ticks())
             validMoves = gs.getValidMoves()
             moveMade = False
             animate = False
-        drawGameState(screen, gs, validMoves, sq_selected)
+        if animation is not None and animation.finished(pygame.time.get_ticks()):
+            animation = None
+        if timer is not None:
+            timer.mark('getValidMoves')
 
+        text = None
         if gs.checkmate:
             gameOver = True
             if gs.whiteToMove:
-                drawText(screen, "Black wins by checkmate")
+                text = "Black wins by checkmate"
             else:
-                drawText(screen, "WHite wins by checkmate")
+                text = "WHite wins by checkmate"
         elif gs.stalemate:
             gameOver = True
-            drawText(screen, "Stalemate")
+            text = "Stalemate"
+
+        dirty = renderer.drawGameState(
+            gs, validMoves, sq_selected, text,
+            animation, pygame.time.get_ticks()
+        )
+        if timer is not None:
+            timer.mark('drawGameState')
+        if dirty:
+            pygame.display.update(dirty)
+        if timer is not None:
+            timer.mark('display')
+
+        clock.tick(MAX_FPS if animation is None else ANIMATION_FPS)
+        if timer is not None:
+            timer.mark('idle')
+        if profiler is not None and profiler.tick():
+            profiler = None
+
+    if parallelSearch is not None:
+        parallelSearch.close()
+
+
+def stopAI(process, search):
+    """
+    Abandon the move the AI is looking for: a process searching for it is killed, a parallel
+    search is told to forget it
+    """
+    if process is not None:
+        process.terminate()
+    elif search is not None:
+        search.cancel()
+
+
+def takeAIMove(process, returnQueue, validMoves):
+    """
+    The AI's move once it is ready, None while the process is still thinking.
+    The cached search writes its analysis back after handing over the move, so the move is taken
+    as soon as it is on the queue. A process that found nothing or died without answering
+    (an exception, or killed) gets a random move instead, so the game goes on.
+    """
+    if returnQueue.empty() and process.is_alive():
+        return None
+    try:
+        move = returnQueue.get(timeout=AI_RESULT_TIMEOUT)
+    except queue.Empty:
+        move = None
+    if not process.is_alive():
+        process.join()
+    return move if move is not None else ChessAI.findRandomMove(validMoves)
+
+
+class BoardRenderer():
+    """
+    Draws the game state onto the screen.
+    The board background, highlight overlays and fonts are rendered once, and each frame
+    only the squares whose contents changed are repainted and reported as dirty.
+    """
 
-        clock.tick(MAX_FPS)
-        pygame.display.flip()
+    def __init__(self, screen):
+        self.screen = screen
+        self.boardSurface = drawBoard()
+        self.highlights = {
+            'selected': highlightSurface(pygame.Color('blue')),
+            'move': highlightSurface(pygame.Color('yellow'))
+        }
+        self.font = pygame.font.SysFont("Helvetica", 32, True, False)
+        self.textSurfaces = {}  # text -> (shadow, text, location)
+        self.squares = [None] * (DIMENSION * DIMENSION)  # (piece, highlight) shown last frame
+        self.text = None
+        self.spriteRect = None  # Where the animated piece was drawn last frame
+
+    def invalidate(self):
+        """
+        Forget what is on screen so the next frame repaints everything
+        """
+        self.squares = [None] * (DIMENSION * DIMENSION)
+        self.text = None
+
+    def drawGameState(self, gs, validMoves, sqSelected, text=None, animation=None, now=0):
+        """
+        Responsible for graphics within current game state.
+        While a move animates its end square still shows what stood there and the
+        moving piece is drawn on top at its current position.
+        Returns the list of rects that changed since the last frame.
+        """
+        if text != self.text and self.text is not None:
+            self.invalidate()  # Old text covers squares that did not change
+        if self.spriteRect is not None:
+            # Squares under last frame's moving piece have to be repainted
+            for row, col in squaresUnder(self.spriteRect):
+                self.squares[row * DIMENSION + col] = None
+            self.spriteRect = None
+
+        highlights = getHighlights(gs, validMoves, sqSelected)
+        dirty = []
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                square = (gs.board[row][col], highlights.get((row, col)))
+                if animation is not None and (row, col) == (animation.move.endRow, animation.move.endCol):
+                    square = (animation.capturedPiece, square[1])
+                if self.squares[row * DIMENSION + col] != square:
+                    self.squares[row * DIMENSION + col] = square
+                    dirty.append(self.drawSquare(row, col, *square))
+
+        if animation is not None:
+            row, col = animation.position(now)
+            self.spriteRect = pygame.Rect(
+                round(col * SQ_SIZE), round(row * SQ_SIZE), SQ_SIZE, SQ_SIZE
+            )
+            self.screen.blit(IMAGES[animation.move.pieceMoved], self.spriteRect)
+            dirty.append(self.spriteRect)
+
+        if text is not None and (dirty or text != self.text):
+            dirty.append(self.drawText(text))
+        self.text = text
+        return dirty
+
+    def drawSquare(self, row, col, piece, highlight=None):
+        """
+        Repaint one square: background, optional highlight and the piece on it
+        """
+        rect = pygame.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.boardSurface, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
+    def drawText(self, text):
+        if text not in self.textSurfaces:
+            shadow = self.font.render(text, 0, pygame.Color("gray"))
+            location = pygame.Rect(0, 0, WIDTH, HEIGHT).move(
+                WIDTH / 2 - shadow.get_width() // 2,
+                HEIGHT / 2 - shadow.get_height() // 2
+            )
+            self.textSurfaces[text] = (
+                shadow,
+                self.font.render(text, 0, pygame.Color("black")),
+                location
+            )
+        shadow, text_object, location = self.textSurfaces[text]
+        self.screen.blit(shadow, location)
+        self.screen.blit(text_object, location.move(2, 2))
+        return pygame.Rect(
+            location.x, location.y,
+            shadow.get_width() + 2, shadow.get_height() + 2
+        )
 
 
-def highlightSquares(screen, gs, validMoves, sqSelected):
+def getHighlights(gs, validMoves, sqSelected):
     """
-    Highlights square selected and shows possible moves
+    Square selected and the possible moves from it, as {(row, col): highlight}
     """
+    highlights = {}
     if sqSelected != ():
         row, col = sqSelected
         if gs.board[row][col][0] == ('w' if gs.whiteToMove else 'b'):
             # Highlight Selected Square
-            s = pygame.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(pygame.Color('blue'))
-            screen.blit(s, (col * SQ_SIZE, row * SQ_SIZE))
+            highlights[(row, col)] = 'selected'
 
             # Highlight Moves from that square
-            s.fill(pygame.Color('yellow'))
             for move in validMoves:
                 if move.startRow == row and move.startCol == col:
-                    screen.blit(
-                        s,
-                        (
-                            move.endCol * SQ_SIZE,
-                            move.endRow * SQ_SIZE
-                        )
-                    )
+                    highlights[(move.endRow, move.endCol)] = 'move'
+    return highlights
 
 
-def drawGameState(screen, gs, validMoves, sqSelected):
+def highlightSurface(color):
     """
-    Responsible for graphics within current game state
+    Translucent square used to highlight squares
     """
-    drawBoard(screen)  # Draw square on the board
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)  # draw pieces on top of squares
+    s = pygame.Surface((SQ_SIZE, SQ_SIZE))
+    s.set_alpha(100)
+    s.fill(color)
+    return s
 
 
-def drawBoard(screen):
+def drawBoard():
     """
-    Draw the squares on the board.
+    Render the squares of the board onto a surface.
     Top Left Square is always light.
     """
-    global colors
     colors = [pygame.Color("white"), pygame.Color("gray")]
+    surface = pygame.Surface((WIDTH, HEIGHT))
 
     for row in range(DIMENSION):
         for col in range(DIMENSION):
             color = colors[(row + col) % 2]
             pygame.draw.rect(
-                screen,
+                surface,
                 color,
                 pygame.Rect(
                     col * SQ_SIZE,
@@ -208,81 +429,46 @@ def drawBoard(screen):
                     SQ_SIZE
                 )
             )
+    return surface
 
 
-def drawPieces(screen, board):
+def squaresUnder(rect):
     """
-    Draw Pieces on board using current GameState.board
+    (row, col) of every board square the rect overlaps
     """
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            piece = board[row][col]
-            if piece != "--":
-                # If not empty, draw the piece on board
-                screen.blit(
-                    IMAGES[piece],
-                    pygame.Rect(
-                        col * SQ_SIZE,
-                        row * SQ_SIZE,
-                        SQ_SIZE,
-                        SQ_SIZE
-                    )
-                )
+    return [
+        (row, col)
+        for row in range(max(rect.top // SQ_SIZE, 0), min((rect.bottom - 1) // SQ_SIZE, DIMENSION - 1) + 1)
+        for col in range(max(rect.left // SQ_SIZE, 0), min((rect.right - 1) // SQ_SIZE, DIMENSION - 1) + 1)
+    ]
 
 
-def animateMove(move, screen, board, clock):
+class MoveAnimation():
     """
-    Animate a move
+    A move sliding from its start square to its end square.
+    Driven by elapsed time rather than frame count, so it takes the same time at any frame rate.
     """
-    global colors
-    coords = []  # List of coordinates that the animation will move
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSquare = 10  # Frames to move one square
-    frameCount = (abs(dR) + abs(dC)) * framesPerSquare
-    for frame in range(frameCount + 1):
-
-        row, col = (
-            move.startRow + dR * frame / frameCount,
-            move.startCol + dC * frame / frameCount
-        )
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase piece moved from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = pygame.Rect(
-            move.endCol * SQ_SIZE,
-            move.endRow * SQ_SIZE,
-            SQ_SIZE, SQ_SIZE
-        )
-        pygame.draw.rect(screen, color, endSquare)
-        # Draw Captured Piece on rectangle
-        if move.pieceCaptured != "--":
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        # Draw moving piece
-        screen.blit(
-            IMAGES[move.pieceMoved],
-            pygame.Rect(
-                col * SQ_SIZE,
-                row * SQ_SIZE,
-                SQ_SIZE,
-                SQ_SIZE
-            )
+
+    def __init__(self, move, startTime):
+        self.move = move
+        self.startTime = startTime
+        distance = max(abs(move.endRow - move.startRow), abs(move.endCol - move.startCol))
+        self.duration = min(distance * ANIMATION_MS_PER_SQUARE, MAX_ANIMATION_MS)
+        # What the end square shows until the piece arrives
+        self.capturedPiece = "--" if move.enPassant else move.pieceCaptured
+
+    def position(self, now):
+        """
+        Fractional (row, col) of the moving piece at time now
+        """
+        t = min((now - self.startTime) / self.duration, 1) if self.duration else 1
+        return (
+            self.move.startRow + (self.move.endRow - self.move.startRow) * t,
+            self.move.startCol + (self.move.endCol - self.move.startCol) * t
         )
-        pygame.display.flip()
-        clock.tick(60)
-
-
-def drawText(screen, text):
-    font = pygame.font.SysFont("Helvetica", 32, True, False)
-    text_object = font.render(text, 0, pygame.Color("gray"))
-    text_location = pygame.Rect(0, 0, WIDTH, HEIGHT).move(
-        WIDTH / 2 - text_object.get_width() // 2,
-        HEIGHT / 2 - text_object.get_height() // 2
-    )
-    screen.blit(text_object, text_location)
-    text_object = font.render(text, 0, pygame.Color("black"))
-    screen.blit(text_object, text_location.move(2, 2))
+
+    def finished(self, now):
+        return now - self.startTime >= self.duration
 
 
 if __name__ == "__main__":
@@ -0,0 +1,371 @@
+"""
+Streaming PGN reader and an on-disk index from position hash to the games that reached it.
+
+The index is a file of fixed-width records (hash, game offset, ply, result) sorted by hash,
+so a lookup is a binary search over a memory-mapped file and never loads the archive.
+
+    python ChessPGN.py index games.pgn games.idx
+    python ChessPGN.py query games.idx games.pgn e4 e5 Nf3
+"""
+import argparse
+import heapq
+import mmap
+import os
+import re
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+
+RECORD = struct.Struct('<QQHbx')  # hash, byte offset of the game, ply, result
+CHUNK_BYTES = 16 * 1024 * 1024  # PGN bytes handed to one worker; bounds each worker's memory
+
+RESULTS = {'1-0': 1, '0-1': -1, '1/2-1/2': 0, '*': -2}
+RESULT_NAMES = {v: k for k, v in RESULTS.items()}
+
+sanRegex = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+tagRegex = re.compile(rb'^\[(\w+)\s+"(.*)"\]\s*$')
+commentRegex = re.compile(r'\{[^}]*\}|;[^\n]*')
+tokenRegex = re.compile(r'\(|\)|\$\d+|\d+\.(?:\.\.)?|[^\s()]+')
+
+
+class PGNError(ValueError):
+    pass
+
+
+# ======================================================== Reading ==================================================================
+
+def readGames(f, start=0, end=None):
+    """
+    Yield (offset, headers, movetext) for every game starting in [start, end) of binary file f.
+    start must be the offset of a game (or 0).
+    Reads line by line so memory use does not depend on the size of the file.
+    """
+    f.seek(start)
+    offset = start
+    gameOffset = None
+    headers = {}
+    movetext = []
+    for line in iter(f.readline, b''):
+        lineOffset = offset
+        offset += len(line)
+        stripped = line.strip()
+        if stripped.startswith(b'['):
+            if movetext or gameOffset is None:
+                # A tag after movetext starts the next game
+                if gameOffset is not None:
+                    yield gameOffset, headers, ' '.join(movetext)
+                if end is not None and lineOffset >= end:
+                    return
+                gameOffset = lineOffset
+                headers = {}
+                movetext = []
+            match = tagRegex.match(stripped)
+            if match:
+                headers[match.group(1).decode('utf-8', 'replace')] = match.group(2).decode('utf-8', 'replace')
+        elif stripped and gameOffset is not None:
+            movetext.append(stripped.decode('utf-8', 'replace'))
+    if gameOffset is not None:
+        yield gameOffset, headers, ' '.join(movetext)
+
+
+def readGameAt(path, offset):
+    """
+    (headers, movetext) of the game starting at byte offset in the PGN file
+    """
+    with open(path, 'rb') as f:
+        for _, headers, movetext in readGames(f, offset):
+            return headers, movetext
+    raise PGNError("no game at offset %d" % offset)
+
+
+def sanTokens(movetext):
+    """
+    SAN moves of the main line, dropping comments, variations, NAGs, move numbers and the result
+    """
+    depth = 0
+    for token in tokenRegex.findall(commentRegex.sub(' ', movetext)):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and token[0] != '$' and token != '*' and \
+                (not token[0].isdigit() or token.startswith('0-0')):
+            # Move numbers and results start with a digit, but so does castling written with zeros
+            yield token
+
+
+# ======================================================== SAN =====================================================================
+
+def parseSan(gs, san, validMoves):
+    """
+    The Move in validMoves written as san in the position gs
+    """
+    san = san.rstrip('+#!?')
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        endCol = 6 if len(san) == 3 else 2
+        for move in validMoves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move
+        raise PGNError("illegal castling " + san)
+
+    match = sanRegex.match(san)
+    if not match:
+        raise PGNError("unreadable move " + san)
+    piece, fromFile, fromRank, target, promotion = match.groups()
+    if promotion is not None and promotion != 'Q':
+        raise PGNError("only promotion to a queen is supported: " + san)
+    piece = piece or 'p'
+    endRow = ChessEngine.Move.ranksToRows[target[1]]
+    endCol = ChessEngine.Move.filesToCols[target[0]]
+    candidates = [
+        move for move in validMoves
+        if move.pieceMoved[1] == piece and move.endRow == endRow and move.endCol == endCol and
+        not move.isCastleMove and
+        (fromFile is None or move.startCol == ChessEngine.Move.filesToCols[fromFile]) and
+        (fromRank is None or move.startRow == ChessEngine.Move.ranksToRows[fromRank])
+    ]
+    if len(candidates) != 1:
+        raise PGNError(("illegal move " if not candidates else "ambiguous move ") + san)
+    return candidates[0]
+
+
+def toSan(gs, move, validMoves):
+    """
+    SAN of move in the position gs, where validMoves are the legal moves
+    """
+    if move.isCastleMove:
+        san = 'O-O' if move.endCol == 6 else 'O-O-O'
+    else:
+        target = move.getRankFile(move.endRow, move.endCol)
+        capture = 'x' if move.pieceCaptured != '--' else ''
+        piece = move.pieceMoved[1]
+        if piece == 'p':
+            san = (ChessEngine.Move.colsToFiles[move.startCol] + capture if capture else '') + target
+            if move.isPawnPromotion:
+                san += '=Q'
+        else:
+            rivals = [other for other in validMoves
+                      if other.pieceMoved == move.pieceMoved and other.endRow == move.endRow and
+                      other.endCol == move.endCol and other.startSq != move.startSq]
+            origin = ''
+            if rivals:
+                if all(other.startCol != move.startCol for other in rivals):
+                    origin = ChessEngine.Move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in rivals):
+                    origin = ChessEngine.Move.rowsToRanks[move.startRow]
+                else:
+                    origin = move.getRankFile(move.startRow, move.startCol)
+            san = piece + origin + capture + target
+    gs.makeMove(move)
+    if gs.isInCheck():
+        san += '+' if gs.hasLegalMove() else '#'
+    gs.undoMove()
+    return san
+
+
+def replaySan(sanMoves, gs=None):
+    """
+    Yield (ply, gs) after each SAN move played from the start (or gs); stops with PGNError on a bad move
+    """
+    gs = gs if gs is not None else ChessEngine.GameState()
+    for ply, san in enumerate(sanMoves, 1):
+        gs.makeMove(parseSan(gs, san, gs.getValidMoves()))
+        yield ply, gs
+
+
+# ======================================================== Index ===================================================================
+
+def lineStart(f, pos):
+    """
+    Offset of the start of the line holding byte pos
+    """
+    while pos > 0:
+        start = max(0, pos - 4096)
+        f.seek(start)
+        newline = f.read(pos - start).rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        pos = start
+    return 0
+
+
+def nextGameStart(f, pos):
+    """
+    Offset of the first game starting at or after pos: a tag line that doesn't follow another tag line.
+    Lines are always read whole, from the start of the one holding byte pos - 1.
+    """
+    previousIsTag = False
+    offset = 0
+    if pos:
+        offset = lineStart(f, pos - 1)
+        f.seek(offset)
+        previous = f.readline()
+        offset += len(previous)
+        previousIsTag = previous.strip().startswith(b'[')
+    for line in iter(f.readline, b''):
+        stripped = line.strip()
+        if stripped.startswith(b'[') and not previousIsTag:
+            return offset
+        previousIsTag = stripped.startswith(b'[')
+        offset += len(line)
+    return offset
+
+
+def findChunks(path, chunkBytes=CHUNK_BYTES):
+    """
+    Split the file into byte ranges of about chunkBytes that each begin at the start of a game
+    """
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, 'rb') as f:
+        for pos in range(chunkBytes, size, chunkBytes):
+            start = nextGameStart(f, pos)
+            if start > starts[-1] and start < size:
+                starts.append(start)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def indexChunk(path, start, end, runPath):
+    """
+    Index the games starting in [start, end) and write their records, sorted by hash, to runPath.
+    Returns (runPath, games indexed, games stopped early by an unsupported or illegal move).
+    """
+    keys = []  # hash << 64 | offset << 24 | ply << 8 | result + 2, so sorting orders by hash
+    games = errors = 0
+    with open(path, 'rb') as f:
+        for offset, headers, movetext in readGames(f, start, end):
+            if 'FEN' in headers:
+                continue  # Only games from the initial position can be replayed
+            games += 1
+            result = RESULTS.get(headers.get('Result', '*'), -2)
+            try:
+                for ply, gs in replaySan(sanTokens(movetext)):
+                    keys.append(gs.hash << 64 | offset << 24 | ply << 8 | result + 2)
+            except PGNError:
+                errors += 1
+    keys.sort()
+    with open(runPath, 'wb') as out:
+        for key in keys:
+            out.write(packKey(key))
+    return runPath, games, errors
+
+
+def packKey(key):
+    return RECORD.pack(key >> 64, key >> 24 & 0xFFFFFFFFFF, key >> 8 & 0xFFFF, (key & 0xFF) - 2)
+
+
+def readRun(runPath):
+    with open(runPath, 'rb') as f:
+        while True:
+            data = f.read(RECORD.size)
+            if not data:
+                return
+            h, offset, ply, result = RECORD.unpack(data)
+            yield h << 64 | offset << 24 | ply << 8 | result + 2
+
+
+def buildIndex(pgnPath, indexPath, workers=None, chunkBytes=CHUNK_BYTES):
+    """
+    Index every position reached in pgnPath, parsing chunks in a process pool and
+    merging their sorted runs into indexPath. Returns (games, games stopped early).
+    """
+    chunks = findChunks(pgnPath, chunkBytes)
+    runPaths = ['%s.run%d' % (indexPath, i) for i in range(len(chunks))]
+    games = errors = 0
+    with ProcessPoolExecutor(workers) as pool:
+        for _, g, e in pool.map(indexChunk, [pgnPath] * len(chunks),
+                                [c[0] for c in chunks], [c[1] for c in chunks], runPaths):
+            games += g
+            errors += e
+    try:
+        with open(indexPath, 'wb') as out:
+            for key in heapq.merge(*[readRun(runPath) for runPath in runPaths]):
+                out.write(packKey(key))
+    finally:
+        for runPath in runPaths:
+            os.remove(runPath)
+    return games, errors
+
+
+class PositionIndex():
+    """
+    Memory-mapped view of an index built by buildIndex
+    """
+
+    def __init__(self, indexPath):
+        self.file = open(indexPath, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.count = size // RECORD.size
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def hashAt(self, i):
+        return RECORD.unpack_from(self.data, i * RECORD.size)[0]
+
+    def lookup(self, positionHash):
+        """
+        [(game offset, ply, result)] of every game that reached the position with this hash
+        """
+        lo, hi = 0, self.count
+        while lo < hi:  # First record with hash >= positionHash
+            mid = (lo + hi) // 2
+            if self.hashAt(mid) < positionHash:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.count:
+            h, offset, ply, result = RECORD.unpack_from(self.data, lo * RECORD.size)
+            if h != positionHash:
+                break
+            found.append((offset, ply, result))
+            lo += 1
+        return found
+
+    def games(self, gs):
+        """
+        Games that reached the position of GameState gs
+        """
+        return self.lookup(gs.hash)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index PGN archives by position")
+    commands = parser.add_subparsers(dest='command', required=True)
+    index = commands.add_parser('index', help="build a position index for a PGN file")
+    index.add_argument('pgn')
+    index.add_argument('index')
+    index.add_argument('--workers', type=int, default=None)
+    query = commands.add_parser('query', help="list games reaching the position after the given SAN moves")
+    query.add_argument('index')
+    query.add_argument('pgn')
+    query.add_argument('moves', nargs='*')
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        games, errors = buildIndex(args.pgn, args.index, args.workers)
+        print("%d games indexed, %d stopped early" % (games, errors))
+    else:
+        gs = ChessEngine.GameState()
+        for _ in replaySan(args.moves, gs):
+            pass
+        with PositionIndex(args.index) as positions:
+            for offset, ply, result in positions.games(gs):
+                headers, _ = readGameAt(args.pgn, offset)
+                print("%s - %s  %s  (offset %d, ply %d)" % (
+                    headers.get('White', '?'), headers.get('Black', '?'),
+                    RESULT_NAMES.get(result, '*'), offset, ply))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Proof-number search for forced mates.
+
+Proves or disproves that the side to move can force mate within a number of moves. The tree is
+grown best first: every step expands the most-proving node, the leaf whose resolution would do
+most to settle the root, so narrow forcing lines are followed deep while quiet ones are left alone.
+Nodes live in flat arrays capped at maxNodes; if the cap is reached before the root is settled
+the answer is UNKNOWN.
+
+    python ChessPNS.py puzzles.epd --moves 5 --nodes 200000
+
+Puzzle lines are a FEN or EPD; an EPD "dm N" operation sets the mate depth for that puzzle.
+"""
+import argparse
+import re
+import time
+from array import array
+import ChessEngine
+import ChessPGN
+
+PROVEN, DISPROVEN, UNKNOWN = 'mate', 'no mate', 'unknown'
+INFINITY = 1 << 30
+MAX_MOVES = 5  # Default mate depth, in moves of the side to move
+MAX_NODES = 200000  # Default size of the node table
+
+dmRegex = re.compile(r'\bdm\s+(\d+)')
+
+
+class ProofTree():
+    """
+    Node table of a proof-number search. Node 0 is the root; the children of a node are stored
+    contiguously from first[node]. Even plies are OR nodes (the attacker to move), odd plies AND nodes.
+    """
+
+    def __init__(self, maxNodes):
+        self.maxNodes = maxNodes
+        self.parent = array('i', [-1])
+        self.move = array('H', [0])  # Code of the move leading to the node
+        self.first = array('i', [0])
+        self.count = array('i', [0])  # Number of children; 0 until expanded
+        self.proof = array('i', [1])
+        self.disproof = array('i', [1])
+        self.ply = array('H', [0])
+        self.expanded = array('b', [0])
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self, parent, code, proof, disproof):
+        self.parent.append(parent)
+        self.move.append(code)
+        self.first.append(0)
+        self.count.append(0)
+        self.proof.append(proof)
+        self.disproof.append(disproof)
+        self.ply.append(self.ply[parent] + 1)
+        self.expanded.append(0)
+
+    def children(self, node):
+        return range(self.first[node], self.first[node] + self.count[node])
+
+
+def evaluate(gs, ply, lastPly):
+    """
+    (proof, disproof) of a new node whose position is in gs. Unfinished nodes start with the
+    number of moves to refute for the side that has to answer them all.
+    """
+    if ply == lastPly:  # The attacker's last move: mate now or never
+        gs.updateGameOver()
+        return (0, INFINITY) if gs.checkmate else (INFINITY, 0)
+    moves = gs.getValidMoves()
+    if gs.checkmate:
+        return (0, INFINITY) if ply % 2 else (INFINITY, 0)
+    if gs.stalemate:
+        return INFINITY, 0
+    return (1, len(moves)) if ply % 2 == 0 else (len(moves), 1)
+
+
+def setNumbers(tree, node):
+    """
+    Recompute a node's numbers from its children
+    """
+    proofs = [tree.proof[child] for child in tree.children(node)]
+    disproofs = [tree.disproof[child] for child in tree.children(node)]
+    if tree.ply[node] % 2 == 0:
+        tree.proof[node] = min(proofs)
+        tree.disproof[node] = min(sum(disproofs), INFINITY)
+    else:
+        tree.proof[node] = min(sum(proofs), INFINITY)
+        tree.disproof[node] = min(disproofs)
+
+
+def expand(tree, gs, node, lastPly):
+    """
+    Add every child of node; False if the table has no room for them
+    """
+    moves = gs.getValidMoves()
+    if len(tree) + len(moves) > tree.maxNodes:
+        return False
+    tree.first[node] = len(tree)
+    tree.count[node] = len(moves)
+    tree.expanded[node] = 1
+    ply = tree.ply[node] + 1
+    for move in moves:
+        gs.makeMove(move)
+        proof, disproof = evaluate(gs, ply, lastPly)
+        gs.undoMove()
+        tree.add(node, move.getCode(), proof, disproof)
+        if (proof if ply % 2 else disproof) == 0:  # One settled child settles its parent
+            break
+    tree.count[node] = len(tree) - tree.first[node]
+    return True
+
+
+def search(gs, maxMoves=MAX_MOVES, maxNodes=MAX_NODES):
+    """
+    Proof-number search from gs (which is left unchanged).
+    Returns (PROVEN, DISPROVEN or UNKNOWN, ProofTree).
+    """
+    gs = ChessEngine.GameState.fromSnapshot(gs.snapshot(history=False))
+    lastPly = 2 * maxMoves - 1
+    tree = ProofTree(maxNodes)
+    tree.proof[0], tree.disproof[0] = evaluate(gs, 0, lastPly)
+    while tree.proof[0] and tree.disproof[0]:
+        # Walk to the most-proving node
+        node = 0
+        while tree.expanded[node]:
+            if tree.ply[node] % 2 == 0:
+                node = min(tree.children(node), key=tree.proof.__getitem__)
+            else:
+                node = min(tree.children(node), key=tree.disproof.__getitem__)
+            gs.makeMove(ChessEngine.Move.fromCode(tree.move[node], gs.board))
+        full = not expand(tree, gs, node, lastPly)
+        # Back up the new numbers to the root
+        while node:
+            if tree.expanded[node]:
+                setNumbers(tree, node)
+            gs.undoMove()
+            node = tree.parent[node]
+        setNumbers(tree, 0)
+        if full:
+            return UNKNOWN, tree
+    return (PROVEN if tree.proof[0] == 0 else DISPROVEN), tree
+
+
+def mateLength(tree, node, lengths):
+    """
+    Plies to mate from a proven node with best defence, memoized in lengths
+    """
+    if node in lengths:
+        return lengths[node]
+    if not tree.expanded[node]:
+        length = 0  # Checkmate
+    elif tree.ply[node] % 2 == 0:
+        length = 1 + min(mateLength(tree, child, lengths) for child in tree.children(node) if tree.proof[child] == 0)
+    else:
+        length = 1 + max(mateLength(tree, child, lengths) for child in tree.children(node))
+    lengths[node] = length
+    return length
+
+
+def matingLine(tree, gs):
+    """
+    Moves from the root of a proven tree: the fastest mate against the longest defence
+    """
+    lengths = {}
+    line = []
+    node = 0
+    board = ChessEngine.GameState.fromSnapshot(gs.snapshot(history=False))
+    while tree.expanded[node]:
+        children = tree.children(node)
+        if tree.ply[node] % 2 == 0:
+            node = min((c for c in children if tree.proof[c] == 0), key=lambda c: mateLength(tree, c, lengths))
+        else:
+            node = max(children, key=lambda c: mateLength(tree, c, lengths))
+        move = ChessEngine.Move.fromCode(tree.move[node], board.board)
+        line.append(move)
+        board.makeMove(move)
+    return line
+
+
+def findMate(gs, maxMoves=MAX_MOVES, maxNodes=MAX_NODES):
+    """
+    (result, mating line as Moves, nodes used) for the side to move in gs;
+    the line is empty unless the result is PROVEN
+    """
+    result, tree = search(gs, maxMoves, maxNodes)
+    return result, matingLine(tree, gs) if result == PROVEN else [], len(tree)
+
+
+def lineToSan(gs, line):
+    board = ChessEngine.GameState.fromSnapshot(gs.snapshot(history=False))
+    sans = []
+    for move in line:
+        sans.append(ChessPGN.toSan(board, move, board.getValidMoves()))
+        board.makeMove(move)
+    return sans
+
+
+def solvePuzzles(path, maxMoves=MAX_MOVES, maxNodes=MAX_NODES):
+    """
+    Yield (line number, fen, result, SAN mating line, nodes, seconds) for each puzzle in the file
+    """
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split()
+            if len(fields) < 4 or line.lstrip().startswith('#'):
+                continue
+            fen = ' '.join(fields[:4])
+            match = dmRegex.search(line)
+            moves = int(match.group(1)) if match else maxMoves
+            try:
+                gs = ChessEngine.GameState.fromFen(fen)
+            except (ValueError, KeyError, IndexError):
+                yield number, fen, 'unreadable', [], 0, 0.0
+                continue
+            start = time.perf_counter()
+            result, mateLine, nodes = findMate(gs, moves, maxNodes)
+            yield number, fen, result, lineToSan(gs, mateLine), nodes, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve forced-mate puzzles with proof-number search")
+    parser.add_argument('puzzles', help="file of FEN or EPD lines")
+    parser.add_argument('--moves', type=int, default=MAX_MOVES, help="mate depth when a line has no dm operation")
+    parser.add_argument('--nodes', type=int, default=MAX_NODES, help="node table size")
+    args = parser.parse_args()
+
+    solved = total = 0
+    start = time.perf_counter()
+    for number, fen, result, line, nodes, seconds in solvePuzzles(args.puzzles, args.moves, args.nodes):
+        total += 1
+        solved += result == PROVEN
+        text = "mate in %d: %s" % ((len(line) + 1) // 2, ' '.join(line)) if result == PROVEN else result
+        print("%d: %s  (%d nodes, %.2fs)  %s" % (number, text, nodes, seconds, fen))
+    print("%d of %d puzzles solved in %.1fs" % (solved, total, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
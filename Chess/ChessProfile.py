@@ -0,0 +1,205 @@
+"""
+Opt-in profiling.
+
+SpanProfiler runs cProfile over a span of frames, profiledCall over one function call (an AI move
+in its own process), and PhaseTimer adds up the wall time spent in each stage of a loop.
+Profiles are written as <prefix>.pstats for pstats/snakeviz and <prefix>.folded collapsed stacks
+for flamegraph.pl or speedscope. While profiling is off, callers hold None instead of a profiler
+or timer, so the only cost is a None check per stage.
+
+In ChessMain, 'p' profiles the next PROFILE_FRAMES frames and the next AI move, and 't' switches
+the phase timer on and off (its report is printed when it goes off). Headless:
+
+    python ChessProfile.py --moves 4 --depth 3 --out search
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import time
+import ChessEngine
+import ChessAI
+
+PROFILE_FRAMES = 100  # Frames of the GUI loop profiled per 'p' press
+MIN_STACK_US = 1  # Collapsed stacks below this many microseconds are dropped
+
+
+def outputPrefix(name):
+    return time.strftime('profile-%s-%%Y%%m%%d-%%H%%M%%S' % name)
+
+
+# ======================================================== cProfile ================================================================
+
+def frameName(func):
+    filename, line, name = func
+    if filename == '~':  # Built-in
+        return name.replace(';', ':')
+    return ('%s (%s:%d)' % (name, os.path.basename(filename), line)).replace(';', ':')
+
+
+def collapsedStacks(stats):
+    """
+    {'root;caller;callee': microseconds} from pstats data.
+    cProfile only records caller/callee pairs, so each function's own time is split over the
+    paths leading to it in proportion to the time each incoming call edge accounts for.
+    Recursion shows as a single frame holding all of its levels.
+    """
+    callees = {}
+    roots = []
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            if caller != func:
+                callees.setdefault(caller, []).append((func, edge[3]))
+        if not any(caller != func for caller in callers):
+            roots.append(func)
+
+    stacks = {}
+    path = []
+    onPath = set()
+
+    def walk(func, fraction):
+        path.append(frameName(func))
+        onPath.add(func)
+        selfTime = stats[func][2] * fraction * 1e6
+        if selfTime >= MIN_STACK_US:
+            key = ';'.join(path)
+            stacks[key] = stacks.get(key, 0) + selfTime
+        for callee, edgeTime in callees.get(func, ()):
+            total = stats[callee][3]
+            if callee in onPath or total <= 0:
+                continue
+            share = fraction * edgeTime / total
+            if total * share * 1e6 >= MIN_STACK_US:
+                walk(callee, share)
+        onPath.discard(func)
+        path.pop()
+
+    for root in roots:
+        walk(root, 1.0)
+    return stacks
+
+
+def writeProfile(profile, prefix):
+    """
+    Write a finished cProfile.Profile as prefix.pstats and prefix.folded; returns both paths
+    """
+    profile.create_stats()
+    statsPath = prefix + '.pstats'
+    foldedPath = prefix + '.folded'
+    profile.dump_stats(statsPath)
+    with open(foldedPath, 'w') as f:
+        for stack, us in sorted(collapsedStacks(pstats.Stats(profile).stats).items()):
+            f.write('%s %d\n' % (stack, round(us)))
+    print("profile written to %s and %s" % (statsPath, foldedPath))
+    return statsPath, foldedPath
+
+
+class SpanProfiler():
+    """
+    cProfile over a span of frames: start() it, then tick() once per frame until it reports
+    it has written its output
+    """
+
+    def __init__(self, prefix, frames=PROFILE_FRAMES):
+        self.prefix = prefix
+        self.remaining = frames
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        return writeProfile(self.profile, self.prefix)
+
+    def tick(self):
+        self.remaining -= 1
+        if self.remaining > 0:
+            return False
+        self.stop()
+        return True
+
+
+def profiledCall(prefix, function, *args):
+    """
+    function(*args) under cProfile, written to prefix; usable as a multiprocessing target
+    """
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(function, *args)
+    finally:
+        writeProfile(profile, prefix)
+
+
+# ======================================================== Phase Timer =============================================================
+
+class PhaseTimer():
+    """
+    Wall time per stage of a loop. mark(phase) charges the time since the previous mark to phase,
+    so marking the end of every stage accounts for the whole loop.
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.totals[phase] = self.totals.get(phase, 0) + now - self.last
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+        self.last = now
+
+    def report(self):
+        total = sum(self.totals.values()) or 1
+        lines = ["%-16s %10s %8s %10s %6s" % ('phase', 'total ms', 'count', 'mean ms', 'share')]
+        for phase, seconds in sorted(self.totals.items(), key=lambda item: item[1], reverse=True):
+            lines.append("%-16s %10.1f %8d %10.3f %5.1f%%" % (
+                phase, 1000 * seconds, self.counts[phase], 1000 * seconds / self.counts[phase], 100 * seconds / total))
+        return '\n'.join(lines)
+
+
+# ======================================================== Headless ================================================================
+
+def playMoves(gs, moves, depth, timer=None):
+    """
+    Let the AI play moves from gs, with the stages of ChessMain's loop marked on timer
+    """
+    for _ in range(moves):
+        validMoves = gs.getValidMoves()
+        if timer is not None:
+            timer.mark('getValidMoves')
+        if not validMoves:
+            break
+        move = ChessAI.findBestMoveNegaMaxAlphaBeta(gs, validMoves, depth)
+        if move is None:
+            move = ChessAI.findRandomMove(validMoves)
+        if timer is not None:
+            timer.mark('ai')
+        gs.makeMove(move)
+        if timer is not None:
+            timer.mark('makeMove')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the AI without the GUI")
+    parser.add_argument('--moves', type=int, default=4, help="AI moves to play")
+    parser.add_argument('--depth', type=int, default=ChessAI.DEPTH)
+    parser.add_argument('--fen', help="start from this position instead of the initial one")
+    parser.add_argument('--out', default=None, help="output prefix (profile-headless-<time> by default)")
+    parser.add_argument('--phases', action='store_true', help="only time the phases, without cProfile")
+    args = parser.parse_args()
+
+    gs = ChessEngine.GameState.fromFen(args.fen) if args.fen else ChessEngine.GameState()
+    timer = PhaseTimer()
+    if args.phases:
+        playMoves(gs, args.moves, args.depth, timer)
+    else:
+        profile = cProfile.Profile()
+        profile.runcall(playMoves, gs, args.moves, args.depth, timer)
+        writeProfile(profile, args.out or outputPrefix('headless'))
+    print(timer.report())
+
+
+if __name__ == "__main__":
+    main()
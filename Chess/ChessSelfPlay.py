@@ -0,0 +1,266 @@
+"""
+Self-play training data.
+
+ChessAI plays itself from randomized openings in a process pool. Quiet positions of each game
+(side to move not in check, engine's choice not a capture or promotion, score not decided) are
+kept with the search score and, once the game is over, its result. They are written as
+fixed-width records (RECORD_DTYPE) to append-only shards of at most SHARD_RECORDS records, named
+<prefix>-0000.bin, <prefix>-0001.bin, ..., which map straight into NumPy:
+
+    records = ChessSelfPlay.readShard('selfplay-0000.bin')
+    squares = ChessSelfPlay.unpackSquares(records)  # (N, 64) piece codes, as ChessBatch encodes them
+
+    python ChessSelfPlay.py --games 1000 --out selfplay --workers 8 --nodes 2000
+
+Running again with the same prefix adds to the last shard.
+"""
+import argparse
+import collections
+import glob
+import os
+import random
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import ChessEngine
+import ChessAI
+
+RECORD_DTYPE = np.dtype([
+    ('board', 'u1', 32),  # Piece codes of squares 2i (low nibble) and 2i + 1 (high nibble), square row * 8 + col
+    ('flags', 'u1'),  # Bit 0 white to move, bits 1-4 castling rights
+    ('enpassant', 'u1'),  # En-passant file + 1, 0 for none
+    ('halfmove', 'u1'),  # Halfmove clock, capped at 255
+    ('result', 'i1'),  # Final result from white's point of view: 1, 0 or -1
+    ('score', '<i2'),  # Search score from white's point of view in centipawns
+    ('ply', '<u2'),  # Plies played in the game before the position
+])
+RECORD_VERSION = 1  # Change with RECORD_DTYPE
+MAGIC = b'CHESSPS1'
+SHARD_HEADER = struct.Struct('<8sII')  # Magic, record version, record size
+
+SHARD_RECORDS = 1 << 20  # Records per shard
+OPENING_PLIES = (4, 10)  # Range of random plies played before the engines take over
+DEFAULT_NODES = 2000  # Search nodes per move
+MAX_GAME_PLIES = 300  # Games still going after this many plies are scored as draws
+MAX_SCORE = 10  # Positions scored beyond this many pawns are decided and skipped
+
+
+# ======================================================== Records =================================================================
+
+def packBoard(board):
+    codes = [ChessEngine.PIECE_CODES[square] for row in board for square in row]
+    return bytes(codes[i] | codes[i + 1] << 4 for i in range(0, 64, 2))
+
+
+def unpackSquares(records):
+    """
+    (N, 64) int8 piece codes of records
+    """
+    board = records['board']
+    return np.stack([board & 15, board >> 4], axis=-1).reshape(len(records), 64).astype(np.int8)
+
+
+def resultValues(records):
+    """
+    Results as 1 / 0.5 / 0 for a white win / draw / black win, as ChessTune fits them
+    """
+    return (records['result'].astype(np.float32) + 1) / 2
+
+
+def makeRecords(positions, result):
+    """
+    RECORD_DTYPE array of positions given as (board bytes, flags, en passant, halfmove, score, ply)
+    """
+    records = np.zeros(len(positions), dtype=RECORD_DTYPE)
+    if positions:
+        boards, flags, enpassant, halfmove, scores, plies = zip(*positions)
+        records['board'] = np.frombuffer(b''.join(boards), dtype=np.uint8).reshape(len(positions), 32)
+        records['flags'] = flags
+        records['enpassant'] = enpassant
+        records['halfmove'] = halfmove
+        records['score'] = scores
+        records['ply'] = plies
+        records['result'] = result
+    return records
+
+
+# ======================================================== Shards ==================================================================
+
+def shardPath(prefix, number):
+    return '%s-%04d.bin' % (prefix, number)
+
+
+def shardPaths(prefix):
+    return sorted(glob.glob(glob.escape(prefix) + '-[0-9][0-9][0-9][0-9].bin'))
+
+
+def readShard(path):
+    """
+    The records of a shard as a read-only memory-mapped array
+    """
+    with open(path, 'rb') as f:
+        magic, version, size = SHARD_HEADER.unpack(f.read(SHARD_HEADER.size))
+    if magic != MAGIC or version != RECORD_VERSION or size != RECORD_DTYPE.itemsize:
+        raise ValueError("%s is not a version %d position shard" % (path, RECORD_VERSION))
+    count = (os.path.getsize(path) - SHARD_HEADER.size) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=SHARD_HEADER.size, shape=(count,))
+
+
+class ShardWriter():
+    """
+    Appends records to the shards of a prefix, starting a new shard whenever one is full
+    """
+
+    def __init__(self, prefix, shardRecords=SHARD_RECORDS):
+        self.prefix = prefix
+        self.shardRecords = shardRecords
+        paths = shardPaths(prefix)
+        self.number = len(paths) - 1 if paths else 0
+        self.file = None
+        self.count = 0
+        self.open(self.number)
+        self.written = 0
+
+    def open(self, number):
+        path = shardPath(self.prefix, number)
+        if self.file is not None:
+            self.file.close()
+        self.file = open(path, 'ab')
+        size = self.file.tell()
+        if size == 0:
+            self.file.write(SHARD_HEADER.pack(MAGIC, RECORD_VERSION, RECORD_DTYPE.itemsize))
+            self.count = 0
+        else:
+            readShard(path)  # Refuse to append to anything but a shard of this version
+            self.count, partial = divmod(size - SHARD_HEADER.size, RECORD_DTYPE.itemsize)
+            if partial:  # Cut off a record left half written by an interrupted run
+                self.file.truncate(size - partial)
+                self.file.seek(0, os.SEEK_END)
+        self.number = number
+
+    def write(self, records):
+        while len(records):
+            if self.count == self.shardRecords:
+                self.open(self.number + 1)
+            part = records[:self.shardRecords - self.count]
+            self.file.write(part.tobytes())
+            self.count += len(part)
+            self.written += len(part)
+            records = records[len(part):]
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ======================================================== Self-play ===============================================================
+
+def isQuiet(inCheck, move):
+    """
+    Whether a position is worth keeping given whether the side to move is in check and the engine's move
+    """
+    return not inCheck and move.pieceCaptured == '--' and not move.isPawnPromotion
+
+
+def playGame(seed, nodes=DEFAULT_NODES, depth=ChessAI.DEPTH, maxPlies=MAX_GAME_PLIES):
+    """
+    Runs in a pool process: play one game and return (records of its quiet positions, result)
+    """
+    random.seed(seed)
+    ChessAI.transpositionTable.clear()  # So the game doesn't depend on what this process searched before
+    gs = ChessEngine.GameState()
+    gs.enableIncrementalMoves()
+    openingPlies = random.randint(*OPENING_PLIES)
+    repetitions = collections.Counter([gs.hash])
+    positions = []
+    while True:
+        validMoves = gs.getValidMoves()
+        inCheck = gs.inCheck  # The search below leaves gs.inCheck as it was deep in the tree
+        if not validMoves:
+            result = (-1 if gs.whiteToMove else 1) if gs.checkmate else 0
+            break
+        if gs.halfmoveClock >= 100 or repetitions[gs.hash] >= 3 or gs.ply >= maxPlies:
+            result = 0
+            break
+        move = None
+        if gs.ply >= openingPlies:
+            lines = ChessAI.findBestMovesMultiPV(gs, validMoves, 1, depth, nodes)
+            if lines:
+                score, pv = lines[0]
+                move = pv[0]
+                if isQuiet(inCheck, move) and abs(score) < MAX_SCORE:
+                    positions.append((
+                        packBoard(gs.board),
+                        gs.whiteToMove | gs.castlingRights << 1,
+                        gs.enpassantPossible[1] + 1 if gs.enpassantPossible else 0,
+                        min(gs.halfmoveClock, 255),
+                        round(100 * (score if gs.whiteToMove else -score)),
+                        gs.ply
+                    ))
+        gs.makeMove(move if move is not None else random.choice(validMoves))
+        repetitions[gs.hash] += 1
+    return makeRecords(positions, result), result
+
+
+def selfPlay(prefix, games, workers=None, nodes=DEFAULT_NODES, depth=ChessAI.DEPTH, seed=None,
+             window=None, log=sys.stderr):
+    """
+    Play games and append their positions to the shards of prefix; game i uses seed + i, so a
+    run is repeatable. At most window games (twice the workers by default) are in flight at once.
+    Returns ({result: games}, positions written).
+    """
+    workers = workers or os.cpu_count()
+    window = window or 2 * workers
+    seed = seed if seed is not None else random.getrandbits(32)
+    results = collections.Counter()
+    start = time.perf_counter()
+    pending = collections.deque()
+    if log:
+        log.write("seed %d\n" % seed)
+    with ShardWriter(prefix) as writer, ProcessPoolExecutor(workers) as pool:
+        def writeNext():
+            records, result = pending.popleft().result()
+            writer.write(records)
+            results[result] += 1
+            if log:
+                played = sum(results.values())
+                log.write("game %d: %d positions, result %+d (%d positions, %.0f per second)\n" % (
+                    played, len(records), result, writer.written, writer.written / (time.perf_counter() - start)))
+
+        for game in range(games):
+            pending.append(pool.submit(playGame, seed + game, nodes, depth))
+            while len(pending) >= window or (pending and pending[0].done()):
+                writeNext()
+        while pending:
+            writeNext()
+        written = writer.written
+    return results, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate labelled positions from engine self-play")
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--out', default='selfplay', help="shard prefix; shards are <out>-NNNN.bin")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES, help="search nodes per move (0 for no limit)")
+    parser.add_argument('--depth', type=int, default=ChessAI.DEPTH, help="maximum search depth")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the first game (random by default)")
+    args = parser.parse_args()
+
+    results, written = selfPlay(args.out, args.games, args.workers, args.nodes or None, args.depth, args.seed)
+    print("%d games (+%d =%d -%d), %d positions written to %s-NNNN.bin" % (
+        sum(results.values()), results[1], results[0], results[-1], written, args.out), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Hosts many human-vs-engine games over a line-based TCP protocol.
+Each connection is one session with its own GameState. Engine searches run in a shared,
+bounded process pool; sessions waiting for the engine are served first come, first served,
+and every search is capped by its session's time budget, so one slow game can't hold up the rest.
+Positions travel to the pool as GameState snapshots.
+
+    python ChessServer.py --port 8765 --workers 4 [--engine mcts]
+
+Protocol (one command per line, one or more reply lines):
+    NEW [white|black] [seconds]  start a game playing that color, engine thinks up to seconds per move
+    MOVE e2e4                    play a move; the engine's reply follows as ENGINE <move>
+    MOVES                        legal moves in the position
+    BOARD                        the board, ranks 8 to 1 separated by '/'
+    UNDO                         take back the last engine move and yours
+    QUIT                         close the session
+Replies are OK, ENGINE <move>, MOVES ..., BOARD ..., GAMEOVER <result>, ERROR <reason>, BYE.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import ChessEngine
+import ChessAI
+import ChessMCTS
+
+DEFAULT_TIME = 2.0  # Seconds per engine move when NEW doesn't say
+MAX_TIME = 10.0  # Upper bound on any session's time budget
+ENGINES = {'alphabeta': ChessAI, 'mcts': ChessMCTS}  # Modules offering findBestMoveTimed
+
+
+def searchWorker(snapshot, timeLimit, engine='alphabeta'):
+    """
+    Runs in a pool process: restore the position from its snapshot and return the engine's move code
+    """
+    gs = ChessEngine.GameState.fromSnapshot(snapshot)
+    validMoves = gs.getValidMoves()
+    with contextlib.redirect_stdout(io.StringIO()):  # ChessAI prints node counts
+        move = ENGINES[engine].findBestMoveTimed(gs, validMoves, timeLimit)
+    if move is None:
+        move = ChessAI.findRandomMove(validMoves)
+    return move.getCode()
+
+
+def newPool(workers):
+    # Spawned, not forked: a forked worker would inherit the open session sockets and keep
+    # them from closing when their sessions end
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class SearchScheduler():
+    """
+    Runs engine searches on a process pool, at most one per worker at a time, in request order
+    """
+
+    def __init__(self, workers, engine='alphabeta'):
+        self.engine = engine
+        self.workers = workers
+        self.pool = newPool(workers)
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(workers)]
+
+    async def search(self, snapshot, timeLimit):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((snapshot, timeLimit, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            snapshot, timeLimit, future = await self.queue.get()
+            if future.cancelled():  # Session went away while waiting
+                continue
+            pool = self.pool
+            try:
+                result = await loop.run_in_executor(pool, searchWorker, snapshot, timeLimit, self.engine)
+            except BrokenProcessPool as e:  # A worker died; later searches get a new pool
+                if self.pool is pool:
+                    pool.shutdown(wait=False)
+                    self.pool = newPool(self.workers)
+                if not future.cancelled():
+                    future.set_exception(e)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.pool.shutdown(cancel_futures=True)
+
+
+class Session():
+    """
+    One client's game
+    """
+    ids = itertools.count(1)
+
+    def __init__(self, scheduler, reader, writer):
+        self.id = next(Session.ids)
+        self.scheduler = scheduler
+        self.reader = reader
+        self.writer = writer
+        self.gs = None
+        self.validMoves = []
+        self.humanWhite = True
+        self.timeLimit = DEFAULT_TIME
+
+    def send(self, line):
+        self.writer.write((line + '\n').encode())
+
+    async def serve(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                words = line.decode(errors='replace').split()
+                if not words:
+                    continue
+                command = words[0].upper()
+                if command == 'QUIT':
+                    self.send('BYE')
+                    break
+                handler = getattr(self, 'command' + command.capitalize(), None)
+                if handler is None:
+                    self.send('ERROR unknown command ' + words[0])
+                else:
+                    try:
+                        await handler(words[1:])
+                    except ValueError as e:
+                        self.send('ERROR ' + str(e))
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writer.close()
+
+    def requireGame(self):
+        if self.gs is None:
+            raise ValueError("no game, send NEW first")
+
+    async def commandNew(self, args):
+        color = args[0].lower() if args else 'white'
+        if color not in ('white', 'black'):
+            raise ValueError("color must be white or black")
+        timeLimit = DEFAULT_TIME
+        if len(args) > 1:
+            try:
+                timeLimit = float(args[1])
+            except ValueError:
+                timeLimit = math.nan
+            if not math.isfinite(timeLimit) or timeLimit <= 0:
+                raise ValueError("seconds must be a positive number")
+        self.humanWhite = color == 'white'
+        self.timeLimit = min(timeLimit, MAX_TIME)
+        self.gs = ChessEngine.GameState()
+        self.validMoves = self.gs.getValidMoves()
+        self.send('OK %d' % self.id)
+        if not self.humanWhite:
+            await self.engineMove()
+
+    async def commandMove(self, args):
+        self.requireGame()
+        if self.gs.whiteToMove != self.humanWhite or self.gameOver():
+            raise ValueError("not your move")
+        if not args:
+            raise ValueError("MOVE needs a move like e2e4")
+        for move in self.validMoves:
+            if move.getChessNotation() == args[0].lower():
+                break
+        else:
+            raise ValueError("illegal move " + args[0])
+        self.play(move)
+        self.send('OK')
+        if not self.reportGameOver():
+            await self.engineMove()
+
+    async def commandMoves(self, args):
+        self.requireGame()
+        self.send(' '.join(['MOVES'] + [move.getChessNotation() for move in self.validMoves]))
+
+    async def commandBoard(self, args):
+        self.requireGame()
+        self.send('BOARD ' + '/'.join(' '.join(row) for row in self.gs.board))
+
+    async def commandUndo(self, args):
+        self.requireGame()
+        if self.gs.ply < 2:
+            raise ValueError("nothing to undo")
+        self.gs.undoMove()
+        if self.gs.whiteToMove != self.humanWhite:
+            self.gs.undoMove()
+        self.validMoves = self.gs.getValidMoves()
+        self.send('OK')
+
+    def play(self, move):
+        self.gs.makeMove(move)
+        self.validMoves = self.gs.getValidMoves()
+
+    def gameOver(self):
+        return self.gs.checkmate or self.gs.stalemate
+
+    def reportGameOver(self):
+        if self.gs.checkmate:
+            self.send('GAMEOVER ' + ('0-1' if self.gs.whiteToMove else '1-0'))
+        elif self.gs.stalemate:
+            self.send('GAMEOVER 1/2-1/2')
+        return self.gameOver()
+
+    async def engineMove(self):
+        await self.writer.drain()
+        # With the moves that led to the position, so an MCTS worker that searched this game's
+        # previous position can carry its tree over
+        try:
+            code = await self.scheduler.search(self.gs.snapshot(), self.timeLimit)
+        except Exception as e:  # The pool failed; say so and keep the game going with a random move
+            self.send('ERROR engine search failed: %s' % (e or type(e).__name__))
+            code = ChessAI.findRandomMove(self.validMoves).getCode()
+        move = ChessEngine.Move.fromCode(code, self.gs.board)
+        self.play(move)
+        self.send('ENGINE ' + move.getChessNotation())
+        self.reportGameOver()
+
+
+async def startServer(scheduler, host, port):
+    """
+    Listen for sessions on host:port (0 picks a free port); returns the asyncio server
+    """
+    async def connect(reader, writer):
+        await Session(scheduler, reader, writer).serve()
+
+    return await asyncio.start_server(connect, host, port)
+
+
+async def serve(host, port, workers, engine='alphabeta'):
+    scheduler = SearchScheduler(workers, engine)
+    server = await startServer(scheduler, host, port)
+    port = server.sockets[0].getsockname()[1]
+    print("Serving on %s:%d with %d %s search workers" % (host, port, workers, engine))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        scheduler.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play the engine over TCP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='alphabeta')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.engine))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
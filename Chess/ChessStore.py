@@ -0,0 +1,151 @@
+"""
+Compact binary store for finished games.
+
+A store is two append-only files:
+    <path>.games  magic, then per game a 4-byte header (result, flags, plies)
+                  followed by one little-endian uint16 move code per ply
+    <path>.index  one little-endian uint64 offset into .games per game
+Readers memory-map both, so any game is found with one index lookup.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+import ChessEngine
+
+MAGIC = b'CHESSGM1'
+GAME_HEADER = struct.Struct('<bBH')  # result, flags (unused), plies
+OFFSET = struct.Struct('<Q')
+
+# Game results, from white's point of view
+WHITE_WIN, DRAW, BLACK_WIN, UNKNOWN = 1, 0, -1, -2
+
+
+class GameStore():
+    """
+    Appends games to a store, creating it if needed
+    """
+
+    def __init__(self, path):
+        self.games = open(path + '.games', 'ab')
+        self.index = open(path + '.index', 'ab')
+        if self.games.tell() == 0:
+            self.games.write(MAGIC)
+
+    def append(self, codes, result=UNKNOWN):
+        """
+        Store a game given as its 16-bit move codes; returns the game number
+        """
+        offset = self.games.tell()
+        moves = array('H', codes)
+        if sys.byteorder == 'big':
+            moves.byteswap()
+        self.games.write(GAME_HEADER.pack(result, 0, len(moves)))
+        self.games.write(moves.tobytes())
+        self.index.write(OFFSET.pack(offset))
+        return self.index.tell() // OFFSET.size - 1
+
+    def appendGameState(self, gs, result=UNKNOWN):
+        return self.append(gs.getMoveCodes(), result)
+
+    def flush(self):
+        self.games.flush()
+        self.index.flush()
+
+    def close(self):
+        self.games.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GameStoreReader():
+    """
+    Random access to the games of a store through memory maps
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.gamesFile = open(path + '.games', 'rb')
+        self.indexFile = open(path + '.index', 'rb')
+        self.games = self.index = None
+        self.count = 0
+        self.refresh()
+        if self.games[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + " is not a game store")
+
+    def refresh(self):
+        """
+        Remap the files to see games appended since the reader was opened
+        """
+        self.closeMaps()
+        self.games = mmap.mmap(self.gamesFile.fileno(), 0, access=mmap.ACCESS_READ)
+        size = os.fstat(self.indexFile.fileno()).st_size
+        self.index = mmap.mmap(self.indexFile.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.count = size // OFFSET.size
+
+    def closeMaps(self):
+        for data in (self.games, self.index):
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def close(self):
+        self.closeMaps()
+        self.gamesFile.close()
+        self.indexFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def header(self, game):
+        """
+        (offset, result, plies) of a game
+        """
+        if not 0 <= game < self.count:
+            raise IndexError(game)
+        offset = OFFSET.unpack_from(self.index, game * OFFSET.size)[0]
+        result, _, plies = GAME_HEADER.unpack_from(self.games, offset)
+        return offset, result, plies
+
+    def result(self, game):
+        return self.header(game)[1]
+
+    def moveCodes(self, game):
+        """
+        The game's 16-bit move codes as an array
+        """
+        offset, _, plies = self.header(game)
+        start = offset + GAME_HEADER.size
+        moves = array('H')
+        moves.frombytes(self.games[start:start + 2 * plies])
+        if sys.byteorder == 'big':
+            moves.byteswap()
+        return moves
+
+    def gameState(self, game, ply=None):
+        """
+        GameState after the first ply moves of a game (all of them by default)
+        """
+        codes = self.moveCodes(game)
+        return replay(codes if ply is None else codes[:ply])
+
+
+def replay(codes, gs=None):
+    """
+    Play move codes from the start (or on gs) without generating legal moves
+    """
+    gs = gs if gs is not None else ChessEngine.GameState()
+    for code in codes:
+        gs.makeMove(ChessEngine.Move.fromCode(code, gs.board))
+    return gs
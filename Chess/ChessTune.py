@@ -0,0 +1,253 @@
+"""
+Texel tuning of ChessAI's material and piece-square weights.
+
+Reads labelled positions, one per line: a FEN or EPD followed somewhere on the line by the
+game result (1-0, 0-1, 1/2-1/2, or [1.0] / [0.5] / [0.0] from white's point of view).
+Each position becomes a feature row, so the evaluation is features @ weights, and the weights
+are fitted by gradient descent on the logistic loss between sigmoid(scale * score) and the result.
+Features are extracted once and cached next to the data as .npy files; later runs load them
+memory-mapped and go straight to the fit.
+
+    python ChessTune.py positions.epd --out ChessWeights.py
+
+The pawn structure term of ChessAI.scoreBoard is left out of the fit and keeps its constants.
+"""
+import argparse
+import os
+import re
+import time
+import numpy as np
+import ChessEngine
+import ChessAI
+import ChessBatch
+
+PIECE_TYPES = ['p', 'N', 'B', 'R', 'Q', 'K']  # Order of the material and piece-square blocks
+FEATURES = len(PIECE_TYPES) * (1 + ChessBatch.SQUARES)
+EXTRACT_BATCH = 65536  # Positions encoded at a time while extracting
+FIT_BATCH = 65536  # Feature rows converted to float at a time while fitting
+
+resultRegex = re.compile(r'(1-0|0-1|1/2-1/2)|\[\s*(1(?:\.0*)?|0(?:\.0*)?|0?\.50*)\s*\]')
+RESULT_VALUES = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}
+
+
+# ======================================================== Features ================================================================
+
+def parseLine(line):
+    """
+    (fen, result) of a labelled position, result 1 / 0.5 / 0 for a white win / draw / black win;
+    None if the line has no position or no result
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        return None
+    match = resultRegex.search(fields[4] if len(fields) > 4 else '')
+    if match is None:
+        return None
+    result = RESULT_VALUES[match.group(1)] if match.group(1) else float(match.group(2))
+    return ' '.join(fields[:4]) + ' 0 1', result
+
+
+def featuresFromSquares(squares):
+    """
+    (N, FEATURES) int8 features of an (N, 64) array of piece codes: per piece type the count of
+    white minus black pieces, then per piece type and square +1 for a white piece on it and -1
+    for a black piece on its mirror square. features @ weightVector() is the material plus
+    piece-square score from white's point of view.
+    """
+    n = squares.shape[0]
+    codes = squares.astype(np.intp)
+    table = np.zeros((n, 2, len(PIECE_TYPES) * ChessBatch.SQUARES), dtype=np.int8)
+    rows, sq = np.nonzero(codes)
+    piece = codes[rows, sq] - 1  # 0-5 white, 6-11 black, in ChessEngine.PIECES order
+    black = piece >= len(PIECE_TYPES)
+    pieceType = np.array([PIECE_TYPES.index(p[1]) for p in ChessEngine.PIECES[1:]])[piece]
+    sq = np.where(black, sq ^ 56, sq)  # Black reads the tables mirrored
+    table[rows, black.astype(np.intp), pieceType * ChessBatch.SQUARES + sq] = 1
+    positional = table[:, 0] - table[:, 1]
+    material = positional.reshape(n, len(PIECE_TYPES), ChessBatch.SQUARES).sum(axis=2, dtype=np.int8)
+    return np.concatenate([material, positional], axis=1)
+
+
+def extractFeatures(path):
+    """
+    (features, results, lines skipped) for every labelled position in the file
+    """
+    blocks = []
+    results = []
+    skipped = 0
+    batch = []
+    with open(path) as f:
+        for line in f:
+            parsed = parseLine(line)
+            if parsed is None:
+                skipped += line.strip() != ''
+                continue
+            try:
+                batch.append(ChessEngine.GameState.fromFen(parsed[0]))
+            except (ValueError, KeyError, IndexError):
+                skipped += 1
+                continue
+            results.append(parsed[1])
+            if len(batch) == EXTRACT_BATCH:
+                blocks.append(featuresFromSquares(ChessBatch.encodeSquares(batch)))
+                batch = []
+    if batch:
+        blocks.append(featuresFromSquares(ChessBatch.encodeSquares(batch)))
+    features = np.concatenate(blocks) if blocks else np.zeros((0, FEATURES), dtype=np.int8)
+    return features, np.array(results, dtype=np.float32), skipped
+
+
+def cachePaths(path):
+    return path + '.features.npy', path + '.results.npy'
+
+
+def loadFeatures(path, refresh=False):
+    """
+    (features, results) for the file, from the .npy cache when it is newer than the file
+    """
+    featuresPath, resultsPath = cachePaths(path)
+    fresh = all(os.path.exists(p) and os.path.getmtime(p) >= os.path.getmtime(path)
+                for p in (featuresPath, resultsPath))
+    if fresh and not refresh:
+        return np.load(featuresPath, mmap_mode='r'), np.load(resultsPath)
+    features, results, skipped = extractFeatures(path)
+    if skipped:
+        print("%d lines without a readable position and result were skipped" % skipped)
+    np.save(featuresPath, features)
+    np.save(resultsPath, results)
+    return features, results
+
+
+# ======================================================== Fitting =================================================================
+
+def weightVector():
+    """
+    ChessAI's current weights laid out like the features
+    """
+    material = [ChessAI.pieceScore[p] for p in PIECE_TYPES]
+    positional = [score for p in PIECE_TYPES for row in ChessAI.piecePositionScores[p] for score in row]
+    return np.array(material + positional, dtype=np.float64)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def scores(features, weights):
+    """
+    features @ weights, converting FIT_BATCH rows to float at a time so int8 features stay int8 in memory
+    """
+    out = np.empty(features.shape[0])
+    for start in range(0, features.shape[0], FIT_BATCH):
+        out[start:start + FIT_BATCH] = features[start:start + FIT_BATCH].astype(np.float64) @ weights
+    return out
+
+
+def logisticLoss(score, results, scale):
+    # Mean cross-entropy between sigmoid(scale * score) and the results, written with logaddexp to stay finite
+    z = scale * score
+    return float(np.mean(np.logaddexp(0, z) - results * z))
+
+
+def fitScale(features, results, weights):
+    """
+    The scale that best turns the current weights' scores into result probabilities, by golden-section search
+    """
+    score = scores(features, weights)
+    lo, hi = 0.01, 10.0
+    ratio = (5 ** 0.5 - 1) / 2
+    for _ in range(40):
+        a = hi - ratio * (hi - lo)
+        b = lo + ratio * (hi - lo)
+        if logisticLoss(score, results, a) < logisticLoss(score, results, b):
+            hi = b
+        else:
+            lo = a
+    return (lo + hi) / 2
+
+
+def gradient(features, results, weights, scale):
+    """
+    (loss, gradient of the loss with respect to the weights) over the whole dataset
+    """
+    grad = np.zeros_like(weights)
+    loss = 0.0
+    n = features.shape[0]
+    for start in range(0, n, FIT_BATCH):
+        x = features[start:start + FIT_BATCH].astype(np.float64)
+        y = results[start:start + FIT_BATCH]
+        z = scale * (x @ weights)
+        loss += float(np.sum(np.logaddexp(0, z) - y * z))
+        grad += x.T @ (sigmoid(z) - y)
+    return loss / n, grad * scale / n
+
+
+def tune(features, results, weights, scale, iterations=500, rate=0.01, report=50):
+    """
+    Full-batch gradient descent with Adam step sizes, so material (counts up to 8) and
+    piece-square weights (0 or 1 per square) move at comparable rates. Returns the fitted weights.
+    """
+    weights = weights.copy()
+    m = np.zeros_like(weights)
+    v = np.zeros_like(weights)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for t in range(1, iterations + 1):
+        loss, grad = gradient(features, results, weights, scale)
+        if report and (t == 1 or t % report == 0):
+            print("iteration %d  loss %.6f" % (t, loss))
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad * grad
+        weights -= rate * (m / (1 - beta1 ** t)) / (np.sqrt(v / (1 - beta2 ** t)) + eps)
+    weights[PIECE_TYPES.index('K')] = 0  # Both sides always have one king, so its material never matters
+    return weights
+
+
+# ======================================================== Output ==================================================================
+
+def writeWeights(weights, path, note=''):
+    """
+    Write the weights as a Python module defining pieceScore and piecePositionScores for ChessAI
+    """
+    lines = ['"""',
+             'Evaluation weights fitted by ChessTune.py%s.' % (' ' + note if note else ''),
+             'ChessAI uses these in place of its built-in tables while this module is importable.',
+             '"""', '', 'pieceScore = {']
+    lines += ['    "%s": %s,' % (p, round(float(weights[i]), 3) + 0.0) for i, p in enumerate(PIECE_TYPES)]
+    lines += ['}', '', 'piecePositionScores = {']
+    tables = weights[len(PIECE_TYPES):].reshape(len(PIECE_TYPES), 8, 8)
+    for p, table in zip(PIECE_TYPES, tables):
+        lines.append('    "%s": [' % p)
+        lines += ['        [%s],' % ', '.join(str(round(float(s), 3) + 0.0) for s in row) for row in table]
+        lines.append('    ],')
+    lines += ['}', '']
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit ChessAI's evaluation weights to labelled positions")
+    parser.add_argument('positions', help="FEN/EPD lines with game results")
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ChessWeights.py'))
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=0.01)
+    parser.add_argument('--scale', type=float, default=None, help="sigmoid scale; fitted to the start weights if omitted")
+    parser.add_argument('--refresh', action='store_true', help="re-extract features even if the cache is fresh")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    features, results = loadFeatures(args.positions, args.refresh)
+    print("%d positions loaded in %.1fs" % (features.shape[0], time.perf_counter() - start))
+    if not features.shape[0]:
+        return
+    weights = weightVector()
+    scale = args.scale if args.scale is not None else fitScale(features, results, weights)
+    print("scale %.4f, starting loss %.6f" % (scale, logisticLoss(scores(features, weights), results, scale)))
+    weights = tune(features, results, weights, scale, args.iterations, args.rate)
+    loss = logisticLoss(scores(features, weights), results, scale)
+    print("final loss %.6f" % loss)
+    writeWeights(weights, args.out, "from %d positions (loss %.6f, scale %.4f)" % (features.shape[0], loss, scale))
+    print("weights written to " + args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import io
+import ChessAnnotate
+import ChessPGN
+
+GAMES = """[White "a"]
+[Result "1-0"]
+
+1. e4 e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0
+
+[White "b"]
+[Result "*"]
+
+1. d4 d5 *
+"""
+
+
+def test_annotates_games_in_order(tmp_path):
+    pgnPath = tmp_path / 'games.pgn'
+    pgnPath.write_text(GAMES)
+    out = io.StringIO()
+    assert ChessAnnotate.annotate(str(pgnPath), out, workers=1, nodes=None, depth=2, log=None) == (2, 11)
+    text = out.getvalue()
+    assert text.index('[White "a"]') < text.index('[White "b"]')
+    assert 'Nf6??' in text and 'white mates' in text
+    # The output is still PGN whose main line is the original game
+    games = list(ChessPGN.readGames(io.BytesIO(text.encode())))
+    assert [g[1]['Annotator'] for g in games] == ['ChessAI', 'ChessAI']
+    assert [san.rstrip('?') for san in ChessPGN.sanTokens(games[0][2])] == \
+        ['e4', 'e5', 'Qh5', 'Nc6', 'Bc4', 'Nf6', 'Qxf7#']
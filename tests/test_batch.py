@@ -0,0 +1,29 @@
+import random
+import numpy as np
+import ChessEngine
+import ChessAI
+import ChessBatch
+
+
+def randomPositions(count, seed):
+    rng = random.Random(seed)
+    positions = []
+    gs = ChessEngine.GameState()
+    while len(positions) < count:
+        moves = gs.getValidMoves()
+        if not moves or gs.ply >= 100:
+            gs = ChessEngine.GameState()
+            continue
+        gs.makeMove(rng.choice(moves))
+        positions.append(ChessEngine.GameState.fromSnapshot(gs.snapshot(history=False)))
+    return positions
+
+
+def test_batch_scores_match_scalar():
+    positions = [gs for gs in randomPositions(200, 6) if not (gs.checkmate or gs.stalemate)]
+    expected = [ChessAI.scoreBoard(gs) - ChessAI.evaluatePawnStructure(gs.board) for gs in positions]
+    assert np.allclose(ChessBatch.scoreGameStates(positions, batchSize=64), expected)
+
+
+def test_attack_tables_match_scalar():
+    assert ChessBatch.verifyAgainstScalar(randomPositions(300, 7)) == []
@@ -0,0 +1,26 @@
+import pytest
+import ChessBench
+
+
+def report(p50, nps=None, depth=None, version=None):
+    result = {'p50': p50}
+    if nps is not None:
+        result['nps'] = nps
+    if depth is not None:
+        result['depth'] = depth
+    return {'version': version or ChessBench.BENCH_VERSION, 'results': {'search': result}}
+
+
+def test_summarize_in_microseconds():
+    stats = ChessBench.summarize([3000, 1000, 2000, 4000])
+    assert (stats['count'], stats['min'], stats['p50'], stats['mean']) == (4, 1.0, 3.0, 2.5)
+
+
+def test_compare_flags_slowdowns():
+    rows = ChessBench.compare(report(12.0, nps=800, depth=3), report(10.0, nps=1000, depth=3))
+    assert [(name, stat, regressed) for name, stat, _, _, _, regressed in rows] == \
+        [('search', 'p50', True), ('search', 'nps', True)]
+    assert not any(row[5] for row in ChessBench.compare(report(10.5), report(10.0)))
+    assert ChessBench.compare(report(20.0, depth=4), report(10.0, depth=3)) == []
+    with pytest.raises(ValueError):
+        ChessBench.compare(report(10.0), report(10.0, version=-1))
@@ -0,0 +1,81 @@
+import sqlite3
+import ChessCache
+import ChessEngine
+
+
+def rows(path):
+    connection = sqlite3.connect(path)
+    try:
+        return {h & ChessEngine.HASH_MASK: (depth, score, used)
+                for h, depth, score, used in connection.execute('SELECT hash, depth, score, used FROM analysis')}
+    finally:
+        connection.close()
+
+
+def session(path, **kwargs):
+    return ChessCache.AnalysisCache(str(path), **kwargs)
+
+
+def test_upsert_keeps_the_deeper_result(tmp_path, monkeypatch):
+    path = tmp_path / 'analysis.db'
+    big = (1 << 63) + 5  # Stored as a negative integer
+    monkeypatch.setattr(ChessCache.time, 'time', lambda: 100)
+    with session(path) as cache:
+        cache.record({1: (3, 0.5, 0, 10), big: (2, -1.0, 1, 11)})
+    monkeypatch.setattr(ChessCache.time, 'time', lambda: 200)
+    with session(path) as cache:
+        cache.record({1: (2, 9.0, 0, 12), big: (4, 2.0, 0, 13)})
+    stored = rows(str(path))
+    assert stored[1] == (3, 0.5, 200)  # Shallower result ignored, entry still counts as used
+    assert stored[big] == (4, 2.0, 200)
+    table = {}
+    with session(path) as cache:
+        assert cache.load(table) == 2
+    assert table == {1: (3, 0.5, 0, 10), big: (4, 2.0, 0, 13)}
+
+
+def test_probed_entries_survive_eviction(tmp_path, monkeypatch):
+    path = tmp_path / 'analysis.db'
+    monkeypatch.setattr(ChessCache.time, 'time', lambda: 100)
+    with session(path) as cache:
+        cache.record({h: (2, 0.0, 0, 0) for h in range(1, 11)})
+    # A later session reads two of the entries without changing them
+    table = ChessCache.ProbedTable()
+    monkeypatch.setattr(ChessCache.time, 'time', lambda: 200)
+    with session(path) as cache:
+        cache.load(table)
+        table.get(3)
+        table.get(7)
+        table.get(99)
+        assert cache.record(table) == 0
+    assert {h for h, (_, _, used) in rows(str(path)).items() if used == 200} == {3, 7}
+    # New entries push the file over maxEntries: the least recently used go first
+    monkeypatch.setattr(ChessCache.time, 'time', lambda: 300)
+    with session(path, maxEntries=10) as cache:
+        cache.record({h: (1, 0.0, 0, 0) for h in range(100, 104)})
+    stored = rows(str(path))
+    assert len(stored) == 9
+    assert {3, 7, 100, 101, 102, 103} <= set(stored)
+
+
+def test_attached_table_reads_entries_on_demand(tmp_path, monkeypatch):
+    path = tmp_path / 'analysis.db'
+    monkeypatch.setattr(ChessCache.time, 'time', lambda: 100)
+    with session(path) as cache:
+        cache.record({h: (2, float(h), 0, h) for h in range(1, 1001)})
+    table = ChessCache.ProbedTable()
+    monkeypatch.setattr(ChessCache.time, 'time', lambda: 200)
+    with session(path) as cache:
+        cache.attach(table)
+        assert len(table) == 0  # Nothing read up front
+        assert table.get(5) == (2, 5.0, 0, 5)
+        assert table.get(2000) is None
+        assert table.get(2000, 'none') == 'none'
+        assert set(table) == {5} and table.missing == {2000}
+        table[6] = (1, 1.0, 0, 7)  # Searched here, shallower than the stored entry it never read
+        table[5] = (4, 2.0, 0, 9)
+        assert cache.record(table) == 2
+    assert table.cache is None
+    stored = rows(str(path))
+    assert stored[5] == (4, 2.0, 200) and stored[6] == (2, 6.0, 200)
+    assert {h for h, (_, _, used) in stored.items() if used == 200} == {5, 6}
@@ -0,0 +1,152 @@
+import random
+import pytest
+import ChessEngine
+
+
+def playRandom(gs, plies, seed):
+    rng = random.Random(seed)
+    for _ in range(plies):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        gs.makeMove(rng.choice(moves))
+
+
+def test_undo_restores_position():
+    gs = ChessEngine.GameState()
+    start = (gs.getFen(), gs.hash, gs.pawnHash)
+    playRandom(gs, 60, 1)
+    while gs.ply:
+        gs.undoMove()
+    assert (gs.getFen(), gs.hash, gs.pawnHash) == start
+
+
+def test_last_move_and_read_only_log():
+    gs = ChessEngine.GameState()
+    assert gs.lastMove() is None
+    move = next(m for m in gs.getValidMoves() if m.getChessNotation() == 'e2e4')
+    gs.makeMove(move)
+    assert gs.lastMove() == move
+    assert [m.getChessNotation() for m in gs.moveLog] == ['e2e4']
+    with pytest.raises(AttributeError):
+        gs.moveLog.append(move)
+    with pytest.raises(TypeError):
+        del gs.moveLog[-1]
+
+
+def test_move_cache_matches_generation():
+    cached = ChessEngine.GameState()
+    cached.enableMoveCache(16)
+    plain = ChessEngine.GameState()
+    rng = random.Random(2)
+    for _ in range(80):
+        moves = plain.getValidMoves()
+        cachedMoves = cached.getValidMoves()
+        assert sorted(m.getCode() for m in cachedMoves) == sorted(m.getCode() for m in moves)
+        assert (cached.checkmate, cached.stalemate) == (plain.checkmate, plain.stalemate)
+        if not moves:
+            break
+        move = rng.choice(moves)
+        plain.makeMove(move)
+        cached.makeMove(move)
+        if rng.random() < 0.3:  # Step back so cached positions come up again
+            plain.undoMove()
+            cached.undoMove()
+    assert len(cached.moveCache) <= 16 and cached.moveCache.hits
+
+
+def perft(gs, depth):
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+@pytest.mark.parametrize('fen, depth, nodes', [
+    (None, 3, 8902),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', 2, 2039),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', 3, 97862),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', 4, 43238),  # En passant along a rank with a pin
+])
+def test_perft(fen, depth, nodes):
+    gs = ChessEngine.GameState() if fen is None else ChessEngine.GameState.fromFen(fen)
+    assert perft(gs, depth) == nodes
+
+
+@pytest.mark.parametrize('fen, pawnMoves', [
+    ('8/8/4K3/8/4P3/8/8/k3r3 w - - 0 1', ['e4e5']),  # Pinned from behind, king ahead on the file
+    ('k3R3/8/8/4p3/8/4k3/8/K7 b - - 0 1', ['e5e4']),
+    ('8/8/8/K1pP2rB/8/8/8/7k w - c6 0 1', ['d5d6']),  # En passant would expose the king to the rook
+    ('8/8/8/K1pP2Rr/8/8/8/7k w - c6 0 1', ['d5c6', 'd5d6']),  # A piece behind the rook shields
+])
+def test_pawn_pins(fen, pawnMoves):
+    gs = ChessEngine.GameState.fromFen(fen)
+    assert sorted(m.getChessNotation() for m in gs.getValidMoves() if m.pieceMoved[1] == 'p') == pawnMoves
+
+
+@pytest.mark.parametrize('fen', [
+    'rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3',  # Checkmate
+    '7k/5Q2/6K1/8/8/8/8/8 b - - 0 1',  # Stalemate
+    '4k3/8/8/8/8/5n2/8/R3K2r w Q - 0 1',  # Double check
+])
+def test_game_over_probe_matches_generation(fen):
+    gs = ChessEngine.GameState.fromFen(fen)
+    gs.updateGameOver()
+    probed = (gs.checkmate, gs.stalemate, gs.inCheck)
+    gs.getValidMoves()
+    assert probed == (gs.checkmate, gs.stalemate, gs.inCheck)
+
+
+def test_game_over_probe_in_random_games():
+    rng = random.Random(3)
+    for _ in range(20):
+        gs = ChessEngine.GameState()
+        for _ in range(120):
+            gs.updateGameOver()
+            probed = (gs.checkmate, gs.stalemate, gs.inCheck)
+            moves = gs.getValidMoves()
+            assert probed == (gs.checkmate, gs.stalemate, gs.inCheck)
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+
+
+def test_snapshot_restores_position_and_history():
+    import pickle
+    gs = ChessEngine.GameState()
+    playRandom(gs, 50, 4)
+    for copy in (ChessEngine.GameState.fromSnapshot(gs.snapshot()), pickle.loads(pickle.dumps(gs))):
+        assert (copy.getFen(), copy.hash, copy.pawnHash, copy.ply) == (gs.getFen(), gs.hash, gs.pawnHash, gs.ply)
+        assert copy.getMoveCodes() == gs.getMoveCodes()
+        assert sorted(m.getCode() for m in copy.getValidMoves()) == sorted(m.getCode() for m in gs.getValidMoves())
+        while copy.ply:
+            copy.undoMove()
+        assert copy.getFen() == ChessEngine.GameState().getFen()
+    bare = ChessEngine.GameState.fromSnapshot(gs.snapshot(history=False))
+    # Without history the fullmove number starts over; everything else survives
+    assert (bare.getFen().split()[:5], bare.hash, bare.ply) == (gs.getFen().split()[:5], gs.hash, 0)
+
+
+def test_incremental_move_lists_match_generation():
+    rng = random.Random(5)
+    incremental = ChessEngine.GameState()
+    incremental.enableIncrementalMoves()
+    plain = ChessEngine.GameState()
+    for _ in range(400):
+        moves = plain.getValidMoves()
+        assert sorted(m.getCode() for m in incremental.getValidMoves()) == sorted(m.getCode() for m in moves)
+        assert incremental.validatePieceMoves() == []
+        if not moves or rng.random() < 0.25:
+            if not plain.ply:
+                continue
+            plain.undoMove()
+            incremental.undoMove()
+        else:
+            move = rng.choice(moves)
+            plain.makeMove(move)
+            incremental.makeMove(move)
@@ -0,0 +1,57 @@
+import contextlib
+import io
+import random
+import ChessEngine
+import ChessAI
+
+
+def test_pawn_hash_and_table_agree_with_fresh_evaluation():
+    rng = random.Random(8)
+    gs = ChessEngine.GameState()
+    table = ChessAI.PawnHashTable(64)  # Small, so slots get replaced
+    for _ in range(300):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        gs.makeMove(rng.choice(moves))
+        assert gs.pawnHash == ChessEngine.GameState.fromFen(gs.getFen()).pawnHash
+        score = table.probe(gs.pawnHash)
+        if score is None:
+            score = ChessAI.evaluatePawnStructure(gs.board)
+            table.store(gs.pawnHash, score)
+        assert score == ChessAI.evaluatePawnStructure(gs.board)
+    assert table.hits
+
+
+def test_pawn_structure_terms():
+    # White: doubled, isolated and passed c-pawns. Black: an isolated passed pawn on a3 and two
+    # connected pawns still on their starting squares
+    board = ChessEngine.GameState.fromFen('4k3/5pp1/8/8/2P5/p1P5/8/4K3 w - - 0 1').board
+    white = ChessAI.DOUBLED_PAWN + 2 * ChessAI.ISOLATED_PAWN + ChessAI.PASSED_PAWN[2] + ChessAI.PASSED_PAWN[1]
+    black = ChessAI.ISOLATED_PAWN + ChessAI.PASSED_PAWN[4] + 2 * ChessAI.PASSED_PAWN[0]
+    expected = white - black
+    assert abs(ChessAI.evaluatePawnStructure(board) - expected) < 1e-9
+
+
+def test_multipv_lines():
+    gs = ChessEngine.GameState.fromFen('6k1/5ppp/8/8/8/8/1q3PPP/3R2K1 w - - 0 1')
+    fen = gs.getFen()
+    lines = ChessAI.findBestMovesMultiPV(gs, gs.getValidMoves(), 3, 2)
+    assert gs.getFen() == fen
+    assert len(lines) == 3
+    scores = [score for score, _ in lines]
+    assert scores == sorted(scores, reverse=True)
+    assert len({pv[0].getCode() for _, pv in lines}) == 3
+    assert lines[0][1][0].getChessNotation() == 'd1d8' and scores[0] >= ChessAI.CHECKMATE
+    # The exact scores of the other lines agree with a full search of the move alone
+    for score, pv in lines[1:]:
+        assert ChessAI.findBestMovesMultiPV(gs, [pv[0]], 1, 2)[0][0] == score
+
+
+def test_timed_search_keeps_a_move_when_every_move_loses():
+    # Black's only moves are pawn moves, each allowing Qb7#: depth 2 finds no move better than mate
+    gs = ChessEngine.GameState.fromFen('k7/7p/1Q6/8/8/8/8/1R5K b - - 0 1')
+    validMoves = gs.getValidMoves()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert ChessAI.findBestMoveNegaMaxAlphaBeta(gs, list(validMoves), 2) is None
+        assert ChessAI.findBestMoveTimed(gs, validMoves, 10, maxDepth=2) in validMoves
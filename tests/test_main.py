@@ -0,0 +1,57 @@
+import os
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+pygame = pytest.importorskip('pygame')
+import ChessEngine
+import ChessMain
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    monkeypatch.chdir(os.path.dirname(ChessMain.__file__))  # Images load from images/
+    pygame.init()
+    screen = pygame.display.set_mode((ChessMain.WIDTH, ChessMain.HEIGHT))
+    ChessMain.load_images()
+    yield ChessMain.BoardRenderer(screen)
+    pygame.quit()
+
+
+def test_expose_repaints_whole_board(renderer):
+    gs = ChessEngine.GameState()
+    validMoves = gs.getValidMoves()
+    assert len(renderer.drawGameState(gs, validMoves, ())) == 64
+    assert renderer.drawGameState(gs, validMoves, ()) == []
+    assert pygame.WINDOWEXPOSED in ChessMain.REDRAW_EVENTS
+    renderer.invalidate()
+    assert len(renderer.drawGameState(gs, validMoves, ())) == 64
+
+
+def dieWithoutMove(returnQueue):
+    os._exit(1)
+
+
+def answer(returnQueue, code):
+    returnQueue.put(code)
+
+
+def test_dead_ai_process_gets_random_move():
+    from multiprocessing import Process, Queue
+    gs = ChessEngine.GameState()
+    validMoves = gs.getValidMoves()
+    returnQueue = Queue()
+    process = Process(target=dieWithoutMove, args=(returnQueue,))
+    process.start()
+    process.join()
+    move = ChessMain.takeAIMove(process, returnQueue, validMoves)
+    assert move in validMoves
+    assert process.exitcode == 1
+
+
+def test_ai_move_taken_from_queue():
+    from multiprocessing import Process, Queue
+    returnQueue = Queue()
+    process = Process(target=answer, args=(returnQueue, 'move'))
+    process.start()
+    process.join()
+    assert ChessMain.takeAIMove(process, returnQueue, []) == 'move'
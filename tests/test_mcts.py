@@ -0,0 +1,58 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+import ChessMCTS
+
+
+def test_tree_rerooted_two_plies_on():
+    engine = ChessMCTS.MCTS()
+    gs = ChessEngine.GameState()
+    engine.search(gs, 400)
+    tree = engine.tree
+    stats = engine.rootStatistics()
+    first = max(tree.children(0), key=tree.visits.__getitem__)
+    reply = max(tree.children(first), key=tree.visits.__getitem__)
+    for node in (first, reply):
+        gs.makeMove(ChessEngine.Move.fromCode(tree.move[node], gs.board))
+    kept = tree.visits[reply]
+    assert kept > 0 and len(stats) == 20
+    engine.prepare(gs)
+    assert engine.tree.visits[0] == kept
+    assert engine.tree.whiteMoved[0] == 0  # Black made the move into the new root
+
+
+def test_search_root_counts_only_its_own_iterations():
+    gs = ChessEngine.GameState()
+    snapshot = gs.snapshot()
+    ChessMCTS.engine.tree = None
+    first = ChessMCTS.searchRoot(snapshot, 200, None, 1)
+    second = ChessMCTS.searchRoot(snapshot, 200, None, 2)
+    assert ChessMCTS.engine.tree.visits[0] == 400  # The tree was kept
+    assert sum(visits for visits, _ in first.values()) == 200
+    assert sum(visits for visits, _ in second.values()) == 200
+
+
+def test_pool_total_visits_match_the_budget():
+    gs = ChessEngine.GameState()
+    with ProcessPoolExecutor(1) as pool:  # One worker takes every task, growing one tree
+        for _ in range(2):
+            merged = ChessMCTS.mergeRoots(ChessMCTS.submitRoots(pool, gs, 150, None, 3))
+            assert sum(visits for visits, _ in merged.values()) == 450
+
+
+def test_parallel_search_polls_for_move():
+    gs = ChessEngine.GameState()
+    validMoves = gs.getValidMoves()
+    search = ChessMCTS.ParallelSearch(2, 100)
+    try:
+        assert search.takeMove() is None
+        search.start(gs, validMoves)
+        deadline = time.time() + 30
+        move = None
+        while move is None and time.time() < deadline:
+            move = search.takeMove()
+            time.sleep(0.01)
+        assert move in validMoves
+        assert search.takeMove() is None
+    finally:
+        search.close()
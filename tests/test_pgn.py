@@ -0,0 +1,107 @@
+import io
+import random
+import ChessEngine
+import ChessPGN
+
+GAMES = """[Event "a"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 1-0
+
+[Event "b"]
+[Result "0-1"]
+
+1. Nf3 e5 2. e4 0-1
+
+[Event "c"]
+[Result "1/2-1/2"]
+
+1. e4 e5 2. Nf3 Nc6 1/2-1/2
+"""
+
+
+def play(sanMoves):
+    gs = ChessEngine.GameState()
+    for _ in ChessPGN.replaySan(sanMoves, gs):
+        pass
+    return gs
+
+
+def test_index_finds_transpositions(tmp_path):
+    pgnPath = tmp_path / 'games.pgn'
+    pgnPath.write_text(GAMES)
+    indexPath = str(tmp_path / 'games.idx')
+    assert ChessPGN.buildIndex(str(pgnPath), indexPath, workers=1) == (3, 0)
+    gs = play(['e4', 'e5', 'Nf3'])
+    with ChessPGN.PositionIndex(indexPath) as index:
+        games = index.games(gs)
+    assert len(games) == 3
+    assert sorted(ply for _, ply, _ in games) == [3, 3, 3]
+
+
+def manyGames(count, seed):
+    rng = random.Random(seed)
+    games = []
+    for number in range(count):
+        gs = ChessEngine.GameState()
+        sans = []
+        for _ in range(rng.randint(2, 30)):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            move = rng.choice(moves)
+            sans.append(ChessPGN.toSan(gs, move, moves))
+            gs.makeMove(move)
+        movetext = ' '.join(('%d. ' % (i // 2 + 1) if i % 2 == 0 else '') + san for i, san in enumerate(sans))
+        games.append('[Event "g%d"]\n[Site "x"]\n[Result "*"]\n\n%s *\n\n' % (number, movetext))
+    return ''.join(games)
+
+
+def test_game_starts_found_from_any_offset():
+    data = manyGames(12, 9).encode()
+    starts = [offset for offset, _, _ in ChessPGN.readGames(io.BytesIO(data))]
+    f = io.BytesIO(data)
+    for pos in range(len(data) + 1):
+        assert ChessPGN.nextGameStart(f, pos) == next((s for s in starts if s >= pos), len(data))
+
+
+def test_chunked_index_matches_single_chunk(tmp_path):
+    pgnPath = tmp_path / 'games.pgn'
+    text = manyGames(40, 10)
+    pgnPath.write_text(text)
+    onTagNewline = text.index('\n', text.index('[Event "g5"]'))  # A boundary on the newline ending a tag
+    single = str(tmp_path / 'single.idx')
+    assert ChessPGN.buildIndex(str(pgnPath), single, workers=1) == (40, 0)
+    for chunkBytes in (onTagNewline, 200, 333, 1000):
+        chunked = str(tmp_path / ('chunked%d.idx' % chunkBytes))
+        assert len(ChessPGN.findChunks(str(pgnPath), chunkBytes)) > 3
+        assert ChessPGN.buildIndex(str(pgnPath), chunked, workers=3, chunkBytes=chunkBytes) == (40, 0)
+        with open(single, 'rb') as a, open(chunked, 'rb') as b:
+            assert a.read() == b.read()
+    with ChessPGN.PositionIndex(single) as a, ChessPGN.PositionIndex(chunked) as b:
+        assert a.count == b.count
+        for i in range(0, a.count, 7):
+            h = a.hashAt(i)
+            assert a.lookup(h) == b.lookup(h) != []
+        assert b.lookup(ChessEngine.GameState().hash) == []  # The start position is never indexed
+
+
+def test_enpassant_hashed_only_when_capturable():
+    # 1.e4 leaves no black pawn able to take en passant: same hash as the FEN without the square
+    gs = play(['e4'])
+    assert gs.enpassantPossible
+    assert gs.hash == ChessEngine.GameState.fromFen(
+        'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1').hash
+    # With a black pawn on d4 the square matters
+    gs = ChessEngine.GameState.fromFen('4k3/8/8/8/3p4/8/4P3/4K3 w - - 0 1')
+    before = ChessEngine.GameState.fromFen('4k3/8/8/8/3pP3/8/8/4K3 b - - 0 1').hash
+    gs.makeMove(next(m for m in gs.getValidMoves() if m.getChessNotation() == 'e2e4'))
+    assert gs.hash != before and gs.hash == gs.computeHash()
+
+
+def test_san_round_trip():
+    gs = ChessEngine.GameState.fromFen('r3k2r/pppq1ppp/2npbn2/2b1p3/2B1P3/2NPBN2/PPPQ1PPP/R3K2R w KQkq - 0 9')
+    validMoves = gs.getValidMoves()
+    for move in validMoves:
+        san = ChessPGN.toSan(gs, move, validMoves)
+        assert ChessPGN.parseSan(gs, san, validMoves) == move
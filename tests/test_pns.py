@@ -0,0 +1,30 @@
+import pytest
+import ChessEngine
+import ChessPNS
+
+
+@pytest.mark.parametrize('fen, moves', [
+    ('6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1', 1),  # Back-rank mate
+    ('r5rk/5p1p/5R2/4B3/8/8/7P/7K w - - 0 1', 3),
+])
+def test_finds_forced_mates(fen, moves):
+    gs = ChessEngine.GameState.fromFen(fen)
+    result, line, nodes = ChessPNS.findMate(gs, moves)
+    assert result == ChessPNS.PROVEN
+    assert len(line) <= 2 * moves - 1 and len(line) % 2 == 1
+    assert gs.getFen() == fen  # Left unchanged
+    for move in line:
+        assert move in gs.getValidMoves()
+        gs.makeMove(move)
+    assert not gs.getValidMoves() and gs.checkmate
+
+
+def test_disproves_when_there_is_no_mate():
+    gs = ChessEngine.GameState.fromFen('4k3/8/8/8/8/8/8/R3K3 w - - 0 1')
+    result, line, _ = ChessPNS.findMate(gs, 1)
+    assert (result, line) == (ChessPNS.DISPROVEN, [])
+
+
+def test_reports_unknown_when_out_of_nodes():
+    gs = ChessEngine.GameState.fromFen('r5rk/5p1p/5R2/4B3/8/8/7P/7K w - - 0 1')
+    assert ChessPNS.findMate(gs, 3, maxNodes=50)[0] == ChessPNS.UNKNOWN
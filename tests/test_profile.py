@@ -0,0 +1,29 @@
+import pstats
+import ChessEngine
+import ChessAI
+import ChessProfile
+
+
+def test_profiled_call_writes_stats_and_stacks(tmp_path):
+    prefix = str(tmp_path / 'profile')
+    gs = ChessEngine.GameState()
+    lines = ChessProfile.profiledCall(prefix, ChessAI.findBestMovesMultiPV, gs, gs.getValidMoves(), 1, 2)
+    assert len(lines) == 1
+    stats = pstats.Stats(prefix + '.pstats')
+    assert any(name == 'findMovePV' for _, _, name in stats.stats)
+    with open(prefix + '.folded') as f:
+        stacks = [line.rsplit(' ', 1) for line in f.read().splitlines()]
+    assert any('findMovePV' in stack for stack, _ in stacks)
+    # Each function's own time is split over its paths, so the stacks add up to the total
+    total = sum(int(us) for _, us in stacks)
+    assert abs(total - stats.total_tt * 1e6) < 0.05 * stats.total_tt * 1e6 + len(stacks)
+
+
+def test_phase_timer_reports_every_phase():
+    timer = ChessProfile.PhaseTimer()
+    for _ in range(3):
+        timer.mark('events')
+        timer.mark('draw')
+    assert timer.counts == {'events': 3, 'draw': 3}
+    report = timer.report().splitlines()
+    assert len(report) == 3 and {line.split()[0] for line in report[1:]} == {'events', 'draw'}
@@ -0,0 +1,42 @@
+import numpy as np
+import ChessEngine
+import ChessSelfPlay
+
+
+def recordFen(record, squares):
+    rows = []
+    for r in range(8):
+        row, empty = '', 0
+        for code in squares[r * 8:r * 8 + 8]:
+            piece = ChessEngine.PIECES[code]
+            if piece == '--':
+                empty += 1
+                continue
+            letter = piece[1].upper() if piece[1] != 'p' else 'P'
+            row += (str(empty) if empty else '') + (letter if piece[0] == 'w' else letter.lower())
+            empty = 0
+        rows.append(row + (str(empty) if empty else ''))
+    flags = int(record['flags'])
+    castling = ''.join(c for c, bit in zip('KQkq', (1, 2, 4, 8)) if flags >> 1 & bit) or '-'
+    return '%s %s %s - %d 1' % ('/'.join(rows), 'w' if flags & 1 else 'b', castling, record['halfmove'])
+
+
+def test_kept_positions_are_not_in_check():
+    records, result = ChessSelfPlay.playGame(3, nodes=150, depth=2, maxPlies=60)
+    assert len(records) and result in (-1, 0, 1)
+    for record, squares in zip(records, ChessSelfPlay.unpackSquares(records)):
+        assert not ChessEngine.GameState.fromFen(recordFen(record, squares)).isInCheck()
+
+
+def test_shards_read_back_what_was_written(tmp_path):
+    prefix = str(tmp_path / 'selfplay')
+    records = ChessSelfPlay.makeRecords([
+        (ChessSelfPlay.packBoard(ChessEngine.GameState().board), 1 | 15 << 1, 0, i, 10 * i, i) for i in range(7)
+    ], 1)
+    with ChessSelfPlay.ShardWriter(prefix, shardRecords=3) as writer:
+        writer.write(records[:4])
+    with ChessSelfPlay.ShardWriter(prefix, shardRecords=3) as writer:  # Appends to the last shard
+        writer.write(records[4:])
+    paths = ChessSelfPlay.shardPaths(prefix)
+    assert len(paths) == 3
+    assert np.array_equal(np.concatenate([ChessSelfPlay.readShard(path) for path in paths]), records)
@@ -0,0 +1,81 @@
+import asyncio
+import ChessServer
+
+
+class Writer():
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.decode().splitlines())
+
+    async def drain(self):
+        pass
+
+
+class BrokenScheduler():
+    async def search(self, snapshot, timeLimit):
+        raise ChessServer.BrokenProcessPool("worker died")
+
+
+def run(commands, scheduler=None):
+    session = ChessServer.Session(scheduler or BrokenScheduler(), None, Writer())
+
+    async def play():
+        for command in commands:
+            words = command.split()
+            try:
+                await getattr(session, 'command' + words[0].capitalize())(words[1:])
+            except ValueError as e:
+                session.send('ERROR ' + str(e))
+
+    asyncio.run(play())
+    return session
+
+
+def test_new_rejects_bad_time():
+    for seconds in ('nan', 'inf', '-1', '0', 'soon'):
+        session = run(['NEW white ' + seconds])
+        assert session.writer.lines == ['ERROR seconds must be a positive number']
+        assert session.gs is None
+    session = run(['NEW white 30'])
+    assert session.writer.lines[0].startswith('OK')
+    assert session.timeLimit == ChessServer.MAX_TIME
+
+
+def test_failed_search_replies_with_error():
+    session = run(['NEW white', 'MOVE e2e4'])
+    lines = session.writer.lines
+    assert lines[1:3] == ['OK', 'ERROR engine search failed: worker died']
+    assert lines[3].startswith('ENGINE ')
+    assert session.gs.ply == 2 and session.gs.whiteToMove
+
+
+def test_loopback_game():
+    async def play():
+        scheduler = ChessServer.SearchScheduler(1)
+        server = await ChessServer.startServer(scheduler, '127.0.0.1', 0)
+        try:
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'NEW white 0.2\nMOVE e2e4\nMOVES\nQUIT\n')
+            await writer.drain()
+            lines = []
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 30)
+                if not line:
+                    break
+                lines.append(line.decode().rstrip('\n'))
+            writer.close()
+            return lines
+        finally:
+            server.close()
+            await server.wait_closed()
+            scheduler.close()
+
+    lines = asyncio.run(play())
+    assert lines[0].startswith('OK ') and lines[1] == 'OK'
+    reply = lines[2].split()
+    assert reply[0] == 'ENGINE' and reply[1][1] in '765'  # A black move from the 7th rank or a knight's jump
+    assert lines[3].startswith('MOVES ') and 'd2d4' in lines[3].split()
+    assert lines[4:] == ['BYE']
@@ -0,0 +1,36 @@
+import random
+import ChessEngine
+import ChessStore
+
+
+def randomGame(seed, plies):
+    rng = random.Random(seed)
+    gs = ChessEngine.GameState()
+    for _ in range(plies):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        gs.makeMove(rng.choice(moves))
+    return gs
+
+
+def test_games_read_back(tmp_path):
+    path = str(tmp_path / 'games')
+    games = [randomGame(seed, 40 + seed) for seed in range(5)]
+    with ChessStore.GameStore(path) as store:
+        for i, gs in enumerate(games[:3]):
+            assert store.appendGameState(gs, ChessStore.WHITE_WIN if i else ChessStore.DRAW) == i
+    with ChessStore.GameStore(path) as store:  # Appends to the existing store
+        for gs in games[3:]:
+            store.appendGameState(gs)
+        store.append([])
+    with ChessStore.GameStoreReader(path) as reader:
+        assert len(reader) == 6
+        assert [reader.result(i) for i in range(6)] == [ChessStore.DRAW] + [ChessStore.WHITE_WIN] * 2 + \
+            [ChessStore.UNKNOWN] * 3
+        for i, gs in enumerate(games):
+            assert list(reader.moveCodes(i)) == gs.getMoveCodes()
+            replayed = reader.gameState(i)
+            assert (replayed.getFen(), replayed.hash) == (gs.getFen(), gs.hash)
+        assert reader.gameState(5).ply == 0
+        assert reader.gameState(0, 10).getMoveCodes() == games[0].getMoveCodes()[:10]
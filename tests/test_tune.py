@@ -0,0 +1,42 @@
+import numpy as np
+import ChessEngine
+import ChessAI
+import ChessBatch
+import ChessTune
+
+FENS = [
+    'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1',
+    'r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/2N2N2/PPPP1PPP/R1BQK2R w KQkq - 6 5',
+    '4k3/5pp1/8/8/2P5/p1P5/8/4K3 w - - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+]
+
+
+def test_parse_line():
+    assert ChessTune.parseLine('8/8/8/8/8/8/8/K6k w - - c9 "1/2-1/2";') == ('8/8/8/8/8/8/8/K6k w - - 0 1', 0.5)
+    assert ChessTune.parseLine('8/8/8/8/8/8/8/K6k b - - [1.0]')[1] == 1.0
+    assert ChessTune.parseLine('8/8/8/8/8/8/8/K6k b - - 0-1')[1] == 0.0
+    assert ChessTune.parseLine('8/8/8/8/8/8/8/K6k b - -') is None
+
+
+def test_features_reproduce_the_evaluation():
+    positions = [ChessEngine.GameState.fromFen(fen) for fen in FENS]
+    features = ChessTune.featuresFromSquares(ChessBatch.encodeSquares(positions))
+    expected = [ChessAI.scoreBoard(gs) - ChessAI.evaluatePawnStructure(gs.board) for gs in positions]
+    assert np.allclose(ChessTune.scores(features, ChessTune.weightVector()), expected)
+
+
+def test_gradient_and_descent():
+    features = ChessTune.featuresFromSquares(ChessBatch.encodeSquares(
+        [ChessEngine.GameState.fromFen(fen) for fen in FENS]))
+    results = np.array([0.5, 0.5, 0.0, 1.0])
+    weights = ChessTune.weightVector()
+    loss, grad = ChessTune.gradient(features, results, weights, 0.5)
+    i = int(np.argmax(np.abs(grad)))
+    step = np.zeros_like(weights)
+    step[i] = 1e-6
+    numeric = (ChessTune.gradient(features, results, weights + step, 0.5)[0] -
+               ChessTune.gradient(features, results, weights - step, 0.5)[0]) / 2e-6
+    assert abs(numeric - grad[i]) < 1e-6 * max(1, abs(grad[i]))
+    tuned = ChessTune.tune(features, results, weights, 0.5, iterations=100, report=0)
+    assert ChessTune.gradient(features, results, tuned, 0.5)[0] < loss